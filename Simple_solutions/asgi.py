@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Simple_solutions.settings')
+# Настройки, зависящие от сервера: под ASGI Django не переиспользует постоянные соединения с базой
+os.environ.setdefault('SERVER_INTERFACE', 'asgi')
 
 application = get_asgi_application()
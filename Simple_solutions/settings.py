@@ -12,9 +12,10 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
-from config import load_config
+from config import load_database_config
 
-config = load_config(path=Path(__file__).resolve().parent / '.env')
+# Здесь читается только секретный ключ Django: конфигурации Stripe собираются при первом платеже
+database_config = load_database_config(path=Path(__file__).resolve().parent / '.env')
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -22,7 +23,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = config.db.django_secret_key
+SECRET_KEY = database_config.django_secret_key
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -42,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'simple_app.metrics.metrics_middleware',
+    # Сжатие HTML/JSON по Accept-Encoding; стоит выше всех, кто читает или меняет тело ответа
+    'simple_app.compression.HtmlJsonGZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +59,8 @@ ROOT_URLCONF = 'Simple_solutions.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендеринга для метрик
+        'BACKEND': 'simple_app.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +79,99 @@ WSGI_APPLICATION = 'Simple_solutions.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLITE_PROFILE=tuned - профиль для нескольких воркеров: WAL (читатели не ждут писателя),
+# synchronous=NORMAL, кэш страниц и mmap, ожидание блокировки до 20 с, транзакции BEGIN IMMEDIATE
+# и постоянные соединения; его включает gunicorn.conf.py. По умолчанию - plain, стандартные настройки
+# Django: режим WAL сохраняется в файле базы, и любая команда manage.py переводила бы в него db.sqlite3.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'plain')
+# asgi.py задает SERVER_INTERFACE=asgi. Под ASGI каждый запрос работает с базой в своем потоке
+# и открывает новое соединение, поэтому постоянные соединения там по умолчанию выключены
+# Неблокирующий httpx-клиент Stripe используется только под ASGI, где цикл событий живет весь срок воркера
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        # Тестовая база в файле: общая in-memory база SQLite блокирует таблицы без ожидания,
+        # и тесты с одновременными запросами из нескольких потоков падают
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+if SQLITE_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'ENGINE': 'Simple_solutions.sqlite',
+        'CONN_MAX_AGE': int(os.environ.get('SQLITE_CONN_MAX_AGE', 0 if SERVER_INTERFACE == 'asgi' else 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'cache_size': -20000,  # в КиБ, около 20 МБ
+                'mmap_size': 128 * 1024 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
+    })
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Для нескольких процессов укажите общий бэкенд, например
+# PAGE_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache PAGE_CACHE_LOCATION=/tmp/pages
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': os.environ.get('PAGE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('PAGE_CACHE_LOCATION', 'pages'),
+    },
+    'carts': {
+        'BACKEND': os.environ.get('CART_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CART_CACHE_LOCATION', 'carts'),
+    },
+    'items': {
+        'BACKEND': os.environ.get('ITEM_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('ITEM_CACHE_LOCATION', 'items'),
+    },
+}
+
+ITEM_PAGE_CACHE_ALIAS = 'pages'
+ITEM_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Кеш товаров: LRU процесса на LOCAL_SIZE товаров перед общим кешем 'items'.
+# LOCAL_TTL (секунды) ограничивает, сколько другой процесс видит прежнюю версию измененного товара.
+ITEM_CACHE = {
+    'ALIAS': 'items',
+    'TIMEOUT': int(os.environ.get('ITEM_CACHE_TIMEOUT', 60 * 60)),
+    'LOCAL_SIZE': int(os.environ.get('ITEM_CACHE_LOCAL_SIZE', 1024)),
+    'LOCAL_TTL': float(os.environ.get('ITEM_CACHE_LOCAL_TTL', 5)),
+}
+
+# Метрики (/simple_app/metrics/). При нескольких процессах нужен общий каталог METRICS_DIR
+# (gunicorn.conf.py задает его по умолчанию): каждый процесс сбрасывает туда свои метрики
+# не чаще раза в FLUSH_INTERVAL секунд.
+METRICS = {
+    'DIR': os.environ.get('METRICS_DIR'),
+    'FLUSH_INTERVAL': float(os.environ.get('METRICS_FLUSH_INTERVAL', 1)),
+}
+
+# Хранилище корзины: 'db' - заказ в базе с первого добавления товара;
+# 'session', 'cookie' или 'cache' - корзина у посетителя, заказ создается только при оформлении.
+# Для 'cache' при нескольких процессах нужен общий бэкенд кэша 'carts'.
+CART_STORE = {
+    'BACKEND': os.environ.get('CART_STORE', 'db'),
+    'CACHE_ALIAS': 'carts',
+    'COOKIE_NAME': 'cart',
+    'MAX_AGE': 60 * 60 * 24 * 14,
+    # Разных товаров в корзине вне базы; для cookie дополнительно проверяется размер (до 4 КБ)
+    'MAX_LINES': int(os.environ.get('CART_MAX_LINES', 100)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -116,6 +207,14 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 
+# collectstatic добавляет к именам хеш содержимого и сохраняет сжатые копии .gz/.br.
+# SERVE_STATIC - отдавать STATIC_ROOT из приложения (без nginx) с immutable-кешированием и Range.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'Simple_solutions.staticfiles.CompressedManifestStaticFilesStorage'},
+}
+SERVE_STATIC = os.environ.get('SERVE_STATIC', 'true').lower() in ('1', 'true', 'yes')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -127,7 +226,41 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
 }
-STRIPE_PUBLIC_KEY = config.stripe.publishable_key
-STRIPE_SECRET_KEY = config.stripe.secret_key
+# Пул клиентов Stripe (по одному на аккаунт валюты): таймауты в секундах, размер пула соединений.
+# STRIPE_API_BASE позволяет направить запросы на локальную заглушку Stripe.
+STRIPE_CLIENT = {
+    'API_BASE': os.environ.get('STRIPE_API_BASE'),
+    'CONNECT_TIMEOUT': float(os.environ.get('STRIPE_CONNECT_TIMEOUT', 5)),
+    'READ_TIMEOUT': float(os.environ.get('STRIPE_READ_TIMEOUT', 30)),
+    'POOL_SIZE': int(os.environ.get('STRIPE_POOL_SIZE', 10)),
+    # Повторы при сетевых ошибках, 429 и 5xx; POST без ключа идемпотентности получает случайный ключ
+    'MAX_RETRIES': int(os.environ.get('STRIPE_MAX_RETRIES', 2)),
+}
+
+# Вебхуки Stripe: секрет подписи - STRIPE_WEBHOOK_SECRET_<ВАЛЮТА> аккаунта; допустимый возраст подписи
+# в секундах и размер пачки, которую команда process_webhooks обрабатывает одной транзакцией.
+STRIPE_WEBHOOK = {
+    'TOLERANCE': int(os.environ.get('STRIPE_WEBHOOK_TOLERANCE', 300)),
+    'BATCH_SIZE': int(os.environ.get('STRIPE_WEBHOOK_BATCH_SIZE', 500)),
+}
+
+# Повторное использование PaymentIntent: статус записи, который вебхук или проверка в Stripe обновили
+# меньше STATUS_MAX_AGE секунд назад, считается актуальным и перед повторным использованием не сверяется.
+PAYMENT_INTENTS = {
+    'STATUS_MAX_AGE': int(os.environ.get('PAYMENT_INTENT_STATUS_MAX_AGE', 300)),
+}
+
+# Платежный шлюз: 'stripe' - Stripe API, 'fake' - детерминированная заглушка FakeStripe в памяти процесса
+# (без сети) с задержкой, разбросом, долей ошибок 500 и ограничением частоты (429).
+PAYMENT_GATEWAY = {
+    'BACKEND': os.environ.get('PAYMENT_GATEWAY', 'stripe'),
+    'FAKE': {
+        'LATENCY': float(os.environ.get('FAKE_STRIPE_LATENCY', 0)),
+        'JITTER': float(os.environ.get('FAKE_STRIPE_JITTER', 0)),
+        'ERROR_RATE': float(os.environ.get('FAKE_STRIPE_ERROR_RATE', 0)),
+        'RATE_LIMIT': int(os.environ.get('FAKE_STRIPE_RATE_LIMIT', 0)),
+        'SEED': int(os.environ.get('FAKE_STRIPE_SEED', 0)),
+    },
+}
 
 
@@ -0,0 +1,62 @@
+"""
+Бэкенд SQLite для нескольких воркеров.
+
+Опции в DATABASES['default']['OPTIONS'] сверх стандартных:
+- pragmas: PRAGMA, выполняемые на каждом новом соединении (journal_mode, synchronous, ...).
+  journal_mode=WAL сохраняется в файле базы, поэтому выполняется один раз на процесс;
+- transaction_mode: режим BEGIN для atomic(), например IMMEDIATE - транзакция сразу
+  берет блокировку на запись и ждет ее (timeout), а не падает с "database is locked"
+  при попытке повысить блокировку чтения до записи.
+"""
+import os
+import threading
+
+from django.db.backends.sqlite3 import base, creation
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+# Файлы баз, уже переведенные этим процессом в WAL
+_wal_databases = set()
+_wal_lock = threading.Lock()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        super()._destroy_test_db(test_database_name, verbosity)
+        # В режиме WAL рядом с базой остаются файлы -wal и -shm
+        if test_database_name and not self.is_in_memory_db(test_database_name):
+            with _wal_lock:
+                _wal_databases.discard(os.fspath(test_database_name))
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(f'{test_database_name}{suffix}'):
+                    os.remove(f'{test_database_name}{suffix}')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = dict(self.settings_dict['OPTIONS'].get('pragmas', {}))
+        if str(pragmas.get('journal_mode', '')).upper() == 'WAL' and not self.is_in_memory_db():
+            database = os.fspath(conn_params['database'])
+            with _wal_lock:
+                if database in _wal_databases:
+                    del pragmas['journal_mode']
+                else:
+                    _wal_databases.add(database)
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode', 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ValueError(f'Неизвестный режим транзакций SQLite: {mode}')
+        self.cursor().execute(f'BEGIN {mode}')
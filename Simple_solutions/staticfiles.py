@@ -0,0 +1,210 @@
+"""
+Статические файлы без nginx.
+
+CompressedManifestStaticFilesStorage при collectstatic добавляет к именам файлов хеш содержимого
+(манифест staticfiles.json) и рядом с каждым текстовым файлом сохраняет сжатые копии .gz и .br
+(brotli - если установлен пакет Brotli). Представление serve отдает файлы из STATIC_ROOT:
+выбирает сжатую копию по Accept-Encoding, ставит immutable-кеширование для имен с хешем,
+отвечает 304 на условные запросы и 206 на запросы диапазона (Range).
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - Brotli есть в requirements.txt; без него остается только gzip
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.md', '.ico')
+# Сжатие файлов меньше этого размера не окупает лишний запрос к диску
+MIN_COMPRESS_SIZE = 256
+# Сжатые копии по убыванию предпочтения: (Content-Encoding, расширение файла)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _compress(data):
+    compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(data, quality=11)
+    return compressed
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage, который после хеширования сжимает файлы в gzip и brotli.
+    Сжатая копия сохраняется, только если она меньше исходного файла.
+    """
+    # Файл, которого нет в манифесте (collectstatic не запускался), отдается по исходному имени
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = list(paths) + list(self.hashed_files.values())
+        for name in dict.fromkeys(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self._write_compressed(name)
+
+    def _write_compressed(self, name):
+        path = self.path(name)
+        if os.path.getsize(path) < MIN_COMPRESS_SIZE:
+            return
+        with open(path, 'rb') as file:
+            data = file.read()
+        for extension, content in _compress(data).items():
+            if len(content) < len(data):
+                with open(path + extension, 'wb') as file:
+                    file.write(content)
+
+
+@lru_cache(maxsize=1)
+def _hashed_names(manifest_mtime):
+    # Манифест перечитывается, когда collectstatic его обновил
+    hashed_files, _ = staticfiles_storage.load_manifest()
+    return frozenset(hashed_files.values())
+
+
+def _is_hashed(name):
+    """
+    Имя с хешем содержимого из манифеста: такой файл никогда не меняется и кешируется навсегда
+    """
+    if not hasattr(staticfiles_storage, 'load_manifest'):
+        return False
+    try:
+        mtime = os.stat(staticfiles_storage.path(staticfiles_storage.manifest_name)).st_mtime
+    except OSError:
+        return False
+    return name in _hashed_names(mtime)
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = [value.strip() for value in part.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def _select_file(request, path):
+    """
+    Путь к отдаваемому файлу и его Content-Encoding: сжатая копия, если клиент ее принимает
+    """
+    accepted = _accepted_encodings(request)
+    for encoding, extension in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + extension):
+            return path + extension, encoding
+    return path, None
+
+
+def _parse_range(match, size):
+    """
+    Диапазон из заголовка Range: (начало, конец включительно) или None, если диапазон невыполним
+    """
+    start, end = match.groups()
+    if not start:
+        # bytes=-N: последние N байт
+        length = int(end)
+        if not length:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve(request, path):
+    """
+    Отдает файл из STATIC_ROOT с учетом сжатия, кеширования, условных запросов и Range
+    """
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+
+    file_path, encoding = _select_file(request, full_path)
+    stat = os.stat(file_path)
+    etag = quote_etag(f'{int(stat.st_mtime)}-{stat.st_size}{"-" + encoding if encoding else ""}')
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if _is_hashed(name)
+                          else 'public, max-age=60, must-revalidate'),
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    byte_range = None
+    # Поддерживается один диапазон; несколько диапазонов и If-Range с другим ETag
+    # (у клиента старая версия) - отдаем файл целиком
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if match and any(match.groups()) and request.headers.get('If-Range', etag) == etag:
+        byte_range = _parse_range(match, stat.st_size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type, filename=posixpath.basename(name))
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(file_path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -14,11 +14,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 
-from Simple_solutions import settings
+from Simple_solutions import settings, staticfiles
 from simple_app import views
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -28,5 +27,7 @@ urlpatterns = [
     # здесь не должно быть других шаблонов URL, они должны быть включены в simple_app/urls.py
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+if settings.SERVE_STATIC:
+    urlpatterns += [
+        re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', staticfiles.serve, name='static'),
+    ]
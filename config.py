@@ -1,45 +1,197 @@
+import os
+import threading
 from dataclasses import dataclass
-from typing import Optional
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Union
 
-from environs import Env
+from dotenv import dotenv_values
 
+DEFAULT_CURRENCY = 'USD'
+CURRENCIES = ('USD', 'EUR')
 
-@dataclass
+
+@dataclass(frozen=True)
 class StripeConfig:
     secret_key: str
     publishable_key: str
+    # Секрет подписи вебхуков аккаунта (whsec_...), пустой - вебхуки не принимаются
+    webhook_secret: str = ''
 
 
-@dataclass
+@dataclass(frozen=True)
 class DatabaseConfig:
     django_secret_key: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class Config:
     db: DatabaseConfig
     stripe: StripeConfig
 
 
-def load_config(path: str, currency: Optional[str] = None) -> Config:
-    env = Env()
-    env.read_env(path)
+def _find_env_file(path: Union[str, Path]) -> Optional[Path]:
+    """
+    Ищет .env так же, как environs.Env.read_env: начиная с указанной директории и вверх по дереву
+    """
+    start_dir, env_name = os.path.split(os.fspath(path))
+    start_dir = Path(start_dir or os.getcwd()).resolve()
+    for directory in (start_dir, *start_dir.parents):
+        candidate = directory / env_name
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def _read_values(env_file: Optional[Path]) -> Dict[str, str]:
+    """
+    Значения из .env, переменные окружения процесса имеют приоритет (как при override=False)
+    """
+    values = {key: value for key, value in dotenv_values(env_file).items() if value is not None} if env_file else {}
+    values.update(os.environ)
+    return values
+
 
-    # Определите здесь вашу логику по выбору ключей для разных валют
-    stripe_config = StripeConfig(
-        secret_key=env('STRIPE_SECRET_KEY_USD'),
-        publishable_key=env('STRIPE_PUBLISHABLE_KEY_USD')
-    )
+def _require(values: Mapping[str, str], key: str) -> str:
+    try:
+        return values[key]
+    except KeyError:
+        # environs (и marshmallow) нужен только для этой ошибки: не загружаем его при старте
+        from environs import EnvError
+        raise EnvError(f'Environment variable "{key}" not set') from None
 
-    if currency == 'EUR':
-        stripe_config = StripeConfig(
-            secret_key=env('STRIPE_SECRET_KEY_EUR'),
-            publishable_key=env('STRIPE_PUBLISHABLE_KEY_EUR')
+
+def _build_database(values: Mapping[str, str]) -> DatabaseConfig:
+    return DatabaseConfig(django_secret_key=_require(values, 'DJANGO_SECRET_KEY'))
+
+
+def _build_configs(values: Mapping[str, str]) -> Mapping[str, Config]:
+    """
+    Собирает неизменяемый словарь конфигураций для валют, ключи которых заданы.
+    Ключи валюты по умолчанию обязательны.
+    """
+    db = _build_database(values)
+    configs = {}
+    for currency in CURRENCIES:
+        if currency != DEFAULT_CURRENCY and f'STRIPE_SECRET_KEY_{currency}' not in values:
+            continue
+        configs[currency] = Config(
+            db=db,
+            stripe=StripeConfig(
+                secret_key=_require(values, f'STRIPE_SECRET_KEY_{currency}'),
+                publishable_key=_require(values, f'STRIPE_PUBLISHABLE_KEY_{currency}'),
+                webhook_secret=values.get(f'STRIPE_WEBHOOK_SECRET_{currency}', ''),
+            )
         )
+    return MappingProxyType(configs)
+
+
+def _select(configs: Mapping[str, Config], currency: Optional[str]) -> Config:
+    config = configs.get(currency)
+    if config is not None:
+        return config
+    if currency in CURRENCIES:
+        # Валюта поддерживается, но ключи для нее не заданы
+        _require({}, f'STRIPE_SECRET_KEY_{currency}')
+    return configs[DEFAULT_CURRENCY]
+
+
+class ConfigRegistry:
+    """
+    Реестр конфигураций по валютам для одного .env файла.
+
+    Файл читается один раз на процесс и перечитывается только при изменении его mtime
+    или после явного вызова reload(). Поиск конфигурации по валюте - обращение к словарю.
+    Конфигурации Stripe собираются при первом обращении к ним: настройкам Django при старте
+    нужен только DatabaseConfig.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._values: Optional[Mapping[str, str]] = None
+        self._configs: Optional[Mapping[str, Config]] = None
+        self._database: Optional[DatabaseConfig] = None
+        self._env_file: Optional[Path] = None
+        self._mtime: Optional[float] = None
+
+    def _current_mtime(self) -> Optional[float]:
+        if self._env_file is None:
+            return None
+        try:
+            return os.stat(self._env_file).st_mtime
+        except OSError:
+            return None
+
+    def _current_values(self) -> Mapping[str, str]:
+        values = self._values
+        if values is None or self._current_mtime() != self._mtime:
+            with self._lock:
+                env_file = _find_env_file(self.path)
+                mtime = os.stat(env_file).st_mtime if env_file else None
+                values = _read_values(env_file)
+                self._configs, self._database = None, None
+                self._values, self._env_file, self._mtime = values, env_file, mtime
+        return values
+
+    def reload(self) -> Mapping[str, Config]:
+        self.invalidate()
+        values = self._current_values()
+        self._configs = _build_configs(values)
+        return self._configs
+
+    def invalidate(self) -> None:
+        self._values = None
+
+    def get(self, currency: Optional[str] = None) -> Config:
+        values = self._current_values()
+        configs = self._configs
+        if configs is None:
+            configs = self._configs = _build_configs(values)
+        return _select(configs, currency)
+
+    def database(self) -> DatabaseConfig:
+        """
+        Только DatabaseConfig: ключи Stripe для него не читаются и не проверяются
+        """
+        values = self._current_values()
+        database = self._database
+        if database is None:
+            database = self._database = _build_database(values)
+        return database
+
+
+_registries: Dict[str, ConfigRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path: Union[str, Path]) -> ConfigRegistry:
+    key = os.fspath(path)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(key, ConfigRegistry(path))
+    return registry
+
+
+def reload_config() -> None:
+    """
+    Явный сигнал на перечитывание: все реестры перечитают файлы при следующем обращении
+    """
+    for registry in list(_registries.values()):
+        registry.invalidate()
+
+
+def read_config(path: Union[str, Path], currency: Optional[str] = None) -> Config:
+    """
+    Читает конфигурацию с диска без кеша
+    """
+    return _select(_build_configs(_read_values(_find_env_file(path))), currency)
+
+
+def load_config(path: Union[str, Path], currency: Optional[str] = None) -> Config:
+    return get_registry(path).get(currency)
+
 
-    return Config(
-        db=DatabaseConfig(
-            django_secret_key=env('DJANGO_SECRET_KEY'),
-        ),
-        stripe=stripe_config
-    )
+def load_database_config(path: Union[str, Path]) -> DatabaseConfig:
+    return get_registry(path).database()
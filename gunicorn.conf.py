@@ -0,0 +1,72 @@
+"""
+Настройки gunicorn.
+
+preload_app: мастер один раз импортирует Django и приложение, воркеры получают их готовыми
+через fork (быстрее старт и масштабирование, общая память copy-on-write). Перед fork мастер
+закрывает соединения с базой и кешами, а воркер после fork сбрасывает клиенты Stripe и метрики,
+унаследованные от мастера.
+
+Метрики воркеров сводятся через общий каталог METRICS_DIR: мастер очищает его при старте,
+а метрики завершившегося воркера переносит в общий файл накопленных значений.
+"""
+import glob
+import os
+import sys
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# ASGI: async-представления оплаты не блокируют воркер во время запросов к Stripe
+worker_class = 'uvicorn.workers.UvicornWorker'
+wsgi_app = 'Simple_solutions.asgi:application'
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+# Задается до загрузки Django, чтобы settings.METRICS['DIR'] видели мастер и все воркеры
+metrics_dir = os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'simple_app_metrics'))
+# Несколько воркеров пишут в одну базу SQLite: профиль с WAL и ожиданием блокировки (см. settings.py)
+os.environ.setdefault('SQLITE_PROFILE', 'tuned')
+
+
+def _remove_metrics(pattern):
+    for path in glob.glob(os.path.join(metrics_dir, pattern)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def on_starting(server):
+    # Файлы воркеров прошлого запуска
+    _remove_metrics('*.json*')
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    # URLconf импортирует представления, DRF и шаблонные теги: загружаем их в мастере один раз
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def pre_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    # Сокеты, открытые в мастере, иначе оказались бы общими у всех воркеров
+    from django.core.cache import caches
+    from django.db import connections
+    connections.close_all()
+    caches.close_all()
+
+
+def post_fork(server, worker):
+    from simple_app import metrics
+    metrics.registry.reset()
+    # stripe SDK загружается лениво: если мастер его не загрузил, сбрасывать нечего
+    stripe_clients = sys.modules.get('simple_app.stripe_clients')
+    if stripe_clients is not None:
+        stripe_clients.reset_stripe_clients()
+
+
+def child_exit(server, worker):
+    # Метрики воркера переносятся в общий файл, а не теряются: суммарные счетчики не уменьшаются
+    from simple_app.metrics import retire_process
+    retire_process(metrics_dir, worker.pid)
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Item, Order, Discount, Tax
+from .models import Item, Order, Discount, Tax, PaymentIntentRecord, WebhookEvent
 
 admin.site.register(Item)
 admin.site.register(Order)
 admin.site.register(Discount)
-admin.site.register(Tax)
\ No newline at end of file
+admin.site.register(Tax)
+admin.site.register(PaymentIntentRecord)
+admin.site.register(WebhookEvent)
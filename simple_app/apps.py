@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class SimpleAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'simple_app'
+
+    def ready(self):
+        # Подключение обработчиков сигналов инвалидации кеша
+        from . import page_cache  # noqa: F401
+        from . import item_cache  # noqa: F401
+        # Скидки и налоги обновляют updated_at заказа - валидатор условного GET корзины
+        from . import cart  # noqa: F401
+        # Подключение учета запросов к базе для метрик
+        from . import metrics  # noqa: F401
@@ -0,0 +1,146 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Discount, Order, Tax
+from .money import DEFAULT_CURRENCY, Money
+from .pricing import CartAdjustment, CartLine, CartSummary, OrderTotals
+
+CART_SESSION_KEY = 'cart_id'
+# Состояние отсутствующей корзины: (id заказа, updated_at заказа, строки)
+EMPTY_CART_STATE = (None, None, ())
+
+
+def get_cart_order(request, create=False):
+    """
+    Незавершенный заказ (корзина) текущего посетителя: по cart_id из сессии,
+    а для вошедшего пользователя - его последний незавершенный заказ.
+    При create=True отсутствующая корзина создается и привязывается к сессии и пользователю.
+    """
+    user = request.user if getattr(request, 'user', None) and request.user.is_authenticated else None
+    order = None
+    cart_id = request.session.get(CART_SESSION_KEY)
+    if cart_id is not None:
+        order = Order.objects.filter(pk=cart_id, status='pending').first()
+    if order is None and user is not None:
+        order = Order.objects.filter(user=user, status='pending').order_by('-pk').first()
+    if order is None and create:
+        if request.session.session_key is None:
+            request.session.save()
+        order = Order.objects.create(status='pending', session_key=request.session.session_key, user=user)
+
+    if order is not None and request.session.get(CART_SESSION_KEY) != order.pk:
+        request.session[CART_SESSION_KEY] = order.pk
+    elif order is None and cart_id is not None:
+        del request.session[CART_SESSION_KEY]
+    return order
+
+
+def get_cart_state(request):
+    """
+    Состояние корзины для условного GET одним запросом, без загрузки заказа и расчета сводки:
+    (id заказа, updated_at заказа, строки (item_id, количество, updated_at товара)).
+    Скидки и налоги меняют updated_at своего заказа, поэтому отдельно не читаются.
+    """
+    columns = ('pk', 'updated_at', 'order_items__item_id', 'order_items__quantity', 'order_items__item__updated_at')
+    rows = []
+    cart_id = request.session.get(CART_SESSION_KEY)
+    if cart_id is not None:
+        rows = list(Order.objects.filter(pk=cart_id, status='pending').values_list(*columns))
+    user = request.user if getattr(request, 'user', None) and request.user.is_authenticated else None
+    if not rows and user is not None:
+        latest = Order.objects.filter(user=user, status='pending').order_by('-pk').values('pk')[:1]
+        rows = list(Order.objects.filter(pk__in=latest).values_list(*columns))
+    if not rows:
+        return EMPTY_CART_STATE
+    order_id, updated_at = rows[0][:2]
+    return order_id, updated_at, tuple(sorted(row[2:] for row in rows if row[2] is not None))
+
+
+def line_state(order_items):
+    """
+    Строки корзины для ее состояния по уже загруженным строкам с товарами
+    """
+    return tuple(sorted((order_item.item_id, order_item.quantity, order_item.item.updated_at)
+                        for order_item in order_items))
+
+
+@receiver([post_save, post_delete], sender=Discount, dispatch_uid='cart_discount_changed')
+@receiver([post_save, post_delete], sender=Tax, dispatch_uid='cart_tax_changed')
+def _adjustment_changed(sender, instance, **kwargs):
+    # Скидка или налог меняют суммы корзины: новое updated_at заказа сбрасывает ее ETag
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+
+def _order_items(order):
+    return order.order_items.select_related('item').order_by('pk')
+
+
+def build_cart_summary(order):
+    """
+    Загружает строки заказа вместе с товарами, скидки и налоги (по одному запросу на каждое)
+    и считает все суммы корзины в памяти. Для отсутствующей корзины возвращает пустую сводку.
+    """
+    if order is None:
+        return CartSummary(order_id=None, currency=DEFAULT_CURRENCY)
+    return _summarize(
+        order,
+        list(_order_items(order)),
+        list(order.discount_set.values_list('rate_bp', flat=True)),
+        list(order.tax_set.values_list('rate_bp', flat=True)),
+    )
+
+
+async def abuild_cart_summary(order):
+    """
+    Асинхронный вариант build_cart_summary для async-представлений
+    """
+    return _summarize(
+        order,
+        [order_item async for order_item in _order_items(order)],
+        [rate async for rate in order.discount_set.values_list('rate_bp', flat=True)],
+        [rate async for rate in order.tax_set.values_list('rate_bp', flat=True)],
+    )
+
+
+def _summarize(order, order_items, discount_rates, tax_rates):
+    summary = summarize_lines(order.pk, order_items, discount_rates, tax_rates)
+    order._totals = summary.totals
+    order._cart_state = (order.pk, order.updated_at, line_state(order_items))
+    return summary
+
+
+def summarize_lines(order_id, order_items, discount_rates=(), tax_rates=()):
+    """
+    Считает сводку корзины по строкам с уже загруженными товарами (order_items могут быть не сохранены).
+    Ставки скидок и налогов - в базисных пунктах.
+    """
+    # Валюта корзины определяется по первому товару
+    currency = order_items[0].item.currency if order_items else DEFAULT_CURRENCY
+    lines = tuple(
+        CartLine(
+            item_id=order_item.item_id,
+            name=order_item.item.name,
+            quantity=order_item.quantity,
+            unit_price=Money(order_item.item.price_minor, currency),
+            line_total=Money(order_item.item.price_minor * order_item.quantity, currency),
+            stripe_price=order_item.item.stripe_price,
+        )
+        for order_item in order_items
+    )
+
+    totals = OrderTotals(
+        subtotal=sum(line.line_total.amount for line in lines),
+        discount_rate=sum(discount_rates),
+        tax_rate=sum(tax_rates),
+    )
+    return CartSummary(
+        order_id=order_id,
+        currency=currency,
+        lines=lines,
+        discounts=tuple(CartAdjustment(rate, Money(amount, currency))
+                        for rate, amount in zip(discount_rates, totals.discount_amounts(discount_rates))),
+        taxes=tuple(CartAdjustment(rate, Money(amount, currency))
+                    for rate, amount in zip(tax_rates, totals.tax_amounts(tax_rates))),
+        totals=totals,
+    )
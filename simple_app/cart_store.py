@@ -0,0 +1,364 @@
+import json
+import secrets
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signing import get_cookie_signer
+from django.db import transaction
+from django.utils import timezone
+
+from .cart import EMPTY_CART_STATE, build_cart_summary, get_cart_order, get_cart_state, line_state, summarize_lines
+from .item_cache import get_items
+from .models import Order, OrderItem
+
+
+# Предел браузеров для cookie (имя и значение); cookie больше него молча отбрасывается
+MAX_COOKIE_SIZE = 4096
+COOKIE_SALT = 'simple_app.cart'
+
+
+class CartLimitError(Exception):
+    """
+    Корзина вне базы превысила допустимый размер; изменение не применяется
+    """
+
+
+def apply_operations(quantities, operations):
+    """
+    Применяет операции пакетного изменения к словарю {item_id: количество} и возвращает новый словарь
+    """
+    quantities = dict(quantities)
+    for operation in operations:
+        item_id, op, quantity = operation['item_id'], operation['op'], operation['quantity']
+        if op == 'add':
+            quantities[item_id] = quantities.get(item_id, 0) + quantity
+        elif op == 'set' and quantity > 0:
+            quantities[item_id] = quantity
+        else:
+            quantities.pop(item_id, None)
+    return quantities
+
+
+class DatabaseCartStore:
+    """
+    Корзина - незавершенный заказ в базе, строки пишутся сразу при добавлении товара
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._order = None
+        self._state = None
+
+    def get_order(self, create=False):
+        # Заказ загружается один раз за запрос
+        if self._order is None:
+            self._order = get_cart_order(self.request, create=create)
+        return self._order
+
+    def add(self, item, quantity):
+        self._state = None
+        order = self.get_order(create=True)
+        # Транзакция начинается с записи: SQLite сразу берет блокировку на запись
+        # и ждет ее, а не получает ошибку при попытке повысить блокировку чтения
+        with transaction.atomic():
+            OrderItem.objects.add_quantity(order, item, quantity)
+            order.apply_line_delta(item.price_minor * quantity)
+
+    def clear(self):
+        self._state = None
+        order = self.get_order()
+        if order is not None:
+            with transaction.atomic():
+                order.order_items.all().delete()
+                Order.objects.filter(pk=order.pk).update(total_minor=0, updated_at=timezone.now())
+
+    def apply(self, operations):
+        """
+        Применяет пакет операций одной транзакцией: строки создаются, меняются и удаляются
+        bulk-запросами, общая стоимость пересчитывается один раз. Возвращает сводку корзины.
+        """
+        self._state = None
+        order = self.get_order(create=True)
+        with transaction.atomic():
+            # Первым идет UPDATE заказа: он блокирует заказ от параллельных изменений до конца транзакции
+            Order.objects.filter(pk=order.pk).update(updated_at=timezone.now())
+            # Заказ загружен до блокировки: total_minor мог изменить параллельный запрос,
+            # а calculate_total_price сравнивает новый итог с ним и иначе не сохранил бы его
+            order.refresh_from_db(fields=['total_minor'])
+            existing = {order_item.item_id: order_item for order_item in order.order_items.all()}
+            quantities = apply_operations(
+                {item_id: order_item.quantity for item_id, order_item in existing.items()}, operations,
+            )
+
+            to_create, to_update = [], []
+            for item_id, quantity in quantities.items():
+                order_item = existing.get(item_id)
+                if order_item is None:
+                    to_create.append(OrderItem(order=order, item_id=item_id, quantity=quantity))
+                elif order_item.quantity != quantity:
+                    order_item.quantity = quantity
+                    to_update.append(order_item)
+            removed = [order_item.pk for item_id, order_item in existing.items() if item_id not in quantities]
+
+            if removed:
+                OrderItem.objects.filter(pk__in=removed).delete()
+            OrderItem.objects.bulk_update(to_update, ['quantity'])
+            OrderItem.objects.bulk_create(to_create)
+
+            cart = build_cart_summary(order)
+            order.calculate_total_price(totals=cart.totals)
+        return cart
+
+    def summary(self):
+        order = self.get_order()
+        cart = build_cart_summary(order)
+        self._state = order._cart_state if order is not None else EMPTY_CART_STATE
+        return cart
+
+    def state(self):
+        """
+        Состояние корзины для условного GET (см. get_cart_state); после summary() - без запросов
+        """
+        if self._state is None:
+            return get_cart_state(self.request)
+        return self._state
+
+    def materialize(self):
+        return self.get_order()
+
+    def commit(self, response):
+        return response
+
+
+_NOT_LOADED = object()
+
+
+class _ClientCartStore:
+    """
+    Корзина вне базы: строки (item_id, количество) и id уже созданного заказа
+    хранятся у посетителя. Order и OrderItem создаются только при оформлении заказа.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.modified = False
+        self._state = None
+        self._order = _NOT_LOADED
+        data = self.load() or {}
+        self.order_id = data.get('order_id')
+        self.lines = {int(item_id): quantity for item_id, quantity in data.get('lines', ())}
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, data, response):
+        raise NotImplementedError
+
+    def get_order(self):
+        if self.order_id is None:
+            return None
+        # Заказ загружается один раз за запрос
+        if self._order is _NOT_LOADED:
+            self._order = Order.objects.filter(pk=self.order_id, status='pending').first()
+        return self._order
+
+    def _drop_finished_order(self):
+        # Заказ оплачен или отменен: корзина оформлена и начинается заново, как в режиме db,
+        # иначе следующее оформление создало бы новый заказ с теми же строками
+        if self.order_id is not None and self.get_order() is None:
+            self.order_id, self.lines = None, {}
+            self.modified = True
+            self._state = None
+
+    def check(self, lines):
+        """
+        Проверяет, что корзина с такими строками помещается в хранилище, иначе CartLimitError
+        """
+        max_lines = settings.CART_STORE['MAX_LINES']
+        if len(lines) > max_lines:
+            raise CartLimitError(f'В корзине может быть не больше {max_lines} разных товаров')
+
+    def add(self, item, quantity):
+        self._drop_finished_order()
+        lines = {**self.lines, item.pk: self.lines.get(item.pk, 0) + quantity}
+        self.check(lines)
+        self.lines = lines
+        self.modified = True
+        self._state = None
+
+    def clear(self):
+        self.lines = {}
+        self.modified = True
+        self._state = None
+
+    def apply(self, operations):
+        self._drop_finished_order()
+        lines = apply_operations(self.lines, operations)
+        self.check(lines)
+        self.lines = lines
+        self.modified = True
+        return self.summary()
+
+    def summary(self):
+        self._drop_finished_order()
+        items = get_items(self.lines)
+        order_items = [
+            OrderItem(item=items[item_id], quantity=quantity)
+            for item_id, quantity in self.lines.items() if item_id in items
+        ]
+        self._state = (self.order_id, None, line_state(order_items))
+        return summarize_lines(self.order_id, order_items)
+
+    def state(self):
+        """
+        (id заказа, None, строки (item_id, количество, updated_at товара)) - строки хранятся
+        у посетителя, версии товаров берутся из кеша товаров. Времени изменения корзины нет:
+        после удаления строки оно не выросло бы, поэтому Last-Modified не отдается.
+        """
+        if self._state is not None:
+            return self._state
+        self._drop_finished_order()
+        items = get_items(self.lines)
+        lines = tuple(sorted(
+            (item_id, quantity, items[item_id].updated_at) for item_id, quantity in self.lines.items() if item_id in items
+        ))
+        return self.order_id, None, lines
+
+    def materialize(self):
+        """
+        Переносит корзину в базу одной транзакцией: создает заказ (или обновляет созданный
+        при прошлой попытке оплаты) и все его строки через bulk_create
+        """
+        self._drop_finished_order()
+        items = get_items(self.lines)
+        if not items:
+            return None
+        with transaction.atomic():
+            order = self.get_order()
+            if order is None:
+                user = getattr(self.request, 'user', None)
+                order = Order.objects.create(
+                    status='pending',
+                    session_key=self.request.session.session_key or '',
+                    user=user if user is not None and user.is_authenticated else None,
+                )
+            else:
+                order.order_items.all().delete()
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, item=items[item_id], quantity=quantity)
+                for item_id, quantity in self.lines.items() if item_id in items
+            ])
+            order.calculate_total_price()
+        self._order = order
+        if order.pk != self.order_id:
+            self.order_id = order.pk
+            self.modified = True
+            self._state = None
+        return order
+
+    def commit(self, response):
+        """
+        Сохраняет измененную корзину; вызывается представлением перед возвратом ответа
+        """
+        if self.modified:
+            self.save(self.data(self.lines), response)
+            self.modified = False
+        return response
+
+    def data(self, lines):
+        return {'order_id': self.order_id, 'lines': list(lines.items())}
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+class SessionCartStore(_ClientCartStore):
+    """
+    Корзина в сессии; сессия без записи в базу, если SESSION_ENGINE - кэш или signed_cookies
+    """
+    session_key = 'cart'
+
+    def load(self):
+        return self.request.session.get(self.session_key)
+
+    def save(self, data, response):
+        self.request.session[self.session_key] = data
+
+
+class CookieCartStore(_ClientCartStore):
+    """
+    Корзина в подписанной cookie: сервер ничего не хранит
+    """
+
+    def load(self):
+        options = settings.CART_STORE
+        value = self.request.get_signed_cookie(
+            options['COOKIE_NAME'], default=None, salt=COOKIE_SALT, max_age=options['MAX_AGE'],
+        )
+        try:
+            return json.loads(value) if value else None
+        except ValueError:
+            return None
+
+    def check(self, lines):
+        super().check(lines)
+        # Размер - как у заголовка Set-Cookie: подпись и экранирование запятых и кавычек увеличивают значение
+        name = settings.CART_STORE['COOKIE_NAME']
+        cookie = SimpleCookie()
+        cookie[name] = get_cookie_signer(salt=name + COOKIE_SALT).sign(_dumps(self.data(lines)))
+        if len(cookie[name].OutputString()) > MAX_COOKIE_SIZE:
+            raise CartLimitError('Корзина слишком велика для хранения в cookie')
+
+    def save(self, data, response):
+        options = settings.CART_STORE
+        response.set_signed_cookie(
+            options['COOKIE_NAME'], _dumps(data), salt=COOKIE_SALT,
+            max_age=options['MAX_AGE'], httponly=True, samesite='Lax',
+        )
+
+
+class CacheCartStore(_ClientCartStore):
+    """
+    Корзина в кэше под случайным токеном из подписанной cookie
+    """
+
+    def load(self):
+        options = settings.CART_STORE
+        self.token = self.request.get_signed_cookie(
+            options['COOKIE_NAME'], default=None, salt=COOKIE_SALT, max_age=options['MAX_AGE'],
+        )
+        self.new_token = self.token is None
+        if self.new_token:
+            self.token = secrets.token_urlsafe(24)
+            return None
+        return caches[options['CACHE_ALIAS']].get(f'cart:{self.token}')
+
+    def save(self, data, response):
+        options = settings.CART_STORE
+        caches[options['CACHE_ALIAS']].set(f'cart:{self.token}', data, options['MAX_AGE'])
+        if self.new_token:
+            response.set_signed_cookie(
+                options['COOKIE_NAME'], self.token, salt=COOKIE_SALT,
+                max_age=options['MAX_AGE'], httponly=True, samesite='Lax',
+            )
+            self.new_token = False
+
+
+CART_STORES = {
+    'db': DatabaseCartStore,
+    'session': SessionCartStore,
+    'cookie': CookieCartStore,
+    'cache': CacheCartStore,
+}
+
+
+def get_cart_store(request):
+    """
+    Хранилище корзины текущего запроса по настройке CART_STORE['BACKEND']
+    """
+    store = getattr(request, '_cart_store', None)
+    if store is None:
+        store = request._cart_store = CART_STORES[settings.CART_STORE['BACKEND']](request)
+    return store
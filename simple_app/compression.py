@@ -0,0 +1,19 @@
+from django.middleware.gzip import GZipMiddleware
+
+# Сжимаются только HTML и JSON: статика уже лежит сжатой рядом с оригиналом (см. Simple_solutions.staticfiles)
+COMPRESSIBLE_TYPES = ('text/html', 'application/json')
+
+
+class HtmlJsonGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware для готовых HTML- и JSON-ответов, если клиент принимает gzip.
+
+    Потоковые ответы (файлы, ответы 206 на Range) не трогаются; ETag становится слабым,
+    и условные запросы с ним по-прежнему получают 304.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if response.streaming or content_type not in COMPRESSIBLE_TYPES:
+            return response
+        return super().process_response(request, response)
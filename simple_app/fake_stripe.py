@@ -0,0 +1,236 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeStripe:
+    """
+    Детерминированная заглушка Stripe API в памяти процесса.
+
+    Поддерживает создание и получение PaymentIntent, создание Checkout Session, создание и изменение
+    Product и Price, ключи идемпотентности (как в Stripe, ключ с другим запросом отклоняется),
+    задержку ответа (latency и разброс jitter, секунды), внедрение ошибок (доля error_rate ответов 500)
+    и ограничение частоты (rate_limit запросов в секунду, сверх - 429). Задержки и ошибки
+    определяются seed, поэтому прогоны воспроизводимы.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, seed=0, url='http://fake-stripe'):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self._url = url
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._idempotent = {}
+        self._window = (0, 0)
+
+    @property
+    def url(self):
+        return self._url
+
+    def next_delay(self):
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def handle(self, method, path, params, headers=None):
+        idempotency_key = (headers or {}).get('Idempotency-Key')
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit:
+                second = int(time.monotonic())
+                window, count = self._window
+                count = count + 1 if window == second else 1
+                self._window = (second, count)
+                if count > self.rate_limit:
+                    return 429, _error('rate_limit_error', 'Too many requests', code='rate_limit')
+            if idempotency_key in self._idempotent:
+                request, result = self._idempotent[idempotency_key]
+                if request != _fingerprint(method, path, params):
+                    return 400, _error('idempotency_error', 'Keys for idempotent requests can only be used '
+                                       'with the same parameters they were first used with.')
+                return result
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            return 500, _error('api_error', 'Injected error')
+
+        result = self._route(method.upper(), path.split('?', 1)[0].rstrip('/'), params)
+        if idempotency_key and method.upper() == 'POST':
+            with self._lock:
+                self._idempotent[idempotency_key] = (_fingerprint(method, path, params), result)
+        return result
+
+    def _route(self, method, path, params):
+        if method == 'POST' and path == '/v1/payment_intents':
+            intent_id = f'pi_{uuid.uuid4().hex[:24]}'
+            return 200, self._store({
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': int(params.get('amount', 0)),
+                'currency': params.get('currency', 'usd').lower(),
+                'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:16]}',
+                'status': 'requires_payment_method',
+            })
+        if method == 'POST' and path == '/v1/checkout/sessions':
+            session_id = f'cs_test_{uuid.uuid4().hex[:24]}'
+            return 200, self._store({
+                'id': session_id,
+                'object': 'checkout.session',
+                'url': f'{self.url}/pay/{session_id}',
+                'mode': params.get('mode', 'payment'),
+                'client_reference_id': params.get('client_reference_id'),
+                'metadata': _metadata(params),
+                'payment_status': 'unpaid',
+            })
+        if method == 'POST' and path == '/v1/products':
+            return 200, self._store({
+                'id': f'prod_{uuid.uuid4().hex[:14]}',
+                'object': 'product',
+                'name': params.get('name', ''),
+                'description': params.get('description'),
+                'active': True,
+            })
+        if method == 'POST' and path == '/v1/prices':
+            if params.get('product') not in self._objects:
+                return 400, _error('invalid_request_error', f'No such product: {params.get("product")}')
+            return 200, self._store({
+                'id': f'price_{uuid.uuid4().hex[:24]}',
+                'object': 'price',
+                'product': params['product'],
+                'currency': params.get('currency', 'usd').lower(),
+                'unit_amount': int(params.get('unit_amount', 0)),
+                'active': True,
+            })
+        if path.startswith(('/v1/products/', '/v1/prices/')):
+            obj = self._objects.get(path.rsplit('/', 1)[1])
+            if obj is None:
+                return 404, _error('invalid_request_error', f'No such {path.split("/")[2][:-1]}')
+            if method == 'POST':
+                with self._lock:
+                    for name in ('name', 'description', 'active'):
+                        if name in params:
+                            obj[name] = params[name] not in ('false', False) if name == 'active' else params[name]
+            return 200, obj
+        if path.startswith('/v1/payment_intents/'):
+            intent = self._objects.get(path.rsplit('/', 1)[1])
+            if intent is None:
+                return 404, _error('invalid_request_error', 'No such payment_intent')
+            if method == 'POST' and intent['status'] in ('succeeded', 'canceled'):
+                return 400, _error('invalid_request_error', f'This PaymentIntent has a status of {intent["status"]}',
+                                   code='payment_intent_unexpected_state')
+            if method == 'POST' and 'amount' in params:
+                intent['amount'] = int(params['amount'])
+            return 200, intent
+        return 404, _error('invalid_request_error', f'Unrecognized request URL ({path})')
+
+    def _store(self, obj):
+        with self._lock:
+            self._objects[obj['id']] = obj
+        return obj
+
+
+def _fingerprint(method, path, params):
+    return method.upper(), path.split('?', 1)[0].rstrip('/'), json.dumps(params, sort_keys=True, default=str)
+
+
+def _metadata(params):
+    # Клиент в процессе передает вложенный словарь, HTTP-клиент - поля формы вида metadata[order_id]
+    metadata = dict(params.get('metadata') or {})
+    for name, value in params.items():
+        if name.startswith('metadata[') and name.endswith(']'):
+            metadata[name[len('metadata['):-1]] = value
+    return {name: str(value) for name, value in metadata.items()}
+
+
+def _error(error_type, message, code=None):
+    error = {'type': error_type, 'message': message}
+    if code:
+        error['code'] = code
+    return {'error': error}
+
+
+class _FakeStripeHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, чтобы клиенты могли держать keep-alive соединения
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method, params):
+        delay = self.server.fake.next_delay()
+        if delay:
+            time.sleep(delay)
+        self._reply(*self.server.fake.handle(method, self.path, params, self.headers))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._handle('POST', dict(parse_qsl(self.rfile.read(length).decode())) if length else {})
+
+    def do_GET(self):
+        self._handle('GET', {})
+
+
+class _FakeStripeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Стандартная очередь в 5 соединений искажает результаты при одновременных запросах
+    request_queue_size = 256
+
+
+class FakeStripeServer(FakeStripe):
+    """
+    Заглушка Stripe API за локальным HTTP-сервером для тестов и бенчмарков транспорта.
+    Дополнительно считает принятые TCP-соединения; delay - задержка ответа в секундах.
+    """
+
+    def __init__(self, delay=0.0, host='127.0.0.1', port=0, **options):
+        super().__init__(latency=delay, **options)
+        self.connections = 0
+        self._server = _FakeStripeHTTPServer((host, port), _FakeStripeHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def delay(self):
+        return self.latency
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
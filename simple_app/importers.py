@@ -0,0 +1,155 @@
+import codecs
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Item
+from .serializers import ItemSerializer
+
+READ_SIZE = 64 * 1024
+CHUNK_SIZE = 500
+# Сколько ошибок строк возвращается подробно; остальные только считаются
+MAX_ERRORS = 100
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+
+class RowParseError(Exception):
+    """
+    Строку загрузки не удалось разобрать как JSON
+    """
+
+
+def iter_ndjson(stream) -> Iterator[Any]:
+    """
+    Читает NDJSON построчно: в памяти одновременно находится только одна строка.
+    Строка с некорректным JSON возвращается как RowParseError и не прерывает загрузку.
+    """
+    for raw_line in stream:
+        line = raw_line.decode('utf-8') if isinstance(raw_line, bytes) else raw_line
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield RowParseError(str(e))
+
+
+def iter_json_array(stream, read_size=READ_SIZE) -> Iterator[Any]:
+    """
+    Потоково разбирает JSON-массив: элементы декодируются по мере чтения,
+    в буфере хранится только еще не разобранный хвост. Нарушение структуры массива
+    (пропущенная или лишняя запятая, данные после ]) - RowParseError.
+    """
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, position, eof = '', 0, False
+    # expect_value - после [ или запятой, allow_end - после [ или значения
+    started, finished, expect_value, allow_end = False, False, True, True
+
+    while True:
+        while position < len(buffer) and buffer[position] in _WHITESPACE:
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                if finished:
+                    return
+                raise RowParseError('Неожиданный конец JSON-массива')
+            chunk = stream.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + text_decoder.decode(chunk or b'', final=eof)
+            position = 0
+            continue
+
+        char = buffer[position]
+        if finished:
+            raise RowParseError('Лишние данные после JSON-массива')
+        if not started:
+            if char != '[':
+                raise RowParseError('Ожидался JSON-массив')
+            started = True
+            position += 1
+        elif char == ']':
+            if not allow_end:
+                raise RowParseError('Лишняя запятая перед концом JSON-массива')
+            finished = True
+            position += 1
+        elif char == ',':
+            if expect_value:
+                raise RowParseError('Ожидалось значение, а не запятая')
+            expect_value, allow_end = True, False
+            position += 1
+        elif not expect_value:
+            raise RowParseError('Ожидалась запятая или конец JSON-массива')
+        else:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                if eof:
+                    raise RowParseError(str(e))
+                value, end = None, None
+            # Значение могло оборваться на границе прочитанного блока - дочитываем
+            if end is None or (end == len(buffer) and not eof):
+                chunk = stream.read(read_size)
+                eof = not chunk
+                buffer = buffer[position:] + text_decoder.decode(chunk or b'', final=eof)
+                position = 0
+                continue
+            yield value
+            position, expect_value, allow_end = end, False, True
+
+
+def _chunks(rows: Iterable[Any], size: int) -> Iterator[List[Tuple[int, Any]]]:
+    numbered = enumerate(rows)
+    while True:
+        chunk = list(islice(numbered, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@dataclass
+class ImportResult:
+    """
+    Итог загрузки: число сохраненных строк, первые max_errors ошибок строк и общее число ошибок.
+    Память на ошибки ограничена и не растет с размером файла.
+    """
+    created: int = 0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    error_count: int = 0
+    max_errors: int = MAX_ERRORS
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'errors': errors})
+
+
+def import_item_rows(rows: Iterable[Any], chunk_size=CHUNK_SIZE, max_errors=MAX_ERRORS) -> ImportResult:
+    """
+    Валидирует строки порциями по правилам ItemSerializer (как ItemSerializer(many=True)),
+    сохраняет корректные через bulk_create, каждая порция - в своей транзакции.
+    Ошибки собираются построчно и не прерывают загрузку остальных строк;
+    RowParseError из rows (поврежденный JSON-массив) передается вызывающему.
+    """
+    result = ImportResult(max_errors=max_errors)
+    serializer = ItemSerializer()
+    for chunk in _chunks(rows, chunk_size):
+        items = []
+        for row, data in chunk:
+            if isinstance(data, RowParseError):
+                result.add_error(row, {'non_field_errors': [str(data)]})
+                continue
+            try:
+                items.append(Item(**serializer.run_validation(data)))
+            except ValidationError as e:
+                result.add_error(row, e.detail)
+        with transaction.atomic():
+            Item.objects.bulk_create(items, batch_size=chunk_size)
+        result.created += len(items)
+    return result
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404
+
+from .models import Item
+
+_stats_lock = threading.Lock()
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+class LocalLRU:
+    """
+    Кеш процесса: не больше max_size записей, каждая живет ttl секунд.
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at <= now:
+                    del self._data[key]
+                    self.expirations += 1
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, values):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = None
+_local_lock = threading.Lock()
+
+
+def _local_cache():
+    global _local
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LocalLRU(settings.ITEM_CACHE['LOCAL_SIZE'], settings.ITEM_CACHE['LOCAL_TTL'])
+    return _local
+
+
+def _shared_cache():
+    return caches[settings.ITEM_CACHE['ALIAS']]
+
+
+def _key(item_id):
+    return f'item:{item_id}'
+
+
+def _count(**counts):
+    with _stats_lock:
+        for name, value in counts.items():
+            _stats[name] += value
+
+
+def _split_local(item_ids):
+    ids = list(dict.fromkeys(int(item_id) for item_id in item_ids))
+    found = _local_cache().get_many(ids)
+    return found, [item_id for item_id in ids if item_id not in found]
+
+
+def _merge_shared(found, missing, cached):
+    shared = {item.pk: item for item in cached.values()}
+    found.update(shared)
+    return shared, [item_id for item_id in missing if item_id not in shared]
+
+
+def _finish(found, local_hits, shared, missing, loaded):
+    found.update(loaded)
+    _local_cache().set_many({**shared, **loaded})
+    _count(local_hits=local_hits, shared_hits=len(shared), misses=len(missing))
+    return found
+
+
+def get_items(item_ids):
+    """
+    Товары по id одним вызовом, как Item.objects.in_bulk: {id: Item}, отсутствующих в результате нет.
+
+    Сначала LRU процесса, затем общий кеш ITEM_CACHE['ALIAS'] одним get_many, остальное -
+    одним запросом к базе; найденное дальше по цепочке сохраняется в кешах перед ним.
+    Объекты общие для запросов процесса: их нельзя изменять и сохранять.
+    """
+    found, missing = _split_local(item_ids)
+    local_hits = len(found)
+    shared, loaded = {}, {}
+    if missing:
+        shared, missing = _merge_shared(found, missing, _shared_cache().get_many([_key(pk) for pk in missing]))
+    if missing:
+        loaded = Item.objects.in_bulk(missing)
+        _shared_cache().set_many({_key(pk): item for pk, item in loaded.items()}, settings.ITEM_CACHE['TIMEOUT'])
+    return _finish(found, local_hits, shared, missing, loaded)
+
+
+async def aget_items(item_ids):
+    """
+    Асинхронный вариант get_items для async-представлений
+    """
+    found, missing = _split_local(item_ids)
+    local_hits = len(found)
+    shared, loaded = {}, {}
+    if missing:
+        cached = await _shared_cache().aget_many([_key(pk) for pk in missing])
+        shared, missing = _merge_shared(found, missing, cached)
+    if missing:
+        loaded = await Item.objects.ain_bulk(missing)
+        await _shared_cache().aset_many({_key(pk): item for pk, item in loaded.items()},
+                                        settings.ITEM_CACHE['TIMEOUT'])
+    return _finish(found, local_hits, shared, missing, loaded)
+
+
+def get_item_or_404(item_id):
+    item = get_items([item_id]).get(int(item_id))
+    if item is None:
+        raise Http404('No Item matches the given query.')
+    return item
+
+
+async def aget_item_or_404(item_id):
+    item = (await aget_items([item_id])).get(int(item_id))
+    if item is None:
+        raise Http404('No Item matches the given query.')
+    return item
+
+
+def invalidate_items(item_ids):
+    """
+    Удаляет товары из обоих кешей. Вызывается после изменений в обход save(), например bulk_update
+    """
+    item_ids = list(item_ids)
+    _local_cache().delete_many(item_ids)
+    _shared_cache().delete_many([_key(pk) for pk in item_ids])
+
+
+@receiver(post_save, sender=Item, dispatch_uid='item_cache_on_save')
+@receiver(post_delete, sender=Item, dispatch_uid='item_cache_on_delete')
+def _item_changed(sender, instance, **kwargs):
+    # Повторно после фиксации транзакции: параллельный запрос мог успеть вернуть в кеш
+    # версию, прочитанную до фиксации
+    item_id = instance.pk
+    invalidate_items([item_id])
+    transaction.on_commit(lambda: invalidate_items([item_id]))
+
+
+def clear_item_cache():
+    _local_cache().clear()
+    _shared_cache().clear()
+
+
+def item_cache_stats():
+    """
+    Счетчики кеша товаров текущего процесса: попадания в LRU процесса и в общий кеш, промахи
+    (чтения из базы), вытеснения из переполненного LRU и записи, истекшие по LOCAL_TTL
+    """
+    local = _local_cache()
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+    hits = stats['local_hits'] + stats['shared_hits']
+    return {
+        **stats,
+        'hit_rate': hits / lookups if lookups else 0.0,
+        'evictions': local.evictions,
+        'expirations': local.expirations,
+        'local_size': len(local),
+    }
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simple_app.fake_stripe import FakeStripeServer
+
+SERVERS = {
+    'asgi': ['-m', 'uvicorn', 'Simple_solutions.asgi:application', '--workers', '1', '--port'],
+    'wsgi': ['-m', 'gunicorn', 'Simple_solutions.wsgi:application', '--workers', '1', '--bind'],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест платежных представлений против локальной заглушки Stripe с задержкой: '
+            'один воркер uvicorn (ASGI) против одного синхронного воркера gunicorn (WSGI)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--delay', type=float, default=0.5, help='задержка ответа Stripe, секунды')
+        parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, FakeStripeServer(delay=options['delay']) as stripe_server:
+            env = dict(os.environ, SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'),
+                       STRIPE_API_BASE=stripe_server.url, STRIPE_POOL_SIZE=str(options['requests']))
+            manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+            subprocess.run(manage + ['migrate', '-v', '0'], env=env, check=True)
+            item_id = subprocess.run(
+                manage + ['shell', '-c', "from simple_app.models import Item; "
+                                         "print(Item.objects.create(name='Bench', description='', price=10).pk)"],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout.strip()
+
+            for name in options['servers']:
+                port = _free_port()
+                address = str(port) if name == 'asgi' else f'127.0.0.1:{port}'
+                process = subprocess.Popen([sys.executable, *SERVERS[name], address], env=env, cwd=settings.BASE_DIR,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    elapsed = asyncio.run(self.load(f'http://127.0.0.1:{port}', item_id, options['requests']))
+                finally:
+                    process.terminate()
+                    process.wait()
+                concurrency = options['requests'] * options['delay'] / elapsed
+                self.stdout.write(
+                    f'{name}: {options["requests"]} requests in {elapsed:.2f}s, '
+                    f'{options["requests"] / elapsed:.1f} req/s, effective concurrency {concurrency:.1f}'
+                )
+
+    async def load(self, base_url, item_id, count):
+        url = f'{base_url}/simple_app/create-payment-intent/{item_id}/'
+        async with httpx.AsyncClient(timeout=120) as client:
+            for _ in range(100):
+                try:
+                    await client.get(f'{base_url}/simple_app/payment/cancel/')
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(client.post(url) for _ in range(count)))
+            elapsed = time.perf_counter() - started
+        failed = [response for response in responses if response.status_code != 200]
+        if failed:
+            self.stderr.write(f'{len(failed)} failed requests, e.g. {failed[0].status_code}: {failed[0].text[:200]}')
+        return elapsed
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from config import load_config, read_config
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает чтение .env на каждый запрос с закешированным реестром конфигураций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, '.env')
+            with open(path, 'w') as env_file:
+                env_file.write(
+                    'DJANGO_SECRET_KEY=bench\n'
+                    'STRIPE_SECRET_KEY_USD=sk_usd\nSTRIPE_PUBLISHABLE_KEY_USD=pk_usd\n'
+                    'STRIPE_SECRET_KEY_EUR=sk_eur\nSTRIPE_PUBLISHABLE_KEY_EUR=pk_eur\n'
+                )
+
+            uncached = timeit.timeit(lambda: read_config(path, currency='EUR'), number=iterations)
+            cached = timeit.timeit(lambda: load_config(path, currency='EUR'), number=iterations)
+
+        per_uncached = uncached / iterations * 1e6
+        per_cached = cached / iterations * 1e6
+        self.stdout.write(f'read .env per request: {per_uncached:.1f} us/call')
+        self.stdout.write(f'cached registry:       {per_cached:.1f} us/call')
+        self.stdout.write(f'savings per request:   {per_uncached - per_cached:.1f} us ({per_uncached / per_cached:.0f}x)')
@@ -0,0 +1,108 @@
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand
+
+from simple_app.money import Money
+from simple_app.pricing import CartLine, CartSummary, OrderTotals, price_checkout
+
+CENT = Decimal('0.01')
+
+
+def _quantize(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def decimal_checkout(lines, discount_rate, tax_rate):
+    """
+    Прежний расчет на Decimal: ставки в процентах, округление нарастающим итогом по строкам.
+    Как и price_checkout, возвращает итог и суммы по строкам (без скидки и налог)
+    """
+    subtotal = sum((price * quantity for price, quantity in lines), Decimal(0))
+    discounts = subtotal * discount_rate / 100
+    total = _quantize(subtotal - discounts + (subtotal - discounts) * tax_rate / 100)
+    discount_factor, tax_factor = 1 - discount_rate / 100, 1 + tax_rate / 100
+    running_net = running_total = Decimal(0)
+    net_before = total_before = 0
+    priced = []
+    for price, quantity in lines:
+        net = price * quantity * discount_factor
+        running_net += net
+        running_total += net * tax_factor
+        net_minor = int(_quantize(running_net) * 100) - net_before
+        net_before += net_minor
+        line_total = int(_quantize(running_total) * 100) - total_before
+        total_before += line_total
+        priced.append((net_minor, line_total - net_minor))
+    return total, total_before, priced
+
+
+def minor_cart(lines, discount_rate, tax_rate):
+    cart_lines = tuple(
+        CartLine(item_id=index, name='', quantity=quantity, unit_price=Money(price), line_total=Money(price * quantity))
+        for index, (price, quantity) in enumerate(lines)
+    )
+    totals = OrderTotals(sum(line.line_total.amount for line in cart_lines), discount_rate, tax_rate)
+    return CartSummary(order_id=None, currency='USD', lines=cart_lines, totals=totals)
+
+
+def minor_checkout(cart):
+    """
+    Расчет в целых копейках (ставки в базисных пунктах) - price_checkout приложения
+    """
+    pricing = price_checkout(cart)
+    return cart.totals.total, pricing.total_minor, pricing.lines
+
+
+class Command(BaseCommand):
+    help = ('Микробенчмарк расчета корзины и распределения по строкам для Stripe: '
+            'Decimal и ставки в процентах против целых копеек и базисных пунктов. '
+            'Итоги могут отличаться на копейку: в целых копейках скидка и налог округляются отдельно, '
+            'чтобы итог был равен сумме товаров минус скидка плюс налог, как их видит покупатель')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--lines', type=int, default=25)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        carts = []
+        for _ in range(options['carts']):
+            minor = [(rng.randint(1, 50000), rng.randint(1, 5)) for _ in range(options['lines'])]
+            discount_bp, tax_bp = rng.choice([0, 500, 750, 1000]), rng.choice([0, 1000, 1300, 2000])
+            carts.append((minor, discount_bp, tax_bp))
+        # Корзины в обоих представлениях строятся заранее: измеряется только расчет
+        benchmarks = (
+            ('decimal', decimal_checkout, [
+                ([(Decimal(price) / 100, quantity) for price, quantity in minor],
+                 Decimal(discount_bp) / 100, Decimal(tax_bp) / 100)
+                for minor, discount_bp, tax_bp in carts
+            ]),
+            ('minor', minor_checkout, [(minor_cart(*cart),) for cart in carts]),
+        )
+
+        # Прогоны чередуются, чтобы фоновая нагрузка одинаково влияла на оба варианта
+        timings, outputs = {name: [] for name, _, _ in benchmarks}, {}
+        for _ in range(options['repeat']):
+            for name, function, inputs in benchmarks:
+                started = time.perf_counter()
+                outputs[name] = [function(*cart) for cart in inputs]
+                timings[name].append(time.perf_counter() - started)
+        for name, _, inputs in benchmarks:
+            best = min(timings[name])
+            self.stdout.write(f'{name:>8}: {len(inputs) / best:10.0f} carts/s '
+                              f'({best * 1e6 / len(inputs):.1f} µs/cart, {options["lines"]} lines)')
+
+        differences = [
+            abs(int(decimal_total * 100) - minor_total)
+            for (decimal_total, _, _), (minor_total, _, _) in zip(outputs['decimal'], outputs['minor'])
+        ]
+        mismatched = sum(1 for difference in differences if difference)
+        inconsistent = sum(1 for total, lines_total, _ in outputs['minor'] if total != lines_total)
+        self.stdout.write(f'speedup: {min(timings["decimal"]) / min(timings["minor"]):.2f}x; '
+                          f'carts with a different total (per-component rounding): {mismatched}, '
+                          f'at most {max(differences, default=0)} minor unit(s); '
+                          f'carts where lines do not sum to the total: {inconsistent}')
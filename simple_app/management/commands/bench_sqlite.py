@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+from simple_app.cart import build_cart_summary
+from simple_app.models import Item, Order, OrderItem
+
+PROFILES = ('plain', 'tuned')
+# wsgi - запросы к ORM в одном потоке с границами запроса, как у синхронного воркера;
+# asgi - HTTP-запросы через ASGI-приложение Simple_solutions.asgi, как у UvicornWorker из gunicorn.conf.py
+SERVERS = ('wsgi', 'asgi')
+
+
+async def _asgi_request(application, method, path, cookies, body=b'', headers=()):
+    """
+    Один HTTP-запрос к ASGI-приложению: возвращает статус и обновляет cookies из Set-Cookie
+    """
+    cookie = '; '.join(f'{name}={value}' for name, value in cookies.items())
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode()), *headers],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = None
+
+    async def receive():
+        # После тела запроса клиент "ждет" ответа, не отключаясь
+        return messages.pop(0) if messages else await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            for name, value in message['headers']:
+                if name.lower() == b'set-cookie':
+                    name, value = value.decode().split(';', 1)[0].split('=', 1)
+                    cookies[name] = value
+
+    await application(scope, receive, send)
+    return status
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест SQLite несколькими процессами: смесь чтений (товары, корзина) и записей '
+            '(добавление в корзину) в стандартном профиле Django (plain) и в профиле для воркеров (tuned)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='длительность на профиль, секунды')
+        parser.add_argument('--write-ratio', type=float, default=0.3)
+        parser.add_argument('--items', type=int, default=200)
+        parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+        parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+        # Внутренние режимы: подготовка базы и процесс-воркер
+        parser.add_argument('--seed', action='store_true', help='служебный режим')
+        parser.add_argument('--worker', type=int, default=None, help='служебный режим')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            Item.objects.bulk_create([
+                Item(name=f'Bench {index}', description='', price=f'{index % 50 + 1}.99') for index in range(options['items'])
+            ])
+            return
+        if options['worker'] is not None:
+            self.run_worker(options)
+            return
+
+        manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_sqlite']
+        for profile, server in [(profile, server) for server in options['servers'] for profile in options['profiles']]:
+            with tempfile.TemporaryDirectory() as directory:
+                env = dict(os.environ, SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'), SQLITE_PROFILE=profile,
+                           SERVER_INTERFACE=server)
+                subprocess.run([sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'migrate', '-v', '0'],
+                               env=env, check=True)
+                subprocess.run(manage + ['--seed', '--items', str(options['items'])], env=env, check=True)
+                args = ['--duration', str(options['duration']), '--write-ratio', str(options['write_ratio'])]
+                processes = [
+                    subprocess.Popen(manage + ['--worker', str(index), *args], env=env, stdout=subprocess.PIPE, text=True)
+                    for index in range(options['workers'])
+                ]
+                results = [json.loads(process.communicate()[0]) for process in processes]
+            self.report(f'{profile}/{server}', results, options['duration'])
+
+    def run_worker(self, options):
+        random.seed(options['worker'])
+        connections_opened = []
+        connection_created.connect(lambda **kwargs: connections_opened.append(1), weak=False)
+        if settings.SERVER_INTERFACE == 'asgi':
+            result = asyncio.run(self.run_asgi_worker(options))
+        else:
+            result = self.run_wsgi_worker(options)
+        result['connections'] = len(connections_opened)
+        self.stdout.write(json.dumps(result))
+
+    async def run_asgi_worker(self, options):
+        from Simple_solutions.asgi import application
+
+        item_ids = [item_id async for item_id in Item.objects.values_list('pk', flat=True)]
+        cookies = {}
+        # Первый запрос выдает cookie сессии и CSRF, с ними идут записи в корзину
+        await _asgi_request(application, 'GET', reverse('item_detail', args=[item_ids[0]]), cookies)
+        latencies = {'read': [], 'write': []}
+        errors = {'read': 0, 'write': 0}
+
+        deadline = time.monotonic() + options['duration']
+        while time.monotonic() < deadline:
+            kind = 'write' if random.random() < options['write_ratio'] else 'read'
+            item_id = random.choice(item_ids)
+            started = time.perf_counter()
+            if kind == 'read':
+                path = random.choice([reverse('item_detail', args=[item_id]), reverse('cart_view')])
+                status = await _asgi_request(application, 'GET', path, cookies)
+            else:
+                status = await _asgi_request(
+                    application, 'POST', reverse('add_to_order', args=[item_id]), cookies, b'quantity=1',
+                    [(b'content-type', b'application/x-www-form-urlencoded'),
+                     (b'x-csrftoken', cookies.get(settings.CSRF_COOKIE_NAME, '').encode())],
+                )
+            if status == 200:
+                latencies[kind].append(time.perf_counter() - started)
+            else:
+                errors[kind] += 1
+        return {'latencies': latencies, 'errors': errors}
+
+    def run_wsgi_worker(self, options):
+        item_ids = list(Item.objects.values_list('pk', flat=True))
+        order = Order.objects.create(status='pending', session_key=f'bench-{options["worker"]}')
+        latencies = {'read': [], 'write': []}
+        errors = {'read': 0, 'write': 0}
+
+        deadline = time.monotonic() + options['duration']
+        while time.monotonic() < deadline:
+            kind = 'write' if random.random() < options['write_ratio'] else 'read'
+            # Границы запроса: соединения закрываются и переиспользуются по CONN_MAX_AGE, как в представлениях
+            request_started.send(sender=self.__class__)
+            started = time.perf_counter()
+            try:
+                if kind == 'read':
+                    list(Item.objects.filter(pk__in=random.sample(item_ids, 10)))
+                    build_cart_summary(order)
+                else:
+                    item = Item.objects.get(pk=random.choice(item_ids))
+                    with transaction.atomic():
+                        OrderItem.objects.add_quantity(order, item, 1)
+                        order.apply_line_delta(item.price_minor)
+                    # Полный пересчет: транзакция начинается с чтения, затем пишет
+                    with transaction.atomic():
+                        order.calculate_total_price(totals=order.get_totals(refresh=True))
+                latencies[kind].append(time.perf_counter() - started)
+            except OperationalError:
+                errors[kind] += 1
+            finally:
+                request_finished.send(sender=self.__class__)
+
+        return {'latencies': latencies, 'errors': errors}
+
+    def report(self, name, results, duration):
+        requests = 0
+        for kind in ('read', 'write'):
+            latencies = [latency for result in results for latency in result['latencies'][kind]]
+            errors = sum(result['errors'][kind] for result in results)
+            requests += len(latencies) + errors
+            self.stdout.write(
+                f'{name:>10} {kind:>5}: {len(latencies) / duration:8.1f} ops/s, {errors} errors, '
+                f'p50 {_percentile(latencies, 0.5) * 1000:.2f} ms, p99 {_percentile(latencies, 0.99) * 1000:.2f} ms'
+            )
+        self.stdout.write(f'{name:>10} connections opened: {sum(result["connections"] for result in results)} '
+                          f'for {requests} requests')
@@ -0,0 +1,68 @@
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Холодный старт воркера: Django, приложения и URLconf - то, что воркер делает до первого запроса
+STARTUP = '''
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+{preload}
+print(time.perf_counter() - started)
+'''
+# Прежний порядок: stripe SDK, httpx и клиенты Stripe загружались при импорте моделей и представлений
+EAGER_MODULES = ('simple_app.stripe_clients', 'simple_app.webhooks', 'stripe')
+
+
+def _parse_importtime(stderr):
+    """
+    Модули верхнего уровня из вывода python -X importtime: [(имя, накопленное время в мкс)]
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            modules.append((name.strip(), int(cumulative)))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('Время холодного старта воркера в отдельных процессах: с ленивой загрузкой Stripe '
+            '(как сейчас) и с загрузкой stripe SDK при старте (как раньше), и самые тяжелые импорты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=10)
+
+    def start(self, preload):
+        script = STARTUP.format(preload='\n'.join(f'import {module}' for module in preload))
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], env=env,
+                                capture_output=True, text=True, check=True, cwd=settings.BASE_DIR)
+        return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, preload in (('lazy', ()), ('eager', EAGER_MODULES)):
+            timings = []
+            for _ in range(options['runs']):
+                elapsed, stderr = self.start(preload)
+                timings.append(elapsed)
+            results[name] = (statistics.median(timings), _parse_importtime(stderr))
+            self.stdout.write(f'{name:>6}: {statistics.median(timings) * 1000:7.1f} ms median '
+                              f'(min {min(timings) * 1000:.1f} ms, {options["runs"]} runs)')
+
+        lazy, eager = results['lazy'][0], results['eager'][0]
+        self.stdout.write(f'saved at worker start: {(eager - lazy) * 1000:.1f} ms ({eager / lazy:.2f}x)')
+        self.stdout.write('heaviest top-level imports (lazy):')
+        for module, cumulative in sorted(results['lazy'][1], key=lambda row: -row[1])[:options['top']]:
+            self.stdout.write(f'{cumulative / 1000:9.1f} ms  {module}')
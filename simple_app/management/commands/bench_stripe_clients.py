@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.core.management.base import BaseCommand
+
+from simple_app.fake_stripe import FakeStripeServer
+from simple_app.stripe_clients import StripeClient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает число TCP-соединений к заглушке Stripe: клиент по умолчанию SDK и пул StripeClient'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkouts', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8)
+
+    def run(self, server, checkouts, threads, create):
+        connections_before = server.connections
+        started = time.perf_counter()
+        # Как у воркера gunicorn с потоками: потоки живут, пока живет воркер, и обслуживают все запросы
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _: create(amount=1099, currency='usd'), range(checkouts)))
+        elapsed = time.perf_counter() - started
+        return server.connections - connections_before, elapsed
+
+    def handle(self, *args, **options):
+        checkouts, threads = options['checkouts'], options['threads']
+        with FakeStripeServer() as server:
+            api_base, api_key = stripe.api_base, stripe.api_key
+            stripe.api_base, stripe.api_key = server.url, 'sk_test_bench'
+            try:
+                sdk = self.run(server, checkouts, threads, stripe.PaymentIntent.create)
+            finally:
+                stripe.api_base, stripe.api_key = api_base, api_key
+
+            client = StripeClient('sk_test_bench', api_base=server.url, pool_size=threads)
+            pooled = self.run(server, checkouts, threads, client.create_payment_intent)
+            client.close()
+
+        for name, (connections, elapsed) in (('sdk default client', sdk), ('pooled StripeClient', pooled)):
+            self.stdout.write(
+                f'{name:20} {connections:5d} connections, '
+                f'{connections / checkouts:.3f} per checkout, {elapsed / checkouts * 1000:.2f} ms per checkout'
+            )
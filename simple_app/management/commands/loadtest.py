@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_app.fake_stripe import FakeStripeServer
+
+# Имена URL: checkout_cart и create_checkout_session_for_cart - представления checkout_order
+# и create_checkout_session_for_order без order_id, заказ создается из корзины
+ENDPOINTS = ('item_detail', 'add_to_order', 'cart_view', 'checkout_cart', 'create_checkout_session_for_cart',
+             'create_payment_intent')
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = ('Воспроизводимый нагрузочный тест simple_app: наполняет временную базу, прогоняет сценарий покупателя '
+            '(страница товара, добавление в корзину, корзина, оформление, PaymentIntent) с фиксированной '
+            'конкурентностью против локальной заглушки Stripe и сохраняет результаты в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=200, help='уже существующие заказы')
+        parser.add_argument('--lines', type=int, default=5, help='строк в каждом существующем заказе')
+        parser.add_argument('--users', type=int, default=200, help='число сценариев покупателя')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--stripe-delay', type=float, default=0.05, help='задержка заглушки Stripe, секунды')
+        parser.add_argument('--stripe-jitter', type=float, default=0.0, help='разброс задержки, секунды')
+        parser.add_argument('--stripe-error-rate', type=float, default=0.0, help='доля ответов 500')
+        parser.add_argument('--stripe-rate-limit', type=int, default=0, help='запросов в секунду, сверх - 429')
+        parser.add_argument('--gateway', choices=['http', 'inprocess'], default='http',
+                            help='заглушка Stripe за локальным HTTP-сервером или в памяти процесса')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='куда сохранить результаты в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='допустимый рост p95 относительно baseline, доля')
+        parser.add_argument('--run', help='служебный режим: прогон во временной базе, результат в этот файл')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            result = asyncio.run(self.run(options))
+            with open(options['run'], 'w') as file:
+                json.dump(result, file)
+            return
+
+        fake = {
+            'delay': options['stripe_delay'],
+            'jitter': options['stripe_jitter'],
+            'error_rate': options['stripe_error_rate'],
+            'rate_limit': options['stripe_rate_limit'],
+            'seed': options['seed'],
+        }
+        with tempfile.TemporaryDirectory() as directory, FakeStripeServer(**fake) as stripe:
+            env = dict(os.environ, SQLITE_PATH=os.path.join(directory, 'loadtest.sqlite3'),
+                       STRIPE_API_BASE=stripe.url, STRIPE_POOL_SIZE=str(options['concurrency']))
+            if options['gateway'] == 'inprocess':
+                env.update(PAYMENT_GATEWAY='fake', FAKE_STRIPE_LATENCY=str(fake['delay']),
+                           FAKE_STRIPE_JITTER=str(fake['jitter']), FAKE_STRIPE_ERROR_RATE=str(fake['error_rate']),
+                           FAKE_STRIPE_RATE_LIMIT=str(fake['rate_limit']), FAKE_STRIPE_SEED=str(fake['seed']))
+            manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+            subprocess.run(manage + ['migrate', '-v', '0'], env=env, check=True)
+            result_path = os.path.join(directory, 'result.json')
+            passthrough = [f'--{name}={options[name]}' for name in ('items', 'orders', 'lines', 'users',
+                                                                     'concurrency', 'seed')]
+            subprocess.run(manage + ['loadtest', f'--run={result_path}', *passthrough], env=env, check=True)
+            with open(result_path) as file:
+                result = json.load(file)
+        result['config'].update({f'stripe_{name}': value for name, value in fake.items() if name != 'seed'},
+                                gateway=options['gateway'])
+
+        self.report(result)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(result, file, indent=2)
+        if options['baseline']:
+            self.compare(result, options['baseline'], options['max_regression'])
+
+    def seed(self, options):
+        from simple_app.models import Discount, Item, Order, OrderItem, Tax
+
+        rng = random.Random(options['seed'])
+        Item.objects.bulk_create([
+            Item(name=f'Item {index}', description=f'Описание товара {index}',
+                 price=f'{rng.randint(1, 500)}.{rng.randint(0, 99):02d}', currency=rng.choice(['USD', 'EUR']))
+            for index in range(options['items'])
+        ], batch_size=500)
+        item_ids = list(Item.objects.values_list('pk', flat=True))
+        orders = Order.objects.bulk_create([
+            Order(status='pending', session_key=f'seed-{index}') for index in range(options['orders'])
+        ], batch_size=500)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, item_id=item_id, quantity=rng.randint(1, 5))
+            for order in orders
+            for item_id in rng.sample(item_ids, min(options['lines'], len(item_ids)))
+        ], batch_size=500)
+        Discount.objects.bulk_create([Discount(order=order, rate='5.00') for order in orders[::2]])
+        Tax.objects.bulk_create([Tax(order=order, rate='10.00') for order in orders[::3]])
+        # Валюта корзины пользователя должна быть одна, поэтому сценарии берут товары в USD
+        return list(Item.objects.filter(currency='USD').values_list('pk', flat=True))
+
+    async def run(self, options):
+        from asgiref.sync import sync_to_async
+        from django.core.asgi import get_asgi_application
+
+        from simple_app import metrics
+
+        item_ids = await sync_to_async(self.seed)(options)
+        application = get_asgi_application()
+        latencies, errors = defaultdict(list), defaultdict(int)
+        rng = random.Random(options['seed'])
+        plans = [rng.sample(item_ids, 3) for _ in range(options['users'])]
+        queue = asyncio.Queue()
+        for plan in plans:
+            queue.put_nowait(plan)
+
+        async def timed(name, send):
+            started = time.perf_counter()
+            response = await send()
+            latencies[name].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[name] += 1
+            return response
+
+        async def shopper(plan):
+            transport = httpx.ASGITransport(app=application)
+            async with httpx.AsyncClient(transport=transport, base_url='http://127.0.0.1/simple_app') as client:
+                for item_id in plan:
+                    await timed('item_detail', lambda: client.get(f'/item/{item_id}/'))
+                    headers = {'X-CSRFToken': client.cookies.get('csrftoken', '')}
+                    await timed('add_to_order', lambda: client.post(
+                        f'/add-to-order/{item_id}/', data={'quantity': 1}, headers=headers))
+                await timed('cart_view', lambda: client.get('/cart/'))
+                await timed('checkout_cart', lambda: client.post('/checkout-order/', headers=headers))
+                await timed('create_checkout_session_for_cart',
+                            lambda: client.post('/create-checkout-session-for-order/', headers=headers))
+                await timed('create_payment_intent', lambda: client.post(f'/create-payment-intent/{plan[0]}/'))
+
+        async def worker():
+            while not queue.empty():
+                await shopper(queue.get_nowait())
+
+        metrics.registry.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+        elapsed = time.perf_counter() - started
+
+        counters = dict(metrics.registry.counters)
+        endpoints = {}
+        for name in ENDPOINTS:
+            values = latencies[name]
+            requests = sum(value for (metric, labels), value in counters.items()
+                           if metric == 'simple_app_requests_total' and ('view', name) in labels)
+            queries = counters.get(('simple_app_db_queries_total', (('view', name),)), 0)
+            endpoints[name] = {
+                'requests': len(values),
+                'errors': errors[name],
+                'throughput': len(values) / elapsed,
+                'p50': _percentile(values, 0.50),
+                'p95': _percentile(values, 0.95),
+                'p99': _percentile(values, 0.99),
+                'queries_per_request': queries / requests if requests else 0.0,
+            }
+        return {
+            'config': {name: options[name] for name in ('items', 'orders', 'lines', 'users', 'concurrency', 'seed')},
+            'environment': {'python': platform.python_version(), 'sqlite_profile': settings.SQLITE_PROFILE},
+            'elapsed': elapsed,
+            'throughput': sum(len(values) for values in latencies.values()) / elapsed,
+            'endpoints': endpoints,
+        }
+
+    def report(self, result):
+        self.stdout.write(f'{result["throughput"]:.1f} req/s in {result["elapsed"]:.2f}s '
+                          f'(concurrency {result["config"]["concurrency"]}, {result["config"]["users"]} users)')
+        self.stdout.write(f'{"endpoint":<36}{"req":>6}{"err":>5}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}'
+                          f'{"p99 ms":>9}{"q/req":>7}')
+        for name, stats in result['endpoints'].items():
+            self.stdout.write(
+                f'{name:<36}{stats["requests"]:>6}{stats["errors"]:>5}{stats["throughput"]:>9.1f}'
+                f'{stats["p50"] * 1000:>9.1f}{stats["p95"] * 1000:>9.1f}{stats["p99"] * 1000:>9.1f}'
+                f'{stats["queries_per_request"]:>7.1f}'
+            )
+
+    def compare(self, result, baseline_path, max_regression):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        regressions = []
+        for name, stats in result['endpoints'].items():
+            before = baseline['endpoints'].get(name)
+            if not before or not before['p95']:
+                continue
+            change = stats['p95'] / before['p95'] - 1
+            queries = stats['queries_per_request'] - before['queries_per_request']
+            self.stdout.write(f'{name:<36} p95 {change:+.0%}, queries/request {queries:+.1f}')
+            if change > max_regression or queries > 0:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f'Регрессия относительно {baseline_path}: {", ".join(regressions)}')
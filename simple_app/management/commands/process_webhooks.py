@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simple_app.webhooks import process_batch
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает входящий ящик событий Stripe пачками: переводит заказы в оплаченные '
+            'или возвращенные и обновляет статусы PaymentIntent. С --loop работает как фоновый воркер.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_WEBHOOK['BATCH_SIZE'])
+        parser.add_argument('--loop', action='store_true', help='не завершаться, ожидая новые события')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='пауза, когда необработанных событий нет, секунды')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_batch(options['batch_size'])
+            total += processed
+            if processed:
+                self.stdout.write(f'Обработано событий: {processed}')
+            elif options['loop']:
+                time.sleep(options['interval'])
+            else:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Всего обработано событий: {total}'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_app.stripe_catalog import sync_catalog
+
+
+class Command(BaseCommand):
+    help = ('Создает и обновляет Product и Price в Stripe для товаров, измененных после прошлого запуска, '
+            'и сохраняет их id в товарах; оформление заказа затем ссылается на цены Stripe')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=4, help='параллельных запросов к Stripe')
+        parser.add_argument('--full', action='store_true', help='отправить все товары, а не только измененные')
+
+    def handle(self, *args, **options):
+        def report(synced, failed):
+            self.stdout.write(f'Пачка: синхронизировано {synced}, с ошибкой {failed}')
+
+        synced, failed = sync_catalog(options['batch_size'], options['concurrency'], options['full'], report)
+        for item_id, error in failed:
+            self.stderr.write(f'Товар {item_id}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Синхронизировано товаров: {synced}'))
+        if failed:
+            raise CommandError(f'Не синхронизировано товаров: {len(failed)}, они будут отправлены при следующем запуске')
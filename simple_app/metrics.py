@@ -0,0 +1,366 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+from django.utils.decorators import sync_and_async_middleware
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'simple_app_requests_total': ('counter', 'Запросы по представлению, методу и статусу'),
+    'simple_app_request_duration_seconds': ('histogram', 'Время обработки запроса'),
+    'simple_app_db_queries_total': ('counter', 'Запросы к базе'),
+    'simple_app_db_query_duration_seconds_total': ('counter', 'Суммарное время запросов к базе'),
+    'simple_app_stripe_requests_total': ('counter', 'Вызовы Stripe API по операции и результату (ok/error)'),
+    'simple_app_stripe_request_duration_seconds': ('histogram', 'Время вызова Stripe API'),
+    'simple_app_template_render_duration_seconds': ('histogram', 'Время рендеринга шаблона'),
+}
+
+
+class _Registry:
+    """
+    Метрики текущего процесса. Гистограмма хранится как счетчики по корзинам
+    (последняя - больше всех границ), сумма и количество наблюдений.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def _check_fork(self):
+        # После fork дочерний процесс начинает с нуля, иначе метрики мастера посчитаются дважды
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            histogram['buckets'][_bucket_index(value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            self._check_fork()
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, histogram] for (name, labels), histogram in self.histograms.items()],
+            }
+
+
+def _bucket_index(value):
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return index
+    return len(BUCKETS)
+
+
+registry = _Registry()
+
+
+class RequestStats:
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.query_time = 0.0
+
+    @property
+    def view(self):
+        if self.request is None:
+            return 'none'
+        match = getattr(self.request, 'resolver_match', None)
+        if match is None:
+            return 'unmatched'
+        return match.url_name or match.view_name
+
+
+_current = ContextVar('simple_app_metrics_request', default=None)
+
+
+def _current_view():
+    stats = _current.get()
+    return stats.view if stats is not None else 'none'
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@contextmanager
+def stripe_call(operation):
+    """
+    Учитывает вызов Stripe API: время, количество и ошибки по представлению и операции
+    """
+    labels = {'view': _current_view(), 'operation': operation}
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        registry.observe('simple_app_stripe_request_duration_seconds', labels, time.perf_counter() - started)
+        registry.inc('simple_app_stripe_requests_total', {**labels, 'outcome': outcome})
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            registry.observe(
+                'simple_app_template_render_duration_seconds',
+                {'view': _current_view(), 'template': self.origin.template_name or '-'},
+                time.perf_counter() - started,
+            )
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Шаблонизатор Django, который измеряет время рендеринга каждого шаблона
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def _begin(request):
+    stats = RequestStats(request)
+    return stats, _current.set(stats), time.perf_counter()
+
+
+def _finish(stats, token, started, response):
+    elapsed = time.perf_counter() - started
+    _current.reset(token)
+    labels = {'view': stats.view, 'method': stats.request.method}
+    registry.inc('simple_app_requests_total', {**labels, 'status': str(response.status_code)})
+    registry.observe('simple_app_request_duration_seconds', labels, elapsed)
+    if stats.queries:
+        registry.inc('simple_app_db_queries_total', {'view': stats.view}, stats.queries)
+        registry.inc('simple_app_db_query_duration_seconds_total', {'view': stats.view}, stats.query_time)
+    flush()
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Собирает метрики запроса: время, статус, число и время запросов к базе по имени URL
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats, token, started = _begin(request)
+            response = await get_response(request)
+            _finish(stats, token, started, response)
+            return response
+    else:
+        def middleware(request):
+            stats, token, started = _begin(request)
+            response = get_response(request)
+            _finish(stats, token, started, response)
+            return response
+    return middleware
+
+
+def _metrics_dir():
+    return settings.METRICS.get('DIR')
+
+
+def flush(force=False):
+    """
+    Записывает метрики процесса в METRICS['DIR'] не чаще раза в FLUSH_INTERVAL секунд,
+    чтобы /metrics любого воркера видел метрики всех процессов
+    """
+    directory = _metrics_dir()
+    if not directory:
+        return
+    now = time.monotonic()
+    if not force and now - registry.flushed_at < settings.METRICS.get('FLUSH_INTERVAL', 1.0):
+        return
+    registry.flushed_at = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(f'{path}.tmp', path)
+
+
+# Метрики завершившихся процессов: счетчики сводки не должны уменьшаться при перезапуске воркера
+ACCUMULATED = 'accumulated.json'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _locked(directory):
+    # Перенос метрик завершившегося процесса и чтение сводки не должны пересекаться между процессами
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+            total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def _retire(directory, pid):
+    path = os.path.join(directory, f'{pid}.json')
+    snapshot = _read(path)
+    if snapshot is not None:
+        accumulated_path = os.path.join(directory, ACCUMULATED)
+        counters, histograms = _merge([s for s in (_read(accumulated_path), snapshot) if s is not None])
+        with open(f'{accumulated_path}.tmp', 'w') as file:
+            json.dump({
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, histogram] for (name, labels), histogram in histograms.items()],
+            }, file)
+        os.replace(f'{accumulated_path}.tmp', accumulated_path)
+    for leftover in (path, f'{path}.tmp'):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+
+def retire_process(directory, pid):
+    """
+    Переносит метрики завершившегося процесса pid в общий файл ACCUMULATED и удаляет его файл,
+    как multiprocess-режим prometheus_client: суммы в сводке после этого не уменьшаются
+    """
+    with _locked(directory):
+        _retire(directory, pid)
+
+
+def collect():
+    """
+    Сводит метрики всех процессов: текущего - из памяти, остальных - из их файлов,
+    завершившихся - из ACCUMULATED (файлы таких процессов сначала переносятся туда).
+    """
+    snapshots = [registry.snapshot()]
+    directory = _metrics_dir()
+    if directory:
+        with _locked(directory):
+            for path in glob.glob(os.path.join(directory, '*.json')):
+                pid = os.path.basename(path)[:-len('.json')]
+                if not pid.isdigit() or int(pid) == os.getpid():
+                    continue
+                if not _alive(int(pid)):
+                    _retire(directory, int(pid))
+                    continue
+                snapshots.append(_read(path))
+            snapshots.append(_read(os.path.join(directory, ACCUMULATED)))
+    return _merge([snapshot for snapshot in snapshots if snapshot is not None])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_metrics():
+    """
+    Метрики всех процессов в текстовом формате Prometheus
+    """
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            continue
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-17 23:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_app', '0005_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentIntentRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope_key', models.CharField(max_length=255, unique=True)),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.PositiveIntegerField(help_text='Сумма в минимальных единицах валюты (центы/копейки)')),
+                ('stripe_id', models.CharField(max_length=255, unique=True)),
+                ('client_secret', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-17 23:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def merge_duplicate_order_items(apps, schema_editor):
+    """
+    Сливает повторяющиеся строки (order, item) в одну с суммарным количеством,
+    иначе уникальное ограничение не создастся
+    """
+    OrderItem = apps.get_model('simple_app', 'OrderItem')
+    kept = {}
+    for order_item in OrderItem.objects.order_by('pk'):
+        key = (order_item.order_id, order_item.item_id)
+        if key not in kept:
+            kept[key] = order_item
+            continue
+        kept[key].quantity += order_item.quantity
+        kept[key].save(update_fields=['quantity'])
+        order_item.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('simple_app', '0006_paymentintentrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='session_key',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(merge_duplicate_order_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='unique_order_item'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+# Поле с Decimal-значением -> поле с целым значением и множитель
+CONVERSIONS = {
+    'item': [('price', 'price_minor', 100)],
+    'order': [('total_price', 'total_minor', 100)],
+    'discount': [('rate', 'rate_bp', 100)],
+    'tax': [('rate', 'rate_bp', 100)],
+}
+BATCH_SIZE = 1000
+
+
+def _convert(apps, forward):
+    for model_name, fields in CONVERSIONS.items():
+        model = apps.get_model('simple_app', model_name)
+        targets = [target if forward else source for source, target, _ in fields]
+        batch = []
+        for obj in model.objects.only('pk', *[name for field in fields for name in field[:2]]).iterator(BATCH_SIZE):
+            for source, target, scale in fields:
+                if forward:
+                    value = Decimal(getattr(obj, source) or 0) * scale
+                    setattr(obj, target, int(value.quantize(1, rounding=ROUND_HALF_UP)))
+                else:
+                    setattr(obj, source, Decimal(getattr(obj, target)) / scale)
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_update(batch, targets)
+                batch = []
+        model.objects.bulk_update(batch, targets)
+
+
+def to_minor_units(apps, schema_editor):
+    _convert(apps, forward=True)
+
+
+def to_decimal(apps, schema_editor):
+    _convert(apps, forward=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_app', '0010_item_stripe_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='price_minor',
+            field=models.BigIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='rate_bp',
+            field=models.PositiveIntegerField(default=0, help_text='Скидка от общей стоимости заказа в сотых долях процента'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tax',
+            name='rate_bp',
+            field=models.PositiveIntegerField(default=0, help_text='Налог в сотых долях процента'),
+            preserve_default=False,
+        ),
+        # Обратная миграция заполняет Decimal-поля, поэтому при откате они должны существовать
+        migrations.AlterField(
+            model_name='item',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='discount',
+            name='rate',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True,
+                                      help_text='Процент скидки от общей стоимости заказа'),
+        ),
+        migrations.AlterField(
+            model_name='tax',
+            name='rate',
+            field=models.DecimalField(decimal_places=2, max_digits=5, null=True),
+        ),
+        migrations.RunPython(to_minor_units, to_decimal),
+        migrations.RemoveField(model_name='item', name='price'),
+        migrations.RemoveField(model_name='order', name='total_price'),
+        migrations.RemoveField(model_name='discount', name='rate'),
+        migrations.RemoveField(model_name='tax', name='rate'),
+    ]
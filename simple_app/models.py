@@ -1,5 +1,11 @@
-import stripe
-from django.db import models
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .money import Money, from_basis_points, from_minor, to_basis_points, to_minor
+from .pricing import OrderTotals
 
 
 class Item(models.Model):
@@ -12,54 +18,202 @@ class Item(models.Model):
 
     name = models.CharField(max_length=255)
     description = models.TextField()
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Цена в минимальных единицах валюты (центах/копейках); price - она же в Decimal
+    price_minor = models.BigIntegerField()
     currency = models.CharField(max_length=3,
                                 choices=CURRENCY_CHOICES,
                                 default=USD
                                 )
+    updated_at = models.DateTimeField(auto_now=True)
+    # Копия товара в каталоге Stripe (команда sync_stripe_catalog): Product и Price аккаунта валюты
+    # stripe_currency, цена stripe_unit_amount в копейках; stripe_synced_at - updated_at синхронизированной версии
+    stripe_product_id = models.CharField(max_length=255, blank=True, default='')
+    stripe_price_id = models.CharField(max_length=255, blank=True, default='')
+    stripe_currency = models.CharField(max_length=3, blank=True, default='')
+    stripe_unit_amount = models.PositiveIntegerField(null=True, blank=True)
+    stripe_synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Каталог: фильтр по валюте с курсором по id
+            models.Index(fields=['currency', 'id'], name='item_currency_id_idx'),
+        ]
+
+    @property
+    def version(self):
+        """
+        Версия товара: меняется при каждом сохранении вместе с updated_at
+        """
+        return int(self.updated_at.timestamp() * 1_000_000)
+
+    @property
+    def price(self):
+        return from_minor(self.price_minor, self.currency)
+
+    @price.setter
+    def price(self, value):
+        self.price_minor = to_minor(value, self.currency)
+
+    @property
+    def unit_price(self):
+        return Money(self.price_minor, self.currency)
+
+    @property
+    def stripe_price(self):
+        """
+        ID цены Stripe, если в Stripe синхронизирована текущая версия товара, иначе None
+        """
+        if self.stripe_price_id and self.stripe_synced_at == self.updated_at:
+            return self.stripe_price_id
+        return None
+
+
+def _sum_by_order(queryset, expression, output_field):
+    """
+    Подзапрос суммы по заказу, который подставляется в аннотацию Order
+    """
+    subquery = queryset.filter(order=OuterRef('pk')).values('order').annotate(
+        total=Sum(expression, output_field=output_field)
+    ).values('total')
+    return Coalesce(Subquery(subquery, output_field=output_field), Value(0), output_field=output_field)
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_rates(self):
+        """
+        Добавляет к заказам суммарные ставки скидок и налогов в базисных пунктах
+        """
+        return self.annotate(
+            totals_discount_rate=_sum_by_order(Discount.objects.all(), F('rate_bp'), BigIntegerField()),
+            totals_tax_rate=_sum_by_order(Tax.objects.all(), F('rate_bp'), BigIntegerField()),
+        )
+
+    def with_totals(self):
+        """
+        Добавляет к заказам сумму товаров в копейках и суммарные ставки скидок и налогов одним запросом
+        """
+        return self.with_rates().annotate(
+            totals_subtotal=_sum_by_order(
+                OrderItem.objects.all(), F('quantity') * F('item__price_minor'), BigIntegerField(),
+            ),
+        )
 
 
 class Order(models.Model):
     items = models.ManyToManyField(Item, through="OrderItem")
-    total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Итог заказа в минимальных единицах валюты; total_price - он же в Decimal
+    total_minor = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=20, default='pending')  # Например: pending, paid, shipped, etc.
+    # Корзина принадлежит сессии посетителя, а после входа - пользователю
+    session_key = models.CharField(max_length=40, blank=True, default='')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='order_status_idx'),
+            # Корзина вошедшего пользователя: его незавершенный заказ
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ]
 
-    def calculate_total_price(self):
+    _totals = None
+
+    def get_totals(self, refresh=False):
+        """
+        Итоги заказа. Берутся из аннотаций with_totals(), если заказ загружен с ними,
+        иначе считаются одним агрегирующим запросом и запоминаются в экземпляре.
+        """
+        if self._totals is None and not refresh and hasattr(self, 'totals_subtotal'):
+            self._totals = OrderTotals(self.totals_subtotal, self.totals_discount_rate, self.totals_tax_rate)
+        if self._totals is None or refresh:
+            row = Order.objects.filter(pk=self.pk).with_totals().values(
+                'totals_subtotal', 'totals_discount_rate', 'totals_tax_rate'
+            ).get()
+            self._totals = OrderTotals(row['totals_subtotal'], row['totals_discount_rate'], row['totals_tax_rate'])
+        return self._totals
+
+    def calculate_total_price(self, totals=None):
         '''
-        Вычисляет общую стоимость с налогом и скидкой
+        Вычисляет общую стоимость с налогом и скидкой. Заказ сохраняется, только если сумма изменилась.
+        Уже посчитанные итоги (например, из сводки корзины) можно передать в totals.
         '''
-        items_total = sum(item.get_cost() for item in self.order_items.all())
-        discounts = sum(items_total * (discount.rate / 100) for discount in self.discount_set.all())
-        taxes = sum((items_total - discounts) * tax.rate / 100 for tax in self.tax_set.all())
-        self.total_price = items_total - discounts + taxes
-        self.save()
+        if totals is None:
+            totals = self.get_totals(refresh=True)
+        self._totals = totals
+        if self.total_minor != totals.total:
+            self.total_minor = totals.total
+            self.save(update_fields=['total_minor', 'updated_at'])
+        return totals
+
+    def apply_line_delta(self, amount):
+        """
+        Инкрементально меняет total_minor на изменение суммы строк (amount - в копейках, без скидок и налогов)
+        одним атомарным UPDATE, без пересчета всего заказа. Возможное расхождение в копейку
+        из-за округления устраняется полным пересчетом при оформлении заказа.
+        """
+        rates = Order.objects.filter(pk=self.pk).with_rates().values('totals_discount_rate', 'totals_tax_rate').get()
+        delta = OrderTotals(amount, rates['totals_discount_rate'], rates['totals_tax_rate']).total
+        Order.objects.filter(pk=self.pk).update(total_minor=F('total_minor') + delta, updated_at=timezone.now())
+        self._totals = None
+        return delta
+
+    @property
+    def total_price(self):
+        return from_minor(self.total_minor)
 
     @property
     def total_price_before_discounts(self):
         """Возвращает общую стоимость заказа без учета скидок."""
-        return sum(order_item.item.price * order_item.quantity for order_item in self.order_items.all())
+        return from_minor(self.get_totals().subtotal)
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def add_quantity(self, order, item, quantity):
+        """
+        Добавляет товар в заказ одним атомарным upsert-запросом:
+        новая строка создается, у существующей количество увеличивается на стороне базы.
+        """
+        table = connection.ops.quote_name(OrderItem._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (order_id, item_id, quantity) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (order_id, item_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity',
+                [order.pk, item.pk, quantity],
+            )
 
 
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, related_name='order_items', on_delete=models.CASCADE)
+    # Отдельный индекс по order не нужен: его покрывает уникальный индекс (order, item)
+    order = models.ForeignKey(Order, related_name='order_items', on_delete=models.CASCADE, db_index=False)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'item'], name='unique_order_item'),
+        ]
+
     def get_cost(self):
-        return self.item.price * self.quantity
+        return self.item.unit_price * self.quantity
 
 
 def create_payment_intent(order):
     """
     функция для создания PaymentIntent в Stripe при подтверждении заказа
     """
+    # stripe SDK загружается при первом платеже, а не при старте воркера
+    from .stripe_clients import get_stripe_client
+
     # Предполагается, что все товары в заказе в одной валюте
     currency = order.items.first().currency
-    amount = int(order.total_price * 100)  # Stripe работает с центами/копейками
+    amount = order.total_minor  # Stripe работает с центами/копейками
 
-    payment_intent = stripe.PaymentIntent.create(
+    payment_intent = get_stripe_client(currency).create_payment_intent(
         amount=amount,
         currency=currency,
         metadata={'order_id': order.id},
@@ -67,18 +221,73 @@ def create_payment_intent(order):
     return payment_intent
 
 
-class Discount(models.Model):
+class _RateMixin:
+    """
+    Ставка хранится в базисных пунктах (rate_bp), rate - она же в процентах
+    """
+
+    @property
+    def rate(self):
+        return from_basis_points(self.rate_bp)
+
+    @rate.setter
+    def rate(self, value):
+        self.rate_bp = to_basis_points(value)
+
+
+class Discount(_RateMixin, models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    rate = models.DecimalField(max_digits=5, decimal_places=2, help_text="Процент скидки от общей стоимости заказа")
+    rate_bp = models.PositiveIntegerField(help_text="Скидка от общей стоимости заказа в сотых долях процента")
 
     @property
     def amount(self):
-        return (self.rate / 100) * self.order.total_price_before_discounts
+        return from_minor(self.order.get_totals().discount_amount(self.rate_bp))
 
     def __str__(self):
         return f"{self.rate}% discount for Order {self.order.id}"
 
 
-class Tax(models.Model):
+class Tax(_RateMixin, models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    rate = models.DecimalField(max_digits=5, decimal_places=2)
+    rate_bp = models.PositiveIntegerField(help_text="Налог в сотых долях процента")
+
+
+class PaymentIntentRecord(models.Model):
+    """
+    Созданный в Stripe PaymentIntent. Повторно используется для той же области
+    (заказ или товар в рамках сессии) и валюты, пока платеж не завершен.
+    """
+    FINAL_STATUSES = ('succeeded', 'canceled')
+
+    scope_key = models.CharField(max_length=255, unique=True)
+    currency = models.CharField(max_length=3)
+    amount = models.PositiveIntegerField(help_text="Сумма в минимальных единицах валюты (центы/копейки)")
+    stripe_id = models.CharField(max_length=255, unique=True)
+    client_secret = models.CharField(max_length=255)
+    status = models.CharField(max_length=40)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.stripe_id} ({self.scope_key})"
+
+
+class WebhookEvent(models.Model):
+    """
+    Входящий ящик событий Stripe: вебхук только сохраняет событие, обрабатывает его
+    команда process_webhooks. Повторная доставка того же события не создает новую строку.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Очередь на обработку: только необработанные события, в порядке поступления
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='webhook_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+DEFAULT_CURRENCY = 'USD'
+# Число знаков дробной части валюты: суммы хранятся в минимальных единицах (центах/копейках)
+MINOR_UNIT_DIGITS = {'USD': 2, 'EUR': 2}
+# Ставки скидок и налогов хранятся в базисных пунктах: 1 bp = 0,01%
+BASIS_POINTS = 10_000
+
+
+def minor_unit_digits(currency=None):
+    return MINOR_UNIT_DIGITS.get(currency or DEFAULT_CURRENCY, 2)
+
+
+def round_half_up(numerator, denominator):
+    """
+    Целочисленное деление с округлением половины от нуля - единое правило округления денег
+    """
+    if numerator < 0:
+        return -round_half_up(-numerator, denominator)
+    quotient, remainder = divmod(numerator, denominator)
+    return quotient + 1 if remainder * 2 >= denominator else quotient
+
+
+def to_minor(value, currency=None):
+    """
+    Сумма (Decimal, строка или число) в минимальных единицах валюты
+    """
+    return int(Decimal(str(value)).scaleb(minor_unit_digits(currency)).quantize(1, rounding=ROUND_HALF_UP))
+
+
+def from_minor(amount, currency=None):
+    return Decimal(amount).scaleb(-minor_unit_digits(currency))
+
+
+def to_basis_points(rate):
+    """
+    Ставка в процентах ('7.5', Decimal) в базисных пунктах
+    """
+    return int(Decimal(str(rate)).scaleb(2).quantize(1, rounding=ROUND_HALF_UP))
+
+
+def from_basis_points(rate_bp):
+    return Decimal(rate_bp).scaleb(-2)
+
+
+def percent_of(amount, rate_bp):
+    """
+    Доля rate_bp (в базисных пунктах) от суммы amount в минимальных единицах, с округлением
+    """
+    return round_half_up(amount * rate_bp, BASIS_POINTS)
+
+
+@dataclass(frozen=True)
+class Money:
+    """
+    Денежная сумма: целое число минимальных единиц и валюта. Арифметика только целочисленная,
+    округление одно - round_half_up. Суммы в разных валютах не складываются.
+    """
+    amount: int
+    currency: str = DEFAULT_CURRENCY
+
+    @classmethod
+    def from_decimal(cls, value, currency=DEFAULT_CURRENCY):
+        return cls(to_minor(value, currency), currency)
+
+    def to_decimal(self):
+        return from_minor(self.amount, self.currency)
+
+    def _check(self, other):
+        if self.currency != other.currency:
+            raise ValueError(f'Суммы в разных валютах: {self.currency} и {other.currency}')
+
+    def __add__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        self._check(other)
+        return Money(self.amount + other.amount, self.currency)
+
+    def __radd__(self, other):
+        # sum() начинает с 0
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __sub__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        self._check(other)
+        return Money(self.amount - other.amount, self.currency)
+
+    def __mul__(self, quantity):
+        if not isinstance(quantity, int):
+            return NotImplemented
+        return Money(self.amount * quantity, self.currency)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.amount, self.currency)
+
+    def __bool__(self):
+        return self.amount != 0
+
+    def percent(self, rate_bp):
+        return Money(percent_of(self.amount, rate_bp), self.currency)
+
+    def __str__(self):
+        return str(self.to_decimal())
@@ -0,0 +1,87 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from .models import Item
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache():
+    return caches[settings.ITEM_PAGE_CACHE_ALIAS]
+
+
+def _pointer_key(item_id):
+    return f'item_detail:pointer:{item_id}'
+
+
+def _page_key(item_id, version, currency, publishable_key):
+    key_digest = hashlib.md5(publishable_key.encode()).hexdigest()[:12]
+    return f'item_detail:page:{item_id}:{version}:{currency}:{key_digest}'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_item_version(item_id):
+    """
+    Текущие (версия, валюта) товара из указателя item_detail:pointer:<id> или None.
+
+    Указатель обновляется при каждом сохранении товара, поэтому версию можно узнать
+    без запроса к базе. Без указателя страница в кеше недостижима - это промах.
+    """
+    pointer = _cache().get(_pointer_key(item_id))
+    if pointer is None:
+        _count('misses')
+    return pointer
+
+
+def get_item_page(item_id, version, currency, publishable_key):
+    """
+    Возвращает закешированную страницу версии version товара или None
+    """
+    page = _cache().get(_page_key(item_id, version, currency, publishable_key))
+    if page is None:
+        _count('misses')
+        return None
+    _count('hits')
+    content, content_type = page
+    return HttpResponse(content, content_type=content_type)
+
+
+def store_item_page(item, publishable_key, response):
+    cache = _cache()
+    timeout = settings.ITEM_PAGE_CACHE_TIMEOUT
+    # add, а не set: если товар уже сохранили заново, указатель на новую версию не перезаписываем
+    cache.add(_pointer_key(item.pk), (item.version, item.currency), timeout)
+    cache.set(
+        _page_key(item.pk, item.version, item.currency, publishable_key),
+        (response.content, response['Content-Type']),
+        timeout,
+    )
+
+
+@receiver(post_save, sender=Item, dispatch_uid='item_page_cache_on_save')
+def _item_saved(sender, instance, **kwargs):
+    # Старые страницы становятся недостижимы и вытесняются по таймауту
+    _cache().set(_pointer_key(instance.pk), (instance.version, instance.currency), settings.ITEM_PAGE_CACHE_TIMEOUT)
+
+
+@receiver(post_delete, sender=Item, dispatch_uid='item_page_cache_on_delete')
+def _item_deleted(sender, instance, **kwargs):
+    _cache().delete(_pointer_key(instance.pk))
+
+
+def page_cache_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PaymentIntentRecord
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _idempotency_key(*parts):
+    return hashlib.sha256(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+async def _single_flight(key, call):
+    """
+    Объединяет одновременные одинаковые вызовы: выполняется только первый,
+    остальные ждут его результат. Работает и между потоками, и между циклами событий.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        return await asyncio.wrap_future(future)
+    try:
+        result = await call()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+
+def _status_is_fresh(record):
+    max_age = settings.PAYMENT_INTENTS['STATUS_MAX_AGE']
+    return timezone.now() - record.updated_at < timedelta(seconds=max_age)
+
+
+async def _acquire(scope_key, currency, amount, params):
+    # stripe SDK загружается при первом платеже, а не при старте воркера
+    import stripe
+    from .stripe_clients import get_async_stripe_client
+
+    client = get_async_stripe_client(currency)
+    record = await PaymentIntentRecord.objects.filter(scope_key=scope_key).afirst()
+
+    if record is not None and record.status not in PaymentIntentRecord.FINAL_STATUSES:
+        status = record.status
+        if not _status_is_fresh(record):
+            # Статус записи обновляют вебхуки, а они могут быть не настроены или запаздывать:
+            # давно не обновлявшийся статус сверяется со Stripe
+            status = (await client.retrieve_payment_intent(record.stripe_id)).status
+        if status not in PaymentIntentRecord.FINAL_STATUSES:
+            try:
+                if record.amount != amount:
+                    # Сумма изменилась - обновляем существующий PaymentIntent вместо создания нового.
+                    # updated_at записи в ключе: при возврате к прежней сумме (A -> B -> A) ключ новый,
+                    # иначе Stripe вернул бы сохраненный ответ на прошлое обновление и сумму не изменил
+                    status = (await client.update_payment_intent(
+                        record.stripe_id,
+                        idempotency_key=_idempotency_key('update', record.stripe_id, record.updated_at.isoformat(),
+                                                         amount),
+                        amount=amount,
+                    )).status
+            except stripe.InvalidRequestError as e:
+                # PaymentIntent завершился, а вебхук об этом еще не пришел - создаем новый
+                if e.code != 'payment_intent_unexpected_state':
+                    raise
+            else:
+                # Сохранение и после сверки статуса: updated_at отсчитывает окно актуальности заново
+                if (record.amount, record.status) != (amount, status) or not _status_is_fresh(record):
+                    record.amount, record.status = amount, status
+                    await record.asave(update_fields=['amount', 'status', 'updated_at'])
+                return record
+
+    generation = record.stripe_id if record is not None else 'new'
+    intent = await client.create_payment_intent(
+        idempotency_key=_idempotency_key('create', scope_key, generation, amount),
+        amount=amount,
+        currency=currency,
+        **params,
+    )
+    record, created = await PaymentIntentRecord.objects.aupdate_or_create(
+        scope_key=scope_key,
+        defaults={
+            'currency': currency,
+            'amount': amount,
+            'stripe_id': intent.id,
+            'client_secret': intent.client_secret,
+            'status': intent.status,
+        },
+    )
+    return record
+
+
+async def acquire_payment_intent(scope, currency, amount, **params):
+    """
+    Возвращает PaymentIntentRecord для области (например, 'order:12') и валюты.
+
+    Незавершенный PaymentIntent переиспользуется: статус записи сверяется со Stripe, только если
+    он старше PAYMENT_INTENTS['STATUS_MAX_AGE']; при изменении суммы PaymentIntent обновляется
+    в Stripe, оплаченный или отмененный (в том числе отклонивший обновление) заменяется новым.
+    Ключи идемпотентности Stripe выводятся из области и суммы, поэтому повторы запросов
+    из разных процессов не создают лишних PaymentIntent.
+    """
+    scope_key = f'{scope}:{currency}'
+    while True:
+        record = await _single_flight(scope_key, lambda: _acquire(scope_key, currency, amount, params))
+        # Ожидали чужой запрос с другой суммой - повторяем уже со своей
+        if record.amount == amount:
+            return record
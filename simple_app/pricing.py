@@ -0,0 +1,211 @@
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from .money import Money, from_basis_points, percent_of, round_half_up, to_minor
+
+
+def to_minor_units(value, currency=None) -> int:
+    """
+    Сумма в копейках/центах, как ее ожидает Stripe
+    """
+    return to_minor(value, currency)
+
+
+@dataclass(frozen=True)
+class OrderTotals:
+    """
+    Итоги заказа в минимальных единицах валюты. Скидки считаются от суммы товаров, налоги - от суммы
+    после скидок, поэтому для расчета достаточно суммы товаров и суммарных ставок скидок и налогов
+    (в базисных пунктах). Суммарная скидка и суммарный налог округляются до копейки один раз
+    по round_half_up; по отдельным ставкам они распределяются в discount_amounts и tax_amounts.
+    """
+    subtotal: int = 0
+    discount_rate: int = 0
+    tax_rate: int = 0
+
+    def discount_amount(self, rate: int) -> int:
+        return percent_of(self.subtotal, rate)
+
+    def tax_amount(self, rate: int) -> int:
+        return percent_of(self.subtotal - self.discounts, rate)
+
+    def discount_amounts(self, rates) -> Tuple[int, ...]:
+        """
+        Суммы скидок по ставкам rates (в сумме discount_rate): их сумма равна discounts
+        """
+        return _allocate(self.subtotal, rates)
+
+    def tax_amounts(self, rates) -> Tuple[int, ...]:
+        """
+        Суммы налогов по ставкам rates (в сумме tax_rate): их сумма равна taxes
+        """
+        return _allocate(self.subtotal - self.discounts, rates)
+
+    @property
+    def discounts(self) -> int:
+        return self.discount_amount(self.discount_rate)
+
+    @property
+    def taxes(self) -> int:
+        return self.tax_amount(self.tax_rate)
+
+    @property
+    def total(self) -> int:
+        return self.subtotal - self.discounts + self.taxes
+
+
+@dataclass(frozen=True)
+class CartLine:
+    item_id: int
+    name: str
+    quantity: int
+    unit_price: Money
+    line_total: Money
+    # Цена Stripe текущей версии товара, если товар синхронизирован
+    stripe_price: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CartAdjustment:
+    """
+    Скидка или налог: ставка в базисных пунктах и рассчитанная сумма
+    """
+    rate_bp: int
+    amount: Money
+
+    @property
+    def rate(self) -> Decimal:
+        """Ставка в процентах для отображения"""
+        return from_basis_points(self.rate_bp)
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    """
+    Полностью рассчитанная корзина для отображения: шаблону не нужно обращаться к базе
+    """
+    order_id: Optional[int]
+    currency: str
+    lines: Tuple[CartLine, ...] = ()
+    discounts: Tuple[CartAdjustment, ...] = ()
+    taxes: Tuple[CartAdjustment, ...] = ()
+    totals: OrderTotals = field(default_factory=OrderTotals)
+
+    @property
+    def subtotal(self) -> Money:
+        return Money(self.totals.subtotal, self.currency)
+
+    @property
+    def total(self) -> Money:
+        return Money(self.totals.total, self.currency)
+
+
+@dataclass(frozen=True)
+class PricedLine:
+    """
+    Строка заказа с распределенными на нее скидкой и налогом, суммы в копейках
+    """
+    name: str
+    quantity: int
+    gross_minor: int
+    discount_minor: int
+    tax_minor: int
+    stripe_price: Optional[str] = None
+
+    @property
+    def net_minor(self) -> int:
+        return self.gross_minor - self.discount_minor
+
+
+@dataclass(frozen=True)
+class CheckoutPricing:
+    currency: str
+    lines: Tuple[PricedLine, ...]
+    tax_minor: int
+    total_minor: int
+
+    def line_items(self):
+        """
+        line_items для Stripe Checkout. Отрицательные суммы Stripe не принимает,
+        поэтому скидка входит в цену строк, а налог выводится отдельной строкой.
+        Строка без скидки синхронизированного товара ссылается на его цену Stripe,
+        остальные передают цену целиком в price_data. Строки с нулевым количеством пропускаются:
+        их сумма нулевая, а Stripe такие позиции не принимает.
+        """
+        currency = self.currency.lower()
+        line_items = []
+        for line in self.lines:
+            if line.quantity == 0:
+                continue
+            if line.stripe_price and line.discount_minor == 0:
+                line_items.append({'price': line.stripe_price, 'quantity': line.quantity})
+                continue
+            if line.net_minor % line.quantity == 0:
+                name, unit_amount, quantity = line.name, line.net_minor // line.quantity, line.quantity
+            else:
+                name, unit_amount, quantity = f'{line.name} × {line.quantity}', line.net_minor, 1
+            line_items.append({
+                'price_data': {
+                    'currency': currency,
+                    'product_data': {'name': name},
+                    'unit_amount': unit_amount,
+                },
+                'quantity': quantity,
+            })
+        if self.tax_minor > 0:
+            line_items.append({
+                'price_data': {
+                    'currency': currency,
+                    'product_data': {'name': 'Tax'},
+                    'unit_amount': self.tax_minor,
+                },
+                'quantity': 1,
+            })
+        return line_items
+
+
+def _allocate(amount, rates):
+    # Нарастающим итогом: последняя накопленная сумма - это percent_of от суммы ставок
+    running_rate = before = 0
+    amounts = []
+    for rate in rates:
+        running_rate += rate
+        amounts.append(percent_of(amount, running_rate) - before)
+        before += amounts[-1]
+    return tuple(amounts)
+
+
+def _share(total, part, whole):
+    return round_half_up(total * part, whole) if total and whole else 0
+
+
+def price_checkout(cart: CartSummary) -> CheckoutPricing:
+    """
+    Распределяет скидки и налоги заказа по строкам корзины за один проход в целых копейках.
+
+    Доли считаются нарастающим итогом, поэтому сумма строк всегда равна итогу заказа
+    и совпадает с OrderTotals.total.
+    """
+    totals = cart.totals
+    discount_total, tax_total = totals.discounts, totals.taxes
+    net_total = totals.subtotal - discount_total
+    gross_running = net_running = discount_before = tax_before = 0
+    lines = []
+    for line in cart.lines:
+        gross_minor = line.line_total.amount
+        gross_running += gross_minor
+        discount = _share(discount_total, gross_running, totals.subtotal) - discount_before
+        discount_before += discount
+        net_running += gross_minor - discount
+        tax = _share(tax_total, net_running, net_total) - tax_before
+        tax_before += tax
+
+        # Позиционные аргументы: конструктор frozen-датакласса заметно дешевле без именованных
+        lines.append(PricedLine(line.name, line.quantity, gross_minor, discount, tax, line.stripe_price))
+    return CheckoutPricing(
+        currency=cart.currency,
+        lines=tuple(lines),
+        tax_minor=tax_before,
+        total_minor=net_running + tax_before,
+    )
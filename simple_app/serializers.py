@@ -4,6 +4,45 @@ from .models import Item
 
 
 class ItemSerializer(serializers.ModelSerializer):
+    # Цена хранится в минимальных единицах валюты, в API она - десятичная строка
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+
     class Meta:
         model = Item
         fields = ['id', 'name', 'description', 'price', 'currency']
+
+
+class ItemCatalogSerializer(ItemSerializer):
+    """
+    Сериализатор каталога: поддерживает выборочные поля (fields=id,name,...)
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    class Meta(ItemSerializer.Meta):
+        fields = ItemSerializer.Meta.fields + ['updated_at']
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """
+    Операция пакетного изменения корзины: add - добавить количество,
+    set - установить количество (0 удаляет строку), remove - удалить строку
+    """
+    OPS = ('add', 'set', 'remove')
+
+    item_id = serializers.IntegerField()
+    op = serializers.ChoiceField(choices=OPS, default='add')
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Для add количество должно быть положительным'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from django.db.models import F
+
+from .item_cache import invalidate_items
+from .models import Item
+from .stripe_clients import get_stripe_client
+
+SYNC_FIELDS = ['stripe_product_id', 'stripe_price_id', 'stripe_currency', 'stripe_unit_amount', 'stripe_synced_at']
+
+
+def pending_items():
+    """
+    Товары, текущая версия которых еще не отправлена в Stripe
+    """
+    return Item.objects.exclude(stripe_synced_at=F('updated_at'))
+
+
+def sync_item(item):
+    """
+    Создает или обновляет Product и Price товара в аккаунте его валюты и записывает их id в item (без сохранения).
+
+    Цены Stripe неизменяемы: при смене цены создается новая Price, а прежняя деактивируется.
+    После смены валюты товар создается заново в аккаунте новой валюты. Ключи идемпотентности
+    привязаны к операции, объекту и версии товара, поэтому повтор после сбоя не создает дубликатов,
+    а разные запросы никогда не получают один ключ (Stripe отклоняет ключ с другими параметрами).
+    """
+    client = get_stripe_client(item.currency)
+    currency, amount = item.currency, item.price_minor
+    product_id = item.stripe_product_id if item.stripe_currency == currency else ''
+
+    if product_id:
+        client.update_product(product_id, idempotency_key=f'catalog:product:update:{product_id}:{item.version}',
+                              name=item.name, description=item.description)
+    else:
+        product = client.create_product(
+            idempotency_key=f'catalog:product:create:{item.pk}:{item.version}', name=item.name,
+            metadata={'item_id': item.pk}, **({'description': item.description} if item.description else {}),
+        )
+        product_id = product.id
+
+    price_id = item.stripe_price_id
+    if product_id != item.stripe_product_id or amount != item.stripe_unit_amount or not price_id:
+        price_id = client.create_price(idempotency_key=f'catalog:price:create:{product_id}:{item.version}',
+                                       product=product_id, currency=currency.lower(), unit_amount=amount).id
+        if item.stripe_price_id and product_id == item.stripe_product_id:
+            client.update_price(item.stripe_price_id, idempotency_key=f'catalog:price:deactivate:{item.stripe_price_id}',
+                                active=False)
+
+    item.stripe_product_id, item.stripe_price_id = product_id, price_id
+    item.stripe_currency, item.stripe_unit_amount = currency, amount
+    item.stripe_synced_at = item.updated_at
+    return item
+
+
+def _try_sync(item):
+    try:
+        return sync_item(item), None
+    except stripe.StripeError as e:
+        return item, e
+
+
+def sync_catalog(batch_size=100, concurrency=4, full=False, on_batch=None):
+    """
+    Синхронизирует каталог со Stripe пачками по batch_size товаров.
+
+    Вызовы Stripe внутри пачки идут параллельно в concurrency потоков, id сохраняются одним bulk_update
+    на пачку. Без full отправляются только товары, измененные после прошлой синхронизации;
+    товар, измененный во время синхронизации, останется в очереди до следующего запуска.
+    Возвращает число синхронизированных товаров и список (item_id, ошибка) для остальных.
+    """
+    queryset = Item.objects.all() if full else pending_items()
+    synced, failed, last_pk = 0, [], 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            done = []
+            for item, error in pool.map(_try_sync, batch):
+                if error is None:
+                    done.append(item)
+                else:
+                    failed.append((item.pk, error))
+            Item.objects.bulk_update(done, SYNC_FIELDS)
+            # bulk_update не вызывает post_save: кешированные копии товаров сбрасываются явно
+            invalidate_items(item.pk for item in done)
+            synced += len(done)
+            if on_batch is not None:
+                on_batch(len(done), len(batch) - len(done))
+    return synced, failed
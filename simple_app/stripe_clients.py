@@ -0,0 +1,441 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+import weakref
+from urllib.parse import urlencode
+
+import httpx
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+
+from config import load_config
+from .fake_stripe import FakeStripe
+from .metrics import stripe_call
+
+
+def _should_retry(error):
+    """
+    Повторяются сетевые ошибки, 429 и ответы 5xx - как в stripe SDK
+    """
+    if isinstance(error, (stripe.APIConnectionError, stripe.RateLimitError)):
+        return True
+    return isinstance(error, stripe.APIError) and (error.http_status or 0) >= 500
+
+
+def _retry_delay(attempt):
+    return min(0.5 * 2 ** attempt, 8.0)
+
+
+def _retry_key(method, idempotency_key, max_retries):
+    # Повтор POST без ключа идемпотентности мог бы создать объект дважды
+    if idempotency_key is None and max_retries and method == 'post':
+        return str(uuid.uuid4())
+    return idempotency_key
+
+
+def _request_headers(api_key, method, idempotency_key=None):
+    """
+    Заголовки запроса к Stripe API, как их отправляет stripe SDK
+    """
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'User-Agent': f'Stripe/v1 PythonBindings/{stripe.VERSION}',
+    }
+    if stripe.api_version:
+        headers['Stripe-Version'] = stripe.api_version
+    if method == 'post':
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
+    return headers
+
+
+def _api_error(status, payload, body=None, headers=None):
+    """
+    Ошибка stripe по ответу Stripe API с кодом не 2xx - то же соответствие кодов и типов, что в stripe SDK
+    """
+    error = payload.get('error') if isinstance(payload, dict) else None
+    if not isinstance(error, dict):
+        return stripe.APIError(f'Некорректный ответ Stripe (HTTP {status}): {body!r}', body, status, payload, headers)
+    message, param, code = error.get('message'), error.get('param'), error.get('code')
+    if status == 429 or (status == 400 and code == 'rate_limit'):
+        return stripe.RateLimitError(message, body, status, payload, headers)
+    if status in (400, 404):
+        if error.get('type') == 'idempotency_error':
+            return stripe.IdempotencyError(message, body, status, payload, headers)
+        return stripe.InvalidRequestError(message, param, code, body, status, payload, headers)
+    if status == 401:
+        return stripe.AuthenticationError(message, body, status, payload, headers)
+    if status == 402:
+        return stripe.CardError(message, param, code, body, status, payload, headers)
+    if status == 403:
+        return stripe.PermissionError(message, body, status, payload, headers)
+    return stripe.APIError(message, body, status, payload, headers)
+
+
+def _form_items(params, prefix=None):
+    """
+    Параметры запроса в виде полей формы, как их принимает Stripe API: вложенные словари
+    и списки разворачиваются в ключи вида metadata[order_id] и line_items[0][quantity]
+    """
+    for key, value in params.items():
+        yield from _form_value(f'{prefix}[{key}]' if prefix else key, value)
+
+
+def _form_value(name, value):
+    if value is None:
+        return
+    if isinstance(value, dict):
+        yield from _form_items(value, name)
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            yield from _form_value(f'{name}[{index}]', item)
+    elif isinstance(value, bool):
+        yield name, 'true' if value else 'false'
+    else:
+        yield name, value
+
+
+def _stripe_object(api_key, params, status, payload, body=None, headers=None):
+    if not 200 <= status < 300:
+        raise _api_error(status, payload, body, headers)
+    return stripe.convert_to_stripe_object(payload, api_key, params=params)
+
+
+class StripeClient:
+    """
+    Долгоживущий клиент Stripe для одного аккаунта (ключа).
+
+    Ключ передается в каждый запрос явно, глобальный stripe.api_key не используется.
+    Запрос собирается без внутренних классов stripe SDK: заголовки - _request_headers, ошибки - _api_error.
+    Соединения переиспользуются через пул keep-alive сессии requests ограниченного размера.
+    Сетевые ошибки, 429 и 5xx повторяются до max_retries раз с экспоненциальной паузой.
+    """
+
+    def __init__(self, secret_key, api_base=None, connect_timeout=5, read_timeout=30, pool_size=10, max_retries=0):
+        self.api_key = secret_key
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        # pool_block: при исчерпании пула запрос ждет свободное соединение, а не открывает лишнее
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.api_base = (api_base or stripe.api_base).rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+    def request(self, method, url, params=None, idempotency_key=None, operation=None):
+        idempotency_key = _retry_key(method, idempotency_key, self.max_retries)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stripe_call(operation or method):
+                    return self._send(method, url, params, idempotency_key)
+            except stripe.StripeError as e:
+                if attempt == self.max_retries or not _should_retry(e):
+                    raise
+            time.sleep(_retry_delay(attempt))
+
+    def _send(self, method, url, params, idempotency_key):
+        headers = _request_headers(self.api_key, method, idempotency_key)
+        encoded = urlencode(list(_form_items(params or {})), safe='[]')
+        url = self.api_base + url
+        try:
+            if method == 'get':
+                response = self.session.get(f'{url}?{encoded}' if encoded else url, headers=headers,
+                                            timeout=self.timeout)
+            else:
+                response = self.session.request(method.upper(), url, data=encoded, headers=headers,
+                                                timeout=self.timeout)
+        except requests.RequestException as e:
+            raise stripe.APIConnectionError(f'Ошибка соединения со Stripe: {e}') from e
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return _stripe_object(self.api_key, params, response.status_code, payload, response.text,
+                              dict(response.headers))
+
+    def create_payment_intent(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/payment_intents', params, idempotency_key, 'create_payment_intent')
+
+    def retrieve_payment_intent(self, intent_id):
+        return self.request('get', f'/v1/payment_intents/{intent_id}', operation='retrieve_payment_intent')
+
+    def update_payment_intent(self, intent_id, idempotency_key=None, **params):
+        return self.request('post', f'/v1/payment_intents/{intent_id}', params, idempotency_key,
+                            'update_payment_intent')
+
+    def create_checkout_session(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/checkout/sessions', params, idempotency_key, 'create_checkout_session')
+
+    def create_product(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/products', params, idempotency_key, 'create_product')
+
+    def update_product(self, product_id, idempotency_key=None, **params):
+        return self.request('post', f'/v1/products/{product_id}', params, idempotency_key, 'update_product')
+
+    def create_price(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/prices', params, idempotency_key, 'create_price')
+
+    def update_price(self, price_id, idempotency_key=None, **params):
+        return self.request('post', f'/v1/prices/{price_id}', params, idempotency_key, 'update_price')
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncStripeClient:
+    """
+    Неблокирующий клиент Stripe для одного аккаунта на httpx.AsyncClient.
+
+    Заголовки (_request_headers), ошибки (_api_error) и формат форм (_form_items) повторяют stripe SDK
+    без его внутренних классов, отличается только транспорт: ожидание ответа Stripe не занимает поток воркера.
+    """
+
+    def __init__(self, secret_key, api_base=None, connect_timeout=5, read_timeout=30, pool_size=10, max_retries=0):
+        self.api_key = secret_key
+        self.max_retries = max_retries
+        self.http = httpx.AsyncClient(
+            base_url=api_base or stripe.api_base,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def request(self, method, url, params=None, idempotency_key=None, operation=None):
+        idempotency_key = _retry_key(method, idempotency_key, self.max_retries)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stripe_call(operation or method):
+                    return await self._send(method, url, params, idempotency_key)
+            except stripe.StripeError as e:
+                if attempt == self.max_retries or not _should_retry(e):
+                    raise
+            await asyncio.sleep(_retry_delay(attempt))
+
+    async def _send(self, method, url, params, idempotency_key):
+        headers = _request_headers(self.api_key, method, idempotency_key)
+        encoded = urlencode(list(_form_items(params or {})), safe='[]')
+        try:
+            if method == 'get':
+                response = await self.http.get(f'{url}?{encoded}' if encoded else url, headers=headers)
+            else:
+                response = await self.http.request(method.upper(), url, content=encoded, headers=headers)
+        except httpx.HTTPError as e:
+            raise stripe.APIConnectionError(f'Ошибка соединения со Stripe: {e}') from e
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return _stripe_object(self.api_key, params, response.status_code, payload, response.text,
+                              dict(response.headers))
+
+    async def create_payment_intent(self, idempotency_key=None, **params):
+        return await self.request('post', '/v1/payment_intents', params, idempotency_key, 'create_payment_intent')
+
+    async def retrieve_payment_intent(self, intent_id):
+        return await self.request('get', f'/v1/payment_intents/{intent_id}', operation='retrieve_payment_intent')
+
+    async def update_payment_intent(self, intent_id, idempotency_key=None, **params):
+        return await self.request('post', f'/v1/payment_intents/{intent_id}', params, idempotency_key,
+                                  'update_payment_intent')
+
+    async def create_checkout_session(self, idempotency_key=None, **params):
+        return await self.request('post', '/v1/checkout/sessions', params, idempotency_key,
+                                  'create_checkout_session')
+
+    async def close(self):
+        await self.http.aclose()
+
+
+class ThreadedStripeClient:
+    """
+    Асинхронный интерфейс к синхронному StripeClient: запрос выполняется в потоке через sync_to_async.
+
+    Вне ASGI у каждого запроса свой короткий цикл событий (async_to_sync), и httpx.AsyncClient
+    на цикл создавался бы заново без переиспользования и закрытия соединений. Вместо этого
+    запросы идут через общий для процесса пул синхронного клиента.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def request(self, method, url, params=None, idempotency_key=None, operation=None):
+        return await sync_to_async(self.client.request, thread_sensitive=False)(
+            method, url, params, idempotency_key, operation)
+
+    async def create_payment_intent(self, idempotency_key=None, **params):
+        return await self.request('post', '/v1/payment_intents', params, idempotency_key, 'create_payment_intent')
+
+    async def retrieve_payment_intent(self, intent_id):
+        return await self.request('get', f'/v1/payment_intents/{intent_id}', operation='retrieve_payment_intent')
+
+    async def update_payment_intent(self, intent_id, idempotency_key=None, **params):
+        return await self.request('post', f'/v1/payment_intents/{intent_id}', params, idempotency_key,
+                                  'update_payment_intent')
+
+    async def create_checkout_session(self, idempotency_key=None, **params):
+        return await self.request('post', '/v1/checkout/sessions', params, idempotency_key,
+                                  'create_checkout_session')
+
+    async def close(self):
+        pass
+
+
+def _fake_response(client, fake, method, url, params, idempotency_key):
+    headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+    status, payload = fake.handle(method, url, params or {}, headers)
+    return _stripe_object(client.api_key, params, status, payload, json.dumps(payload))
+
+
+class InProcessStripeClient(StripeClient):
+    """
+    Клиент к FakeStripe в памяти процесса: без сети, задержка ответа дольше read_timeout
+    заканчивается ошибкой соединения, как у настоящего клиента
+    """
+
+    def __init__(self, secret_key, fake, read_timeout=30, max_retries=0, **options):
+        self.fake = fake
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.api_key = secret_key
+
+    def _send(self, method, url, params, idempotency_key):
+        delay = self.fake.next_delay()
+        time.sleep(min(delay, self.read_timeout))
+        if delay > self.read_timeout:
+            raise stripe.APIConnectionError('Превышено время ожидания ответа Stripe')
+        return _fake_response(self, self.fake, method, url, params, idempotency_key)
+
+    def close(self):
+        pass
+
+
+class AsyncInProcessStripeClient(AsyncStripeClient):
+    """
+    Асинхронный клиент к FakeStripe в памяти процесса
+    """
+
+    def __init__(self, secret_key, fake, read_timeout=30, max_retries=0, **options):
+        self.fake = fake
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.api_key = secret_key
+
+    async def _send(self, method, url, params, idempotency_key):
+        delay = self.fake.next_delay()
+        await asyncio.sleep(min(delay, self.read_timeout))
+        if delay > self.read_timeout:
+            raise stripe.APIConnectionError('Превышено время ожидания ответа Stripe')
+        return _fake_response(self, self.fake, method, url, params, idempotency_key)
+
+    async def close(self):
+        pass
+
+
+def _client_options():
+    options = settings.STRIPE_CLIENT
+    return {
+        'api_base': options.get('API_BASE'),
+        'connect_timeout': options.get('CONNECT_TIMEOUT', 5),
+        'read_timeout': options.get('READ_TIMEOUT', 30),
+        'pool_size': options.get('POOL_SIZE', 10),
+        'max_retries': options.get('MAX_RETRIES', 0),
+    }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_fakes = {}
+_fakes_lock = threading.Lock()
+
+
+def get_fake_stripe():
+    """
+    Общая для процесса заглушка FakeStripe с параметрами PAYMENT_GATEWAY['FAKE']
+    """
+    options = settings.PAYMENT_GATEWAY.get('FAKE', {})
+    key = tuple(sorted(options.items()))
+    with _fakes_lock:
+        if key not in _fakes:
+            _fakes[key] = FakeStripe(
+                latency=options.get('LATENCY', 0.0),
+                jitter=options.get('JITTER', 0.0),
+                error_rate=options.get('ERROR_RATE', 0.0),
+                rate_limit=options.get('RATE_LIMIT', 0),
+                seed=options.get('SEED', 0),
+            )
+        return _fakes[key]
+
+
+def _settings_key():
+    return json.dumps([settings.STRIPE_CLIENT, settings.PAYMENT_GATEWAY], sort_keys=True, default=str)
+
+
+def _create_client(secret_key, asynchronous):
+    """
+    Клиент платежного шлюза по PAYMENT_GATEWAY['BACKEND']: 'stripe' - Stripe API
+    (или его заглушка по STRIPE_CLIENT['API_BASE']), 'fake' - FakeStripe в памяти процесса
+    """
+    backend = settings.PAYMENT_GATEWAY['BACKEND']
+    if backend == 'fake':
+        client_class = AsyncInProcessStripeClient if asynchronous else InProcessStripeClient
+        return client_class(secret_key, get_fake_stripe(), **_client_options())
+    if backend != 'stripe':
+        raise ImproperlyConfigured(f'Неизвестный платежный шлюз: {backend}')
+    client_class = AsyncStripeClient if asynchronous else StripeClient
+    return client_class(secret_key, **_client_options())
+
+
+# Асинхронные клиенты привязаны к циклу событий, в котором созданы; используются только под ASGI
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_stripe_client(currency=None):
+    """
+    Клиент Stripe для аккаунта валюты. Клиенты создаются один раз на процесс;
+    при смене ключа в конфигурации создается новый клиент.
+    """
+    secret_key = load_config(path='.env', currency=currency).stripe.secret_key
+    key = (currency, secret_key, _settings_key())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_client(secret_key, asynchronous=False)
+                _clients[key] = client
+    return client
+
+
+def get_async_stripe_client(currency=None):
+    """
+    Асинхронный клиент Stripe для аккаунта валюты в текущем цикле событий.
+    Под ASGI цикл один на воркер, поэтому клиент и его пул соединений живут весь срок воркера.
+    Вне ASGI (SERVER_INTERFACE != 'asgi') циклы живут один запрос, поэтому возвращается
+    ThreadedStripeClient поверх долгоживущего синхронного клиента.
+    """
+    if settings.SERVER_INTERFACE != 'asgi':
+        return ThreadedStripeClient(get_stripe_client(currency))
+    secret_key = load_config(path='.env', currency=currency).stripe.secret_key
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (currency, secret_key, _settings_key())
+    if key not in clients:
+        clients[key] = _create_client(secret_key, asynchronous=True)
+    return clients[key]
+
+
+def reset_stripe_clients():
+    """
+    Закрывает все клиенты, например после fork или при смене настроек
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+    with _fakes_lock:
+        _fakes.clear()
@@ -1,11 +1,75 @@
-from unittest import mock
+import asyncio
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock, skipIf
 from unittest.mock import patch
 
+import stripe
+from asgiref.sync import async_to_sync
 from django.http import HttpResponse
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from dotenv import dotenv_values
+from environs import EnvError
 
-from .models import Item, Order
+from config import ConfigRegistry, get_registry, reload_config
+from Simple_solutions import staticfiles
+from . import item_cache, metrics
+from .cart import build_cart_summary
+from .fake_stripe import FakeStripeServer
+from .importers import MAX_ERRORS, RowParseError, iter_json_array
+from .item_cache import clear_item_cache, get_item_or_404, get_items, item_cache_stats
+from .models import Discount, Item, Order, OrderItem, PaymentIntentRecord, Tax, WebhookEvent
+from .payment_intents import acquire_payment_intent
+from .money import Money, round_half_up, to_minor
+from .pricing import price_checkout
+from .stripe_catalog import pending_items, sync_catalog
+from .stripe_clients import (
+    AsyncStripeClient, InProcessStripeClient, StripeClient, ThreadedStripeClient, _form_items, _request_headers,
+    get_async_stripe_client, get_fake_stripe, get_stripe_client,
+)
+
+# Платежный шлюз без сети для тестов платежных представлений
+FAKE_GATEWAY = {'BACKEND': 'fake', 'FAKE': {}}
+WEBHOOK_SECRET = 'whsec_test'
+
+
+def use_webhook_secret(test_case):
+    """
+    Задает секрет вебхуков аккаунта USD на время теста
+    """
+    patcher = mock.patch.dict(os.environ, {'STRIPE_WEBHOOK_SECRET_USD': WEBHOOK_SECRET})
+    patcher.start()
+    reload_config()
+    test_case.addCleanup(reload_config)
+    test_case.addCleanup(patcher.stop)
+
+
+def signed_webhook(client, event, secret=WEBHOOK_SECRET):
+    """
+    Отправляет событие на вебхук с подписью в формате заголовка Stripe-Signature
+    """
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return client.post(reverse('stripe_webhook', args=['USD']), payload, content_type='application/json',
+                       HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
 
 
 class ItemDetailViewTest(TestCase):
@@ -43,6 +107,513 @@ class AddToOrderViewTest(TestCase):
         self.assertEqual(order.order_items.first().quantity, 2)  # Проверяем, что количество товара равно 2
 
 
+class CartScopeTest(TestCase):
+    def setUp(self):
+        self.item = Item.objects.create(name='Test Item', price='10.00', currency='USD')
+
+    def test_carts_are_per_session(self):
+        """
+        Проверяет, что у разных посетителей разные корзины, а просмотр корзины не создает заказ
+        """
+        self.assertEqual(Client().get(reverse('cart_view')).status_code, 200)
+        self.assertEqual(Order.objects.count(), 0)
+
+        url = reverse('add_to_order', args=[self.item.id])
+        first, second = Client(), Client()
+        first.post(url, {'quantity': 2})
+        first.post(url, {'quantity': 3})
+        second.post(url, {'quantity': 1})
+
+        quantities = sorted(OrderItem.objects.values_list('quantity', flat=True))
+        self.assertEqual(quantities, [1, 5])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(first.get(reverse('cart_view')).context['cart'].lines[0].quantity, 5)
+
+    def test_total_updated_incrementally(self):
+        """
+        Проверяет, что инкрементальная общая стоимость совпадает с полным пересчетом
+        """
+        url = reverse('add_to_order', args=[self.item.id])
+        self.client.post(url, {'quantity': 1})
+        order = Order.objects.get()
+        Discount.objects.create(order=order, rate='10.00')
+        Tax.objects.create(order=order, rate='20.00')
+        order.calculate_total_price()
+        self.client.post(url, {'quantity': 2})
+
+        order.refresh_from_db()
+        incremental = order.total_price
+        order.calculate_total_price()
+        self.assertEqual(incremental, Decimal('32.40'))
+        self.assertEqual(order.total_price, incremental)
+
+
+class ClientCartStoreTest(TestCase):
+    def setUp(self):
+        self.items = [Item.objects.create(name=f'Item {index}', price='4.00', currency='USD') for index in range(3)]
+
+    def fill_and_checkout(self):
+        for item in self.items:
+            self.client.post(reverse('add_to_order', args=[item.id]), {'quantity': 2})
+        self.assertEqual(Order.objects.count(), 0)
+
+        cart = self.client.get(reverse('cart_view')).context['cart']
+        self.assertEqual([line.quantity for line in cart.lines], [2, 2, 2])
+        self.assertEqual(cart.total, Money(2400, 'USD'))
+
+        with patch('simple_app.stripe_clients.ThreadedStripeClient.create_checkout_session') as mock_checkout_create:
+            mock_checkout_create.return_value.id = 'fake_session_id'
+            for _ in range(2):
+                response = self.client.post(reverse('checkout_cart'))
+                self.assertEqual(response.json(), {'sessionId': 'fake_session_id'})
+
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Decimal('24.00'))
+        self.assertEqual(order.order_items.count(), 3)
+
+        self.client.get(reverse('clear_cart'))
+        self.assertEqual(self.client.get(reverse('cart_view')).context['cart'].lines, ())
+        self.assertEqual(self.client.post(reverse('checkout_cart')).status_code, 400)
+
+    def test_session_store(self):
+        """
+        Проверяет, что корзина в сессии не создает заказ до оформления, а повторное оформление его переиспользует
+        """
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'session'}):
+            self.fill_and_checkout()
+
+    def test_cookie_store(self):
+        """
+        Проверяет корзину в подписанной cookie
+        """
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'cookie'}):
+            self.fill_and_checkout()
+
+    def test_cache_store(self):
+        """
+        Проверяет корзину в кэше
+        """
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'cache'}):
+            self.fill_and_checkout()
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_paid_order_clears_cart(self):
+        """
+        Проверяет, что после оплаты заказа (вебхук) корзина вне базы пуста и повторно не оформляется
+        """
+        use_webhook_secret(self)
+        for backend in ('session', 'cookie', 'cache'):
+            with self.subTest(backend=backend), \
+                    override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': backend}):
+                self.client = Client()
+                self.client.post(reverse('add_to_order', args=[self.items[0].id]), {'quantity': 2})
+                session_id = self.client.post(reverse('checkout_cart')).json()['sessionId']
+                session = dict(get_fake_stripe()._objects[session_id], payment_status='paid')
+                event = {'id': f'evt_{backend}', 'type': 'checkout.session.completed', 'created': 1,
+                         'data': {'object': session}}
+                self.assertEqual(signed_webhook(self.client, event).status_code, 200)
+                call_command('process_webhooks', stdout=io.StringIO())
+                order = Order.objects.get(pk=session['metadata']['order_id'])
+                self.assertEqual(order.status, 'paid')
+
+                self.assertEqual(self.client.get(reverse('cart_view')).context['cart'].lines, ())
+                self.assertEqual(self.client.post(reverse('checkout_cart')).status_code, 400)
+                self.assertEqual(self.client.get(reverse('cart_view')).context['cart'].lines, ())
+                self.assertFalse(Order.objects.filter(status='pending').exists())
+
+    def test_cookie_cart_limits(self):
+        """
+        Проверяет, что корзина в cookie не растет сверх MAX_LINES товаров и сверх размера cookie:
+        такое изменение отклоняется с 400, а сохраненная корзина не меняется
+        """
+        items = self.items + [Item.objects.create(name=f'More {index}', price='1.00') for index in range(397)]
+        update = reverse('update_cart')
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'cookie', 'MAX_LINES': 3}):
+            response = self.client.post(update, {'operations': [{'item_id': item.id} for item in items[:3]]},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post(reverse('add_to_order', args=[items[3].id]))
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('cart', response.cookies)
+            self.assertEqual(len(self.client.get(reverse('cart_view')).context['cart'].lines), 3)
+
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'cookie', 'MAX_LINES': 1000}):
+            operations = [{'item_id': item.id, 'quantity': 1000} for item in items]
+            response = self.client.post(update, {'operations': operations}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(self.client.get(reverse('cart_view')).context['cart'].lines), 3)
+            response = self.client.post(update, {'operations': operations[:100]}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.cookies['cart'].OutputString(attrs=[])), 4096)
+
+    def test_tampered_cookie_ignored(self):
+        """
+        Проверяет, что корзина из cookie с неверной подписью не принимается
+        """
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'cookie'}):
+            self.client.cookies['cart'] = '{"order_id":1,"lines":[[1,5]]}:forged'
+            self.assertEqual(self.client.get(reverse('cart_view')).context['cart'].lines, ())
+
+
+class UpdateCartViewTest(TestCase):
+    def setUp(self):
+        self.items = [Item.objects.create(name=f'Item {index}', price='1.25', currency='USD') for index in range(40)]
+
+    def post_operations(self, operations):
+        return self.client.post(reverse('update_cart'), {'operations': operations}, content_type='application/json')
+
+    def test_batch_queries_do_not_grow(self):
+        """
+        Проверяет, что число запросов пакетного изменения не зависит от количества операций
+        """
+        self.post_operations([{'item_id': self.items[0].id}])
+        with CaptureQueriesContext(connection) as small:
+            self.post_operations([{'item_id': item.id} for item in self.items[:5]])
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_operations([{'item_id': item.id, 'quantity': 2} for item in self.items])
+        self.assertEqual(len(small), len(large))
+
+        cart = response.json()
+        self.assertEqual(len(cart['lines']), 40)
+        self.assertEqual(cart['lines'][0]['quantity'], 4)
+        self.assertEqual(Order.objects.get().total_price, Decimal(cart['total']))
+
+    def test_set_and_remove(self):
+        """
+        Проверяет операции set и remove и пересчет общей стоимости заказа
+        """
+        first, second, third = self.items[:3]
+        self.post_operations([{'item_id': item.id, 'quantity': 3} for item in (first, second, third)])
+        response = self.post_operations([
+            {'item_id': first.id, 'op': 'set', 'quantity': 1},
+            {'item_id': second.id, 'op': 'remove'},
+            {'item_id': third.id, 'op': 'set', 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(line['item_id'], line['quantity']) for line in response.json()['lines']], [(first.id, 1)])
+        self.assertEqual(Order.objects.get().total_price, Decimal('1.25'))
+
+    def test_total_saved_over_concurrent_change(self):
+        """
+        Проверяет, что итог пишется, даже если загруженный до блокировки заказ устарел
+        из-за параллельного изменения корзины
+        """
+        item = self.items[0]
+        self.post_operations([{'item_id': item.id, 'quantity': 2}])
+        stale = Order.objects.get()
+        self.post_operations([{'item_id': item.id}])
+        with patch('simple_app.cart_store.get_cart_order', return_value=stale):
+            self.post_operations([{'item_id': item.id, 'op': 'set', 'quantity': 2}])
+        self.assertEqual(Order.objects.get().total_price, Decimal('2.50'))
+
+    def test_invalid_batch_rejected(self):
+        """
+        Проверяет, что пакет с неизвестным товаром или неверной операцией не применяется
+        """
+        response = self.post_operations([{'item_id': self.items[0].id}, {'item_id': 999999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['item_ids'], [999999])
+        self.assertEqual(self.post_operations([{'item_id': self.items[0].id, 'op': 'merge'}]).status_code, 400)
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_session_store(self):
+        """
+        Проверяет, что с корзиной в сессии пакетное изменение не пишет в базу заказы
+        """
+        with override_settings(CART_STORE={**settings.CART_STORE, 'BACKEND': 'session'}):
+            self.post_operations([{'item_id': item.id} for item in self.items[:3]])
+            response = self.post_operations([{'item_id': self.items[0].id, 'op': 'remove'}])
+        self.assertEqual(len(response.json()['lines']), 2)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Бюджет запросов к базе для каждого представления simple_app/urls.py на корзинах разного размера:
+    число запросов не должно превышать бюджет и не должно зависеть от размера корзины
+    """
+    CART_SIZES = (1, 25)
+    BUDGETS = {
+        'create-item': 1,
+        'import_items': 3,
+        'item_list': 1,
+        'payment_cancel': 0,
+        'create_payment_intent': 8,
+        'item_detail': 1,
+        'add_to_order': 8,
+        'cart_view': 5,
+        'update_cart': 12,
+        'checkout_cart': 8,
+        'checkout_order': 5,
+        'create_checkout_session': 8,
+        'create_checkout_session_for_cart': 14,
+        'create_checkout_session_for_order': 12,
+        'clear_cart': 6,
+        'cache_stats': 0,
+        'metrics': 0,
+        'stripe_webhook': 1,
+    }
+
+    def setUp(self):
+        caches['pages'].clear()
+        server = FakeStripeServer().start()
+        self.addCleanup(server.stop)
+        settings_override = override_settings(STRIPE_CLIENT={'API_BASE': server.url})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.items = [Item.objects.create(name=f'Item {index}', price='3.10', currency='USD') for index in range(30)]
+        use_webhook_secret(self)
+
+    def seed_cart(self, size):
+        caches['pages'].clear()
+        self.client = Client()
+        self.client.post(reverse('update_cart'), {
+            'operations': [{'item_id': item.id, 'quantity': 2} for item in self.items[:size]],
+        }, content_type='application/json')
+        self.order = Order.objects.get(pk=self.client.session['cart_id'])
+        Discount.objects.create(order=self.order, rate='5.00')
+        Tax.objects.create(order=self.order, rate='10.00')
+
+    def call(self, name):
+        item_id, order_id = self.items[0].id, self.order.id
+        requests = {
+            'create-item': lambda: self.client.post(
+                reverse(name), {'name': 'New', 'description': 'd', 'price': '1.00'}, content_type='application/json'),
+            'import_items': lambda: self.client.post(
+                reverse(name), '{"name": "Imported", "description": "d", "price": "2.00"}\n',
+                content_type='application/x-ndjson'),
+            'item_list': lambda: self.client.get(reverse(name)),
+            'payment_cancel': lambda: self.client.get(reverse(name)),
+            'create_payment_intent': lambda: self.client.post(reverse(name, args=[item_id])),
+            'item_detail': lambda: self.client.get(reverse(name, args=[item_id])),
+            'add_to_order': lambda: self.client.post(reverse(name, args=[item_id]), {'quantity': 1}),
+            'cart_view': lambda: self.client.get(reverse(name)),
+            'update_cart': lambda: self.client.post(
+                reverse(name), {'operations': [{'item_id': item_id, 'op': 'set', 'quantity': 5}]},
+                content_type='application/json'),
+            'checkout_cart': lambda: self.client.post(reverse(name)),
+            'checkout_order': lambda: self.client.post(reverse(name, args=[order_id])),
+            'create_checkout_session': lambda: self.client.post(reverse(name, args=[item_id])),
+            'create_checkout_session_for_cart': lambda: self.client.post(reverse(name)),
+            'create_checkout_session_for_order': lambda: self.client.post(reverse(name, args=[order_id])),
+            'clear_cart': lambda: self.client.get(reverse(name)),
+            'cache_stats': lambda: self.client.get(reverse(name)),
+            'metrics': lambda: self.client.get(reverse(name)),
+            'stripe_webhook': lambda: signed_webhook(
+                self.client, {'id': f'evt_{order_id}', 'type': 'payment_intent.created', 'data': {'object': {}}}),
+        }
+        return requests[name]()
+
+    def test_every_view_has_budget(self):
+        """
+        Проверяет, что для каждого маршрута simple_app задан бюджет запросов
+        """
+        from .urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(self.BUDGETS))
+
+    def test_views_within_budget(self):
+        """
+        Проверяет число запросов каждого представления на корзинах разного размера
+        """
+        for name, budget in self.BUDGETS.items():
+            counts = []
+            for size in self.CART_SIZES:
+                self.seed_cart(size)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.call(name)
+                self.assertLess(response.status_code, 400, f'{name}: {response.status_code}')
+                counts.append(len(queries))
+            with self.subTest(view=name, queries=counts):
+                self.assertEqual(len(set(counts)), 1)
+                self.assertLessEqual(counts[0], budget)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        server = FakeStripeServer().start()
+        self.addCleanup(server.stop)
+        settings_override = override_settings(STRIPE_CLIENT={'API_BASE': server.url})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.item = Item.objects.create(name='Metered Item', price='5.00', currency='USD')
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_request_db_template_and_stripe_metrics(self):
+        """
+        Проверяет метрики запросов, базы, шаблонов и вызовов Stripe по имени URL
+        """
+        self.client.get(reverse('cart_view'))
+        self.client.post(reverse('create_payment_intent', args=[self.item.id]))
+        text = self.scrape()
+
+        self.assertIn('simple_app_requests_total{method="GET",status="200",view="cart_view"} 1', text)
+        self.assertIn('simple_app_request_duration_seconds_count{method="GET",view="cart_view"} 1', text)
+        self.assertIn('simple_app_request_duration_seconds_bucket{method="GET",view="cart_view",le="+Inf"} 1', text)
+        self.assertRegex(text, r'simple_app_db_queries_total\{view="create_payment_intent"\} [1-9]')
+        self.assertIn('simple_app_template_render_duration_seconds_count{template="cart.html",view="cart_view"} 1', text)
+        self.assertIn(
+            'simple_app_stripe_requests_total'
+            '{operation="create_payment_intent",outcome="ok",view="create_payment_intent"} 1', text,
+        )
+
+    def test_metrics_merged_across_processes(self):
+        """
+        Проверяет, что /metrics суммирует метрики других процессов и что суммы не уменьшаются,
+        когда процесс завершается: его метрики переносятся в общий файл накопленных значений
+        """
+        line = 'simple_app_requests_total{method="GET",status="200",view="payment_cancel"}'
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS={'DIR': directory}):
+            self.client.get(reverse('payment_cancel'))
+            metrics.flush(force=True)
+            with open(os.path.join(directory, f'{os.getpid()}.json')) as file:
+                snapshot = json.load(file)
+            worker = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdin.read()'], stdin=subprocess.PIPE)
+            with open(os.path.join(directory, f'{worker.pid}.json'), 'w') as file:
+                json.dump(snapshot, file)
+            self.assertIn(f'{line} 2', self.scrape())
+
+            worker.communicate()
+            self.assertIn(f'{line} 2', self.scrape())
+            self.assertFalse(os.path.exists(os.path.join(directory, f'{worker.pid}.json')))
+            self.assertIn(f'{line} 2', self.scrape())
+
+            # Так же метрики переносит хук child_exit мастера gunicorn
+            with open(os.path.join(directory, f'{worker.pid}.json'), 'w') as file:
+                json.dump(snapshot, file)
+            metrics.retire_process(directory, worker.pid)
+            self.assertIn(f'{line} 3', self.scrape())
+
+
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        use_webhook_secret(self)
+        self.item = Item.objects.create(name='Paid Item', price='10.00', currency='USD')
+
+    def event(self, event_id, event_type, created, **obj):
+        return {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': obj}}
+
+    def test_event_recorded_once(self):
+        """
+        Проверяет, что подписанное событие сохраняется во входящий ящик, а повторная доставка игнорируется
+        """
+        event = self.event('evt_1', 'payment_intent.succeeded', 1, id='pi_1', status='succeeded')
+        for _ in range(2):
+            response = signed_webhook(self.client, event)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'received': 'evt_1'})
+        self.assertEqual(WebhookEvent.objects.filter(event_id='evt_1', processed_at__isnull=True).count(), 1)
+
+    def test_invalid_signature_rejected(self):
+        """
+        Проверяет, что событие с неверной подписью или без нее не сохраняется
+        """
+        event = self.event('evt_2', 'payment_intent.succeeded', 1)
+        self.assertEqual(signed_webhook(self.client, event, secret='whsec_other').status_code, 400)
+        response = self.client.post(reverse('stripe_webhook', args=['USD']), json.dumps(event),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_process_webhooks_updates_orders_in_batches(self):
+        """
+        Проверяет, что process_webhooks обрабатывает все события пачками, находит заказ по metadata
+        или по PaymentIntentRecord, применяет самое позднее событие и не откатывает статус
+        """
+        paid, refunded, by_intent, unpaid = [Order.objects.create(status='pending') for _ in range(4)]
+        PaymentIntentRecord.objects.create(scope_key=f'order:{by_intent.id}:USD', currency='USD', amount=1000,
+                                           stripe_id='pi_record', client_secret='secret', status='processing')
+        events = [
+            self.event('evt_a', 'payment_intent.succeeded', 10, id='pi_a', status='succeeded',
+                       metadata={'order_id': str(paid.id)}),
+            # Возврат пришел раньше оплаты, но создан позже: заказ остается возвращенным
+            self.event('evt_c', 'charge.refunded', 30, payment_intent='pi_b', metadata={'order_id': str(refunded.id)}),
+            self.event('evt_b', 'payment_intent.succeeded', 20, id='pi_b', status='succeeded',
+                       metadata={'order_id': str(refunded.id)}),
+            self.event('evt_d', 'payment_intent.succeeded', 10, id='pi_record', status='succeeded'),
+            self.event('evt_e', 'checkout.session.completed', 10, payment_status='unpaid',
+                       metadata={'order_id': str(unpaid.id)}),
+        ]
+        for event in events:
+            self.assertEqual(signed_webhook(self.client, event).status_code, 200)
+
+        call_command('process_webhooks', batch_size=2, stdout=io.StringIO())
+
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[paid.id], 'paid')
+        self.assertEqual(statuses[refunded.id], 'refunded')
+        self.assertEqual(statuses[by_intent.id], 'paid')
+        self.assertEqual(statuses[unpaid.id], 'pending')
+        self.assertEqual(PaymentIntentRecord.objects.get(stripe_id='pi_record').status, 'succeeded')
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True).exists())
+
+        # Возврат, обработанный в отдельной пачке после оплаты, переводит заказ дальше
+        signed_webhook(self.client, self.event('evt_f', 'charge.refunded', 40, metadata={'order_id': str(paid.id)}))
+        call_command('process_webhooks', stdout=io.StringIO())
+        self.assertEqual(Order.objects.get(pk=paid.id).status, 'refunded')
+
+    @override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+    def test_checkout_session_from_view_marks_order_paid(self):
+        """
+        Проверяет, что вебхук checkout.session.completed для сессии, созданной checkout_order,
+        находит заказ и переводит его в оплаченные
+        """
+        order = Order.objects.create(status='pending')
+        order.order_items.create(item=self.item, quantity=2)
+        response = self.client.post(reverse('checkout_order', args=[order.id]))
+        self.assertEqual(response.status_code, 200)
+
+        session = dict(get_fake_stripe()._objects[response.json()['sessionId']], payment_status='paid')
+        event = self.event('evt_session', 'checkout.session.completed', 1, **session)
+        self.assertEqual(signed_webhook(self.client, event).status_code, 200)
+        call_command('process_webhooks', stdout=io.StringIO())
+        self.assertEqual(Order.objects.get(pk=order.id).status, 'paid')
+
+
+class AddToOrderConcurrencyTest(TransactionTestCase):
+    def test_concurrent_adds_lose_no_updates(self):
+        """
+        Проверяет, что одновременные добавления одного товара в одну корзину не теряют количество
+        """
+        item = Item.objects.create(name='Hot Item', price='2.50', currency='USD')
+        url = reverse('add_to_order', args=[item.id])
+        owner = Client()
+        owner.post(url, {'quantity': 1})
+        cookie = owner.cookies['sessionid'].value
+
+        threads_count, posts_per_thread = 8, 10
+        errors = []
+
+        def hammer():
+            client = Client()
+            client.cookies['sessionid'] = cookie
+            try:
+                for _ in range(posts_per_thread):
+                    response = client.post(url, {'quantity': 1})
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=hammer) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order_item = OrderItem.objects.get()
+        self.assertEqual(order_item.quantity, 1 + threads_count * posts_per_thread)
+        order_item.order.refresh_from_db()
+        self.assertEqual(order_item.order.total_price, Decimal('2.50') * order_item.quantity)
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
 class CreatePaymentIntentViewTest(TestCase):
     def setUp(self):
         self.item = Item.objects.create(name='Test Item', price=10.99, currency='USD')
@@ -57,6 +628,7 @@ class CreatePaymentIntentViewTest(TestCase):
         self.assertIsNotNone(response.json()['client_secret'])
 
 
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
 class CreateCheckoutSessionForOrderViewTest(TestCase):
     def setUp(self):
         self.item = Item.objects.create(name='Test Item', price=10.99, currency='USD')
@@ -73,6 +645,7 @@ class CreateCheckoutSessionForOrderViewTest(TestCase):
         self.assertIsNotNone(response.json()['client_secret'])  # Проверяем, что 'client_secret' не равен None
 
 
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
 class CreateCheckoutSessionViewTest(TestCase):
     def setUp(self):
         # Создаем тестовый объект товара
@@ -131,7 +704,7 @@ class PaymentCancelViewTest(TestCase):
 
 
 class CheckoutOrderViewTest(TestCase):
-    @patch('simple_app.views.stripe.checkout.Session.create')
+    @patch('simple_app.stripe_clients.ThreadedStripeClient.create_checkout_session')
     def test_checkout_order_view(self, mock_checkout_create):
         """
          позволяет убедиться, что представление checkout_order правильно взаимодействует с Stripe API и
@@ -148,7 +721,1044 @@ class CheckoutOrderViewTest(TestCase):
             payment_method_types=['card'],
             line_items=mock.ANY,
             mode='payment',
+            client_reference_id=str(order.id),
+            metadata={'order_id': order.id},
             success_url=mock.ANY,
             cancel_url=mock.ANY,
         )
         self.assertEqual(response.status_code, 200)
+
+
+class ConfigRegistryTest(TestCase):
+    ENV = (
+        'DJANGO_SECRET_KEY=secret\n'
+        'STRIPE_SECRET_KEY_USD=sk_usd\nSTRIPE_PUBLISHABLE_KEY_USD=pk_usd\n'
+        'STRIPE_SECRET_KEY_EUR={eur}\nSTRIPE_PUBLISHABLE_KEY_EUR=pk_eur\n'
+    )
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, '.env')
+        self.write_env('sk_eur')
+        # Переменные окружения процесса имеют приоритет над файлом, поэтому убираем их на время теста
+        environ = {key: value for key, value in os.environ.items()
+                   if not key.startswith(('STRIPE_', 'DJANGO_SECRET_KEY'))}
+        patcher = mock.patch.dict(os.environ, environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_env(self, eur_key, mtime=None):
+        with open(self.path, 'w') as env_file:
+            env_file.write(self.ENV.format(eur=eur_key))
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_reads_file_once_and_looks_up_by_currency(self):
+        """
+        Проверяет, что файл читается один раз, а конфигурации выбираются по валюте
+        """
+        registry = ConfigRegistry(self.path)
+        with patch('config.dotenv_values', wraps=dotenv_values) as read:
+            self.assertEqual(registry.get('EUR').stripe.secret_key, 'sk_eur')
+            self.assertEqual(registry.get('USD').stripe.secret_key, 'sk_usd')
+            self.assertEqual(registry.get().stripe.publishable_key, 'pk_usd')
+            self.assertIs(registry.get('EUR'), registry.get('EUR'))
+        self.assertEqual(read.call_count, 1)
+
+    def test_reloads_on_mtime_change_and_explicit_signal(self):
+        """
+        Проверяет перечитывание при изменении mtime файла и после reload_config()
+        """
+        os.utime(self.path, (1000, 1000))
+        registry = get_registry(self.path)
+        self.assertEqual(registry.get('EUR').stripe.secret_key, 'sk_eur')
+
+        self.write_env('sk_eur_2', mtime=2000)
+        self.assertEqual(registry.get('EUR').stripe.secret_key, 'sk_eur_2')
+
+        # mtime не изменился - без явного сигнала конфигурация остается прежней
+        self.write_env('sk_eur_3', mtime=2000)
+        self.assertEqual(registry.get('EUR').stripe.secret_key, 'sk_eur_2')
+        reload_config()
+        self.assertEqual(registry.get('EUR').stripe.secret_key, 'sk_eur_3')
+
+    def test_database_config_without_stripe_keys(self):
+        """
+        Проверяет, что для секретного ключа Django ключи Stripe не нужны: их отсутствие
+        обнаруживается только при обращении к конфигурации Stripe
+        """
+        with open(self.path, 'w') as env_file:
+            env_file.write('DJANGO_SECRET_KEY=secret\n')
+        registry = ConfigRegistry(self.path)
+        self.assertEqual(registry.database().django_secret_key, 'secret')
+        with self.assertRaises(EnvError):
+            registry.get('USD')
+
+
+class StartupTest(TestCase):
+    def test_worker_start_does_not_import_stripe(self):
+        """
+        Проверяет, что запуск Django и загрузка URLconf не импортируют stripe SDK и httpx
+        """
+        script = (
+            'import sys, django; django.setup()\n'
+            'from django.urls import get_resolver; get_resolver().url_patterns\n'
+            'print(sorted(name for name in ("stripe", "httpx", "environs") if name in sys.modules))\n'
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                check=True, cwd=settings.BASE_DIR)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_asgi_disables_persistent_connections(self):
+        """
+        Проверяет, что под ASGI постоянные соединения с базой выключены, а под WSGI - включены
+        """
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, SQLITE_PROFILE='tuned')
+        for name in ('SERVER_INTERFACE', 'SQLITE_CONN_MAX_AGE'):
+            env.pop(name, None)
+        for module, expected in (('asgi', '0'), ('wsgi', '600')):
+            script = (
+                f'import Simple_solutions.{module}\n'
+                'from django.conf import settings; print(settings.DATABASES["default"]["CONN_MAX_AGE"])\n'
+            )
+            result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                    check=True, cwd=settings.BASE_DIR)
+            self.assertEqual(result.stdout.strip(), expected)
+
+    def test_default_profile_does_not_switch_to_wal(self):
+        """
+        Проверяет, что без SQLITE_PROFILE команды manage.py не переводят файл базы в режим WAL,
+        а gunicorn.conf.py включает профиль tuned
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+                       SQLITE_PATH=os.path.join(directory, 'db.sqlite3'))
+            env.pop('SQLITE_PROFILE', None)
+            script = (
+                'import django; django.setup()\n'
+                'from django.db import connection\n'
+                'with connection.cursor() as cursor: print(cursor.execute("PRAGMA journal_mode").fetchone()[0])\n'
+            )
+            result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                    check=True, cwd=settings.BASE_DIR)
+            self.assertEqual(result.stdout.strip(), 'delete')
+
+            script = 'import runpy; runpy.run_path("gunicorn.conf.py"); import os; print(os.environ["SQLITE_PROFILE"])'
+            result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                    check=True, cwd=settings.BASE_DIR)
+            self.assertEqual(result.stdout.strip(), 'tuned')
+
+
+class OrderTotalsTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(status='pending')
+        for index in range(30):
+            item = Item.objects.create(name=f'Item {index}', price='10.00', currency='USD')
+            self.order.order_items.create(item=item, quantity=2)
+        Discount.objects.create(order=self.order, rate='10.00')
+        Discount.objects.create(order=self.order, rate='5.00')
+        Tax.objects.create(order=self.order, rate='20.00')
+
+    def test_totals_in_single_query(self):
+        """
+        Проверяет, что итоги заказа считаются одним запросом независимо от числа строк
+        """
+        order = Order.objects.get(pk=self.order.pk)
+        with self.assertNumQueries(1):
+            totals = order.get_totals()
+            self.assertEqual(order.total_price_before_discounts, Decimal('600.00'))
+        self.assertEqual(totals.discounts, 9000)
+        self.assertEqual(totals.taxes, 10200)
+        self.assertEqual(totals.total, 61200)
+
+    def test_calculate_total_price_saves_only_on_change(self):
+        """
+        Проверяет, что calculate_total_price пишет в базу только при изменении суммы
+        """
+        with self.assertNumQueries(2):
+            self.order.calculate_total_price()
+        self.assertEqual(Order.objects.get(pk=self.order.pk).total_price, Decimal('612.00'))
+        with self.assertNumQueries(1):
+            self.order.calculate_total_price()
+
+    def test_discount_amount_reuses_order_totals(self):
+        """
+        Проверяет, что суммы скидок берутся из уже посчитанных итогов заказа
+        """
+        order = Order.objects.get(pk=self.order.pk)
+        order.get_totals()
+        with self.assertNumQueries(1):
+            amounts = sorted(discount.amount for discount in order.discount_set.all())
+        self.assertEqual(amounts, [Decimal('30.00'), Decimal('60.00')])
+
+    def test_adjustments_add_up_to_total(self):
+        """
+        Проверяет, что скидки и налоги корзины по отдельным ставкам складываются в итог заказа
+        """
+        order = Order.objects.create(status='pending')
+        order.order_items.create(item=Item.objects.create(name='Odd', price='10.05', currency='USD'), quantity=1)
+        for rate in ('5.00', '5.00', '2.50'):
+            Discount.objects.create(order=order, rate=rate)
+            Tax.objects.create(order=order, rate=rate)
+
+        cart = build_cart_summary(order)
+        discounts = [discount.amount.amount for discount in cart.discounts]
+        taxes = [tax.amount.amount for tax in cart.taxes]
+        self.assertEqual(sum(discounts), cart.totals.discounts)
+        self.assertEqual(sum(taxes), cart.totals.taxes)
+        self.assertEqual(cart.subtotal.amount - sum(discounts) + sum(taxes), cart.total.amount)
+        self.assertEqual(discounts, [50, 51, 25])
+        self.assertEqual(cart.total.amount, 1005 - 126 + 110)
+        self.assertEqual(price_checkout(cart).total_minor, cart.total.amount)
+
+
+class CartViewQueryCountTest(TestCase):
+    def fill_cart(self, size):
+        order, created = Order.objects.get_or_create(status='pending')
+        session = self.client.session
+        session['cart_id'] = order.id
+        session.save()
+        for index in range(size):
+            item = Item.objects.create(name=f'Item {index}', price='5.50', currency='EUR')
+            order.order_items.create(item=item, quantity=index + 1)
+        Discount.objects.get_or_create(order=order, rate_bp=1000)
+        Tax.objects.get_or_create(order=order, rate_bp=2000)
+        return order
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart_view'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_cart_view_constant_queries(self):
+        """
+        Проверяет, что число запросов cart_view не зависит от количества строк в корзине
+        """
+        self.fill_cart(1)
+        small, response = self.count_queries()
+        self.fill_cart(25)
+        large, response = self.count_queries()
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 5)
+
+        cart = response.context['cart']
+        self.assertEqual(len(cart.lines), 26)
+        self.assertEqual(cart.currency, 'EUR')
+        self.assertEqual(cart.subtotal, sum(line.line_total for line in cart.lines))
+        self.assertEqual(cart.discounts[0].amount, cart.subtotal.percent(1000))
+
+
+class MoneyTest(TestCase):
+    def test_single_rounding_policy(self):
+        """
+        Проверяет перевод в минимальные единицы и округление половины от нуля
+        """
+        self.assertEqual(to_minor(10.99), 1099)
+        self.assertEqual(to_minor('0.005'), 1)
+        self.assertEqual(to_minor('-0.005'), -1)
+        self.assertEqual([round_half_up(value, 10) for value in (14, 15, -15, -14)], [1, 2, -2, -1])
+        self.assertEqual(Money(1000).percent(750), Money(75))
+        self.assertEqual(str(Money(1099, 'EUR')), '10.99')
+
+    def test_money_arithmetic(self):
+        """
+        Проверяет сложение сумм одной валюты и запрет смешивать валюты
+        """
+        self.assertEqual(sum([Money(150), Money(250)]) * 2, Money(800))
+        with self.assertRaises(ValueError):
+            Money(100, 'USD') + Money(100, 'EUR')
+
+    def test_models_store_minor_units(self):
+        """
+        Проверяет, что цена, итог заказа и ставки хранятся целыми числами, а Decimal - только представление
+        """
+        item = Item.objects.create(name='Minor', description='d', price='19.99', currency='EUR')
+        order = Order.objects.create(status='pending')
+        order.order_items.create(item=item, quantity=3)
+        Discount.objects.create(order=order, rate='12.5')
+        order.calculate_total_price()
+
+        self.assertEqual(Item.objects.values_list('price_minor', flat=True).get(), 1999)
+        self.assertEqual(Discount.objects.values_list('rate_bp', flat=True).get(), 1250)
+        self.assertEqual(Order.objects.values_list('total_minor', flat=True).get(), 5997 - 750)
+        self.assertEqual(Order.objects.get().total_price, Decimal('52.47'))
+        self.assertEqual(order.order_items.get().get_cost(), Money(5997, 'EUR'))
+
+
+class CheckoutPricingTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(status='pending')
+        for index, price in enumerate(['3.33', '19.99', '0.07', '7.10']):
+            item = Item.objects.create(name=f'Item {index}', price=price, currency='USD')
+            self.order.order_items.create(item=item, quantity=index + 1)
+        Discount.objects.create(order=self.order, rate='7.50')
+        Tax.objects.create(order=self.order, rate='13.00')
+
+    def test_line_items_match_order_total(self):
+        """
+        Проверяет, что сумма line_items для Stripe равна итогу заказа в копейках
+        """
+        pricing = price_checkout(build_cart_summary(self.order))
+        line_items = pricing.line_items()
+
+        self.assertEqual(
+            sum(line['price_data']['unit_amount'] * line['quantity'] for line in line_items),
+            pricing.total_minor,
+        )
+        self.assertEqual(pricing.total_minor, self.order.get_totals(refresh=True).total)
+        self.assertTrue(all(line['price_data']['unit_amount'] >= 0 for line in line_items))
+        self.assertEqual(line_items[-1]['price_data']['product_data']['name'], 'Tax')
+
+    def test_zero_quantity_line_skipped(self):
+        """
+        Проверяет, что строка с нулевым количеством не попадает в line_items и не ломает расчет
+        """
+        OrderItem.objects.filter(order=self.order, quantity=2).update(quantity=0)
+        pricing = price_checkout(build_cart_summary(self.order))
+        line_items = pricing.line_items()
+
+        self.assertEqual(len(line_items), 4)
+        self.assertTrue(all(line['quantity'] > 0 for line in line_items))
+        self.assertEqual(
+            sum(line['price_data']['unit_amount'] * line['quantity'] for line in line_items),
+            pricing.total_minor,
+        )
+
+    @patch('simple_app.stripe_clients.ThreadedStripeClient.create_payment_intent')
+    @patch('simple_app.stripe_clients.ThreadedStripeClient.create_checkout_session')
+    def test_checkout_views_agree_on_total(self, mock_checkout_create, mock_intent_create):
+        """
+        Проверяет, что checkout_order и create_checkout_session_for_order выставляют одну и ту же сумму
+        """
+        mock_checkout_create.return_value.id = 'fake_session_id'
+        mock_intent_create.return_value.id = 'pi_fake'
+        mock_intent_create.return_value.client_secret = 'fake_secret'
+        mock_intent_create.return_value.status = 'requires_payment_method'
+
+        self.client.post(reverse('checkout_order', args=[self.order.id]))
+        self.client.post(reverse('create_checkout_session_for_order', args=[self.order.id]))
+
+        line_items = mock_checkout_create.call_args.kwargs['line_items']
+        self.assertEqual(
+            sum(line['price_data']['unit_amount'] * line['quantity'] for line in line_items),
+            mock_intent_create.call_args.kwargs['amount'],
+        )
+
+
+@override_settings(PAYMENT_GATEWAY=FAKE_GATEWAY)
+class StripeCatalogSyncTest(TestCase):
+    def setUp(self):
+        self.items = [
+            Item.objects.create(name=f'Synced {index}', description='d' if index else '', price='4.25', currency='USD')
+            for index in range(3)
+        ]
+
+    def sync(self, **options):
+        call_command('sync_stripe_catalog', batch_size=2, stdout=io.StringIO(), **options)
+
+    def test_incremental_sync(self):
+        """
+        Проверяет, что повторный запуск отправляет только измененные товары, а смена цены
+        создает новую Price и деактивирует прежнюю, не меняя версию товара
+        """
+        fake = get_fake_stripe()
+        self.sync()
+        self.assertFalse(pending_items().exists())
+        item = Item.objects.get(pk=self.items[0].pk)
+        price = fake._objects[item.stripe_price_id]
+        self.assertEqual((price['product'], price['unit_amount'], price['currency']), (item.stripe_product_id, 425, 'usd'))
+        self.assertEqual(item.stripe_price, item.stripe_price_id)
+
+        requests = fake.requests
+        self.sync()
+        self.assertEqual(fake.requests, requests)
+
+        item.price = '5.00'
+        item.save()
+        self.assertIsNone(Item.objects.get(pk=item.pk).stripe_price)
+        self.assertEqual(list(pending_items()), [item])
+        old_price_id = item.stripe_price_id
+        self.sync()
+        item = Item.objects.get(pk=item.pk)
+        self.assertNotEqual(item.stripe_price_id, old_price_id)
+        self.assertEqual(fake._objects[item.stripe_price_id]['unit_amount'], 500)
+        self.assertFalse(fake._objects[old_price_id]['active'])
+        self.assertEqual(item.stripe_price, item.stripe_price_id)
+
+    def test_full_resync_right_after_create(self):
+        """
+        Проверяет, что полная синхронизация сразу после создания обновляет товары
+        с собственными ключами идемпотентности, а не ключами создания
+        """
+        self.sync()
+        synced, failed = sync_catalog(full=True)
+        self.assertEqual((synced, failed), (len(self.items), []))
+        self.assertEqual(sync_catalog(full=True), (len(self.items), []))
+
+    def test_checkout_references_synced_prices(self):
+        """
+        Проверяет, что checkout ссылается на цены Stripe синхронизированных товаров без скидки,
+        а для остальных передает price_data
+        """
+        self.sync()
+        unsynced = Item.objects.create(name='New', description='d', price='1.10', currency='USD')
+        order = Order.objects.create(status='pending')
+        order.order_items.create(item=self.items[1], quantity=3)
+        order.order_items.create(item=unsynced, quantity=1)
+        synced = Item.objects.get(pk=self.items[1].pk)
+
+        line_items = price_checkout(build_cart_summary(order)).line_items()
+        self.assertEqual(line_items[0], {'price': synced.stripe_price_id, 'quantity': 3})
+        self.assertEqual(line_items[1]['price_data']['unit_amount'], 110)
+
+        Discount.objects.create(order=order, rate='10.00')
+        line_items = price_checkout(build_cart_summary(order)).line_items()
+        self.assertTrue(all('price_data' in line for line in line_items))
+
+
+class ImportItemsViewTest(TestCase):
+    def test_iter_json_array_across_read_boundaries(self):
+        """
+        Проверяет потоковый разбор JSON-массива, когда элементы разрезаны границами чтения
+        """
+        rows = [{'name': f'Товар {index}', 'description': 'x' * index, 'price': '1.50'} for index in range(20)]
+        stream = io.BytesIO(json.dumps(rows, ensure_ascii=False).encode('utf-8'))
+        self.assertEqual(list(iter_json_array(stream, read_size=7)), rows)
+        self.assertEqual(list(iter_json_array(io.BytesIO(b' [ ] \n'))), [])
+
+    def test_iter_json_array_rejects_malformed(self):
+        """
+        Проверяет, что пропущенная или лишняя запятая и данные после массива - ошибка разбора
+        """
+        for body in (b'[1 2]', b'[,1]', b'[1,]', b'[1,,2]', b'[,]', b'[1] x', b'[1][2]', b'[1'):
+            with self.subTest(body=body), self.assertRaises(RowParseError):
+                list(iter_json_array(io.BytesIO(body), read_size=2))
+
+    def test_malformed_json_array_rejected_whole(self):
+        """
+        Проверяет, что поврежденный JSON-массив отклоняется целиком, даже если начало уже сохранено порциями
+        """
+        rows = [{'name': f'Item {index}', 'description': 'd', 'price': '2.00'} for index in range(600)]
+        body = json.dumps(rows) + ' trailing'
+        response = self.client.post(reverse('import_items'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 0)
+        self.assertEqual(response.json()['errors'][0]['row'], None)
+        self.assertFalse(Item.objects.exists())
+
+    def test_import_json_array(self):
+        """
+        Проверяет загрузку JSON-массива товаров одним запросом
+        """
+        rows = [{'name': f'Item {index}', 'description': 'd', 'price': '2.00', 'currency': 'EUR'}
+                for index in range(1200)]
+        response = self.client.post(reverse('import_items'), json.dumps(rows), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 1200, 'errors': [], 'error_count': 0})
+        self.assertEqual(Item.objects.filter(currency='EUR').count(), 1200)
+
+    def test_import_ndjson_reports_row_errors(self):
+        """
+        Проверяет, что ошибочные строки NDJSON возвращаются с номерами и не отменяют остальные
+        """
+        body = '\n'.join([
+            json.dumps({'name': 'Ok 1', 'description': 'd', 'price': '1.00'}),
+            json.dumps({'name': 'Bad price', 'description': 'd', 'price': 'abc'}),
+            '{not json',
+            json.dumps({'name': 'Ok 2', 'description': 'd', 'price': '3.00', 'currency': 'GBP'}),
+            json.dumps({'name': 'Ok 3', 'description': 'd', 'price': '3.00'}),
+        ])
+        response = self.client.post(reverse('import_items'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual([error['row'] for error in data['errors']], [1, 2, 3])
+        self.assertIn('price', data['errors'][0]['errors'])
+        self.assertEqual(set(Item.objects.values_list('name', flat=True)), {'Ok 1', 'Ok 3'})
+
+    def test_import_caps_reported_errors(self):
+        """
+        Проверяет, что подробно возвращаются только первые MAX_ERRORS ошибок, а остальные учитываются в error_count
+        """
+        bad_rows = MAX_ERRORS + 50
+        body = '\n'.join([json.dumps({'name': 'Ok', 'description': 'd', 'price': '1.00'})] +
+                         [json.dumps({'name': f'Bad {index}', 'price': 'abc'}) for index in range(bad_rows)])
+        response = self.client.post(reverse('import_items'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual((data['created'], data['error_count']), (1, bad_rows))
+        self.assertEqual([error['row'] for error in data['errors']], list(range(1, MAX_ERRORS + 1)))
+
+
+class ItemListViewTest(TestCase):
+    def setUp(self):
+        Item.objects.bulk_create(
+            Item(name=f'Item {index}', description='d', price='1.00', currency='EUR' if index % 2 else 'USD')
+            for index in range(25)
+        )
+
+    def test_keyset_pagination_and_filters(self):
+        """
+        Проверяет постраничный обход каталога по курсору с фильтром по валюте и выборочными полями
+        """
+        url = reverse('item_list') + '?currency=EUR&limit=5&fields=id,name'
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertTrue(all(set(row) == {'id', 'name'} for row in data['results']))
+            names.extend(row['name'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(names, [f'Item {index}' for index in range(1, 25, 2)])
+
+    def test_conditional_get(self):
+        """
+        Проверяет, что повторный запрос с If-None-Match получает 304, а изменение товара дает новый ETag
+        """
+        url = reverse('item_list') + '?limit=10'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        item = Item.objects.order_by('pk').first()
+        item.name = 'Renamed'
+        item.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_field(self):
+        """
+        Проверяет, что запрос неизвестного поля отклоняется
+        """
+        response = self.client.get(reverse('item_list') + '?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+class StaticFilesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        settings_override = override_settings(STATIC_ROOT=directory.name)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.root = directory.name
+        cls.hashed = staticfiles_storage.stored_name('admin/css/base.css')
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as file:
+            return file.read()
+
+    def get(self, name, **headers):
+        response = self.client.get(f'/static/{name}', headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_collectstatic_hashes_and_compresses(self):
+        """
+        Проверяет, что collectstatic добавляет хеш к имени и сохраняет сжатую копию рядом с файлом
+        """
+        self.assertRegex(self.hashed, r'^admin/css/base\.[0-9a-f]{12}\.css$')
+        self.assertEqual(gzip.decompress(self.read(f'{self.hashed}.gz')), self.read(self.hashed))
+
+    def test_serves_compressed_with_immutable_cache(self):
+        """
+        Проверяет выбор сжатой копии по Accept-Encoding и вечное кеширование только для имен с хешем
+        """
+        response, body = self.get(self.hashed, accept_encoding='br;q=0, gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(gzip.decompress(body), self.read(self.hashed))
+
+        response, body = self.get('admin/css/base.css')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertEqual(body, self.read('admin/css/base.css'))
+        self.assertEqual(self.get('../manage.py')[0].status_code, 404)
+
+    @skipIf(staticfiles.brotli is None, 'пакет Brotli не установлен')
+    def test_serves_brotli(self):
+        """
+        Проверяет, что collectstatic сохраняет копию .br, а клиенту, принимающему br, отдается она
+        """
+        response, body = self.get(self.hashed, accept_encoding='gzip, deflate, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(body, self.read(f'{self.hashed}.br'))
+        self.assertEqual(staticfiles.brotli.decompress(body), self.read(self.hashed))
+
+    def test_conditional_and_range_requests(self):
+        """
+        Проверяет ответ 304 по ETag, 206 на запрос диапазона и 416 на невыполнимый диапазон
+        """
+        response, _ = self.get(self.hashed)
+        self.assertEqual(self.get(self.hashed, if_none_match=response['ETag'])[0].status_code, 304)
+
+        response, body = self.get(self.hashed, range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.read(self.hashed)[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.read(self.hashed))}')
+        self.assertEqual(self.get(self.hashed, range='bytes=99999999-')[0].status_code, 416)
+
+
+class ItemPageCacheTest(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.item = Item.objects.create(name='Cached Item', description='d', price='10.00', currency='USD')
+        self.url = reverse('item_detail', args=[self.item.id])
+
+    def test_second_request_served_from_cache(self):
+        """
+        Проверяет, что повторный запрос страницы товара отдается из кеша без запросов к базе
+        """
+        first = self.client.get(self.url)
+        self.assertIsNotNone(first.context)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertIn('csrftoken', second.cookies)
+
+        stats = self.client.get(reverse('cache_stats')).json()['item_page']
+        self.assertGreaterEqual(stats['hits'], 1)
+
+    def test_invalidated_on_save_and_delete(self):
+        """
+        Проверяет, что сохранение и удаление товара сбрасывают закешированную страницу
+        """
+        self.client.get(self.url)
+        self.item.name = 'Renamed Item'
+        self.item.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Renamed Item')
+
+        self.item.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ItemCacheTest(TestCase):
+    def setUp(self):
+        clear_item_cache()
+        self.items = [Item.objects.create(name=f'Item {index}', price='2.00') for index in range(3)]
+        self.ids = [item.id for item in self.items]
+
+    def test_multi_get_reads_through_both_levels(self):
+        """
+        Проверяет, что промахи загружаются одним запросом, повторное чтение идет из LRU процесса,
+        а после его очистки - из общего кеша, без запросов к базе
+        """
+        before = item_cache_stats()
+        with self.assertNumQueries(1):
+            items = get_items(self.ids + [0])
+        self.assertEqual(sorted(items), self.ids)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_items(self.ids)[self.ids[0]].name, 'Item 0')
+        item_cache._local_cache().clear()
+        with self.assertNumQueries(0):
+            get_items(self.ids)
+
+        after = item_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 4)
+        self.assertEqual(after['local_hits'] - before['local_hits'], 3)
+        self.assertEqual(after['shared_hits'] - before['shared_hits'], 3)
+        self.assertIn('item', self.client.get(reverse('cache_stats')).json())
+
+    def test_invalidated_on_save_and_delete(self):
+        """
+        Проверяет, что сохранение и удаление товара сбрасывают его в обоих кешах
+        """
+        get_items(self.ids)
+        item = Item.objects.get(pk=self.ids[0])
+        item.price = '3.00'
+        item.save()
+        self.assertEqual(get_item_or_404(item.id).price_minor, 300)
+        self.assertEqual(asyncio.run(item_cache.aget_items([item.id]))[item.id].price_minor, 300)
+
+        item.delete()
+        self.assertEqual(get_items(self.ids).keys(), set(self.ids[1:]))
+        self.assertEqual(self.client.get(reverse('item_detail', args=[self.ids[0]])).status_code, 404)
+
+    def test_local_lru_evicts_and_expires(self):
+        """
+        Проверяет вытеснение давно не использованных записей и истечение по времени жизни
+        """
+        lru = item_cache.LocalLRU(max_size=2, ttl=10)
+        with patch('simple_app.item_cache.time.monotonic', return_value=100):
+            lru.set_many({1: 'a', 2: 'b'})
+            lru.get_many([1])
+            lru.set_many({3: 'c'})
+        self.assertEqual(lru.evictions, 1)
+        with patch('simple_app.item_cache.time.monotonic', return_value=105):
+            self.assertEqual(lru.get_many([1, 2, 3]), {1: 'a', 3: 'c'})
+        with patch('simple_app.item_cache.time.monotonic', return_value=111):
+            self.assertEqual(lru.get_many([1, 3]), {})
+        self.assertEqual(lru.expirations, 2)
+        self.assertEqual(len(lru), 0)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.item = Item.objects.create(name='Item', description='d', price='4.00', currency='USD')
+
+    def test_item_detail_not_modified(self):
+        """
+        Проверяет, что повторный просмотр неизмененного товара получает 304 без запросов к базе,
+        а после сохранения товара - новую страницу с другим ETag
+        """
+        url = reverse('item_detail', args=[self.item.id])
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            repeat = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat['ETag'], first['ETag'])
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+        self.item.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_cart_view_not_modified(self):
+        """
+        Проверяет, что повторный просмотр корзины - один запрос к корзине и 304, а изменение
+        строк, скидки или цены товара меняет ETag
+        """
+        self.client.post(reverse('add_to_order', args=[self.item.id]), {'quantity': 2})
+        first = self.client.get(reverse('cart_view'))
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('private', first['Cache-Control'])
+        with CaptureQueriesContext(connection) as queries:
+            repeat = self.client.get(reverse('cart_view'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(len([query for query in queries if 'simple_app_order' in query['sql']]), 1)
+
+        etags = {first['ETag']}
+        order = Order.objects.get(pk=self.client.session['cart_id'])
+        for change in (
+            lambda: self.client.post(reverse('add_to_order', args=[self.item.id]), {'quantity': 1}),
+            lambda: Discount.objects.create(order=order, rate='5.00'),
+            lambda: self.item.save(),
+        ):
+            change()
+            response = self.client.get(reverse('cart_view'), HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(response['ETag'], etags)
+            etags.add(response['ETag'])
+            self.assertEqual(self.client.get(reverse('cart_view'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_html_and_json_compressed(self):
+        """
+        Проверяет, что HTML и JSON сжимаются в gzip, если клиент его принимает, и что ETag сжатого
+        ответа по-прежнему дает 304
+        """
+        response = self.client.get(reverse('item_detail', args=[self.item.id]), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn(b'Item', gzip.decompress(response.content))
+        repeat = self.client.get(reverse('item_detail', args=[self.item.id]),
+                                 HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+        # Ответы короче 200 байт не сжимаются
+        Item.objects.bulk_create([Item(name=f'Item {index}', description='d', price_minor=100) for index in range(5)])
+        catalog = self.client.get(reverse('item_list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(json.loads(gzip.decompress(catalog.content))['results'][0]['name'], 'Item')
+        self.assertFalse(self.client.get(reverse('item_list')).has_header('Content-Encoding'))
+
+
+class StripeClientTest(TestCase):
+    def test_reuses_connections(self):
+        """
+        Проверяет, что клиент передает ключ явно и переиспользует keep-alive соединение
+        """
+        with FakeStripeServer() as server:
+            client = StripeClient('sk_test_pool', api_base=server.url, pool_size=2)
+            intents = [client.create_payment_intent(amount=100 + index, currency='usd') for index in range(5)]
+            client.close()
+        self.assertEqual([intent.amount for intent in intents], [100, 101, 102, 103, 104])
+        self.assertTrue(intents[0].client_secret)
+        self.assertEqual(server.connections, 1)
+
+    def test_async_client_encodes_nested_params(self):
+        """
+        Проверяет, что асинхронный клиент передает вложенные словари и списки полями формы Stripe
+        """
+        async def create_session(url):
+            client = AsyncStripeClient('sk_test_async', api_base=url)
+            try:
+                return await client.create_checkout_session(
+                    mode='payment', metadata={'order_id': 7}, client_reference_id=None,
+                    line_items=[{'price_data': {'currency': 'usd', 'unit_amount': 150}, 'quantity': 2}],
+                )
+            finally:
+                await client.close()
+
+        with FakeStripeServer() as server:
+            session = asyncio.run(create_session(server.url))
+        self.assertEqual(server._objects[session.id]['metadata'], {'order_id': '7'})
+        self.assertEqual(
+            list(_form_items({'line_items': [{'price_data': {'unit_amount': 150}, 'quantity': 2}],
+                              'active': False, 'description': None})),
+            [('line_items[0][price_data][unit_amount]', 150), ('line_items[0][quantity]', 2), ('active', 'false')],
+        )
+
+    def test_maps_error_responses(self):
+        """
+        Проверяет заголовки запроса и разбор ошибок Stripe без внутренних классов stripe SDK
+        """
+        async def retrieve_missing(url):
+            client = AsyncStripeClient('sk_test_errors', api_base=url)
+            try:
+                await client.retrieve_payment_intent('pi_missing')
+            finally:
+                await client.close()
+
+        with FakeStripeServer() as server:
+            client = StripeClient('sk_test_errors', api_base=server.url)
+            client.create_payment_intent(idempotency_key='key-1', amount=100, currency='usd')
+            with self.assertRaises(stripe.IdempotencyError) as error:
+                client.create_payment_intent(idempotency_key='key-1', amount=200, currency='usd')
+            client.close()
+            with self.assertRaises(stripe.InvalidRequestError) as missing:
+                asyncio.run(retrieve_missing(server.url))
+        self.assertEqual(error.exception.http_status, 400)
+        self.assertEqual(missing.exception.http_status, 404)
+        headers = _request_headers('sk_test_errors', 'post', 'key-1')
+        self.assertEqual(headers['Authorization'], 'Bearer sk_test_errors')
+        self.assertEqual(headers['Idempotency-Key'], 'key-1')
+        self.assertEqual(headers['Stripe-Version'], stripe.api_version)
+
+    def test_client_per_currency_account(self):
+        """
+        Проверяет, что для каждой валюты используется свой долгоживущий клиент со своим ключом
+        """
+        usd, eur = get_stripe_client('USD'), get_stripe_client('EUR')
+        self.assertIs(usd, get_stripe_client('USD'))
+        self.assertIsNot(usd, eur)
+        self.assertNotEqual(usd.api_key, eur.api_key)
+
+
+class PaymentGatewayTest(TestCase):
+    def gateway(self, **fake):
+        return override_settings(
+            PAYMENT_GATEWAY={'BACKEND': 'fake', 'FAKE': fake},
+            STRIPE_CLIENT={**settings.STRIPE_CLIENT, 'MAX_RETRIES': 2, 'READ_TIMEOUT': 0.05},
+        )
+
+    def test_fake_backend_selected_from_settings(self):
+        """
+        Проверяет, что PAYMENT_GATEWAY переключает клиентов на заглушку в памяти процесса
+        """
+        with self.gateway():
+            client = get_stripe_client('USD')
+            intent = client.create_payment_intent(amount=500, currency='usd')
+        self.assertIsInstance(client, InProcessStripeClient)
+        self.assertEqual(client.fake._objects[intent.id]['amount'], 500)
+        self.assertNotIsInstance(get_stripe_client('USD'), InProcessStripeClient)
+
+    def test_idempotency_key_bound_to_request(self):
+        """
+        Проверяет, что ключ идемпотентности повторяет тот же запрос, а с другими параметрами отклоняется, как в Stripe
+        """
+        with self.gateway():
+            client = get_stripe_client('USD')
+            first = client.create_payment_intent(idempotency_key='key-1', amount=100, currency='usd')
+            self.assertEqual(client.create_payment_intent(idempotency_key='key-1', amount=100, currency='usd').id,
+                             first.id)
+            with self.assertRaises(stripe.IdempotencyError):
+                client.create_payment_intent(idempotency_key='key-1', amount=200, currency='usd')
+            with self.assertRaises(stripe.IdempotencyError):
+                client.update_payment_intent(first.id, idempotency_key='key-1', amount=100)
+
+    def test_retries_injected_errors_idempotently(self):
+        """
+        Проверяет, что ошибки 500 повторяются с тем же ключом идемпотентности, а результат детерминирован
+        """
+        with self.gateway(ERROR_RATE=0.5, SEED=7), patch('simple_app.stripe_clients._retry_delay', return_value=0):
+            client = get_stripe_client('USD')
+            outcomes = []
+            for _ in range(10):
+                try:
+                    outcomes.append(client.create_payment_intent(amount=100, currency='usd').amount)
+                except stripe.APIError:
+                    outcomes.append('error')
+        self.assertGreater(client.fake.requests, 10)
+        self.assertIn(100, outcomes)
+        self.assertEqual(len(client.fake._objects), outcomes.count(100))
+
+    def test_rate_limit_and_timeout(self):
+        """
+        Проверяет ответ 429 сверх ограничения частоты и ошибку соединения при задержке дольше таймаута
+        """
+        with self.gateway(RATE_LIMIT=1), patch('simple_app.stripe_clients._retry_delay', return_value=0):
+            client = get_stripe_client('USD')
+            client.create_payment_intent(amount=100, currency='usd')
+            with self.assertRaises(stripe.RateLimitError):
+                client.create_payment_intent(amount=100, currency='usd')
+        with self.gateway(LATENCY=0.1), patch('simple_app.stripe_clients._retry_delay', return_value=0):
+            with self.assertRaises(stripe.APIConnectionError):
+                get_stripe_client('USD').create_payment_intent(amount=100, currency='usd')
+
+
+class AsyncPaymentViewsTest(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(STRIPE_CLIENT={'API_BASE': self.server.url})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.item = Item.objects.create(name='Async Item', price='12.34', currency='EUR')
+
+    def test_payment_intent_through_async_client(self):
+        """
+        Проверяет, что async-представления создают PaymentIntent через неблокирующий клиент
+        """
+        response = self.client.post(reverse('create_payment_intent', args=[self.item.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['client_secret'].startswith('pi_'))
+
+        order = Order.objects.create(status='pending')
+        order.order_items.create(item=self.item, quantity=3)
+        response = self.client.post(reverse('create_checkout_session_for_order', args=[order.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('client_secret', response.json())
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('37.02'))
+
+    def test_wsgi_uses_pooled_sync_client(self):
+        """
+        Проверяет, что вне ASGI запросы не создают httpx-клиент на каждый цикл событий,
+        а переиспользуют соединение общего синхронного клиента
+        """
+        for _ in range(3):
+            self.client.post(reverse('create_checkout_session', args=[self.item.id]))
+        self.assertEqual(self.server.connections, 1)
+
+        async def get_clients():
+            return get_async_stripe_client('EUR'), get_async_stripe_client('EUR')
+
+        threaded, _ = async_to_sync(get_clients)()
+        self.assertIsInstance(threaded, ThreadedStripeClient)
+        self.assertIs(threaded.client, get_stripe_client('EUR'))
+        with self.settings(SERVER_INTERFACE='asgi'):
+            first, second = asyncio.run(get_clients())
+        self.assertIsInstance(first, AsyncStripeClient)
+        self.assertIs(first, second)
+
+    def test_missing_object_returns_404(self):
+        """
+        Проверяет, что async-представления отвечают 404 для несуществующего товара
+        """
+        response = self.client.post(reverse('create_checkout_session', args=[self.item.id + 1000]))
+        self.assertEqual(response.status_code, 404)
+
+
+class PaymentIntentReuseTest(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer(delay=0.2).start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(STRIPE_CLIENT={'API_BASE': self.server.url})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    async def test_concurrent_requests_coalesced(self):
+        """
+        Проверяет, что одновременные одинаковые запросы приводят к одному вызову Stripe
+        """
+        records = await asyncio.gather(*(acquire_payment_intent('order:1', 'USD', 1500) for _ in range(5)))
+        self.assertEqual(len({record.stripe_id for record in records}), 1)
+        self.assertEqual(self.server.requests, 1)
+
+    async def test_reused_and_updated_on_amount_change(self):
+        """
+        Проверяет, что PaymentIntent переиспользуется, а при изменении суммы обновляется
+        """
+        first = await acquire_payment_intent('order:2', 'USD', 1000)
+        again = await acquire_payment_intent('order:2', 'USD', 1000)
+        # Статус записи актуален - повторное использование без запросов к Stripe
+        self.assertEqual(self.server.requests, 1)
+
+        updated = await acquire_payment_intent('order:2', 'USD', 2500)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(first.stripe_id, again.stripe_id)
+        self.assertEqual(first.stripe_id, updated.stripe_id)
+        self.assertEqual(self.server._objects[first.stripe_id]['amount'], 2500)
+        self.assertEqual(await PaymentIntentRecord.objects.acount(), 1)
+
+    def test_double_submit_returns_same_client_secret(self):
+        """
+        Проверяет, что повторное нажатие кнопки оплаты возвращает тот же client_secret
+        """
+        item = Item.objects.create(name='Item', price='9.99', currency='USD')
+        url = reverse('create_payment_intent', args=[item.id])
+        secrets = [self.client.post(url).json()['client_secret'] for _ in range(2)]
+        self.assertEqual(secrets[0], secrets[1])
+        self.assertEqual(len(self.server._objects), 1)
+
+    async def test_amount_returning_to_earlier_value_is_updated(self):
+        """
+        Проверяет, что при смене суммы A -> B -> A -> B каждое обновление доходит до Stripe:
+        ключ идемпотентности прежнего обновления с той же суммой не переиспользуется
+        """
+        for amount in (1000, 2000, 1000, 2000):
+            record = await acquire_payment_intent('order:3', 'USD', amount)
+            self.assertEqual(self.server._objects[record.stripe_id]['amount'], amount)
+        self.assertEqual(record.amount, 2000)
+
+    async def test_stale_status_checked_in_stripe(self):
+        """
+        Проверяет, что статус сверяется со Stripe одним запросом, только когда запись старше окна актуальности
+        """
+        record = await acquire_payment_intent('order:5', 'USD', 1000)
+        for _ in range(3):
+            await acquire_payment_intent('order:5', 'USD', 1000)
+        self.assertEqual(self.server.requests, 1)
+
+        with self.settings(PAYMENT_INTENTS={'STATUS_MAX_AGE': 0}):
+            again = await acquire_payment_intent('order:5', 'USD', 1000)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(again.stripe_id, record.stripe_id)
+        self.assertGreater(again.updated_at, record.updated_at)
+
+    async def test_finished_intent_replaced(self):
+        """
+        Проверяет, что оплаченный или отмененный в Stripe PaymentIntent не переиспользуется,
+        даже если вебхук о нем не пришел
+        """
+        first = await acquire_payment_intent('order:4', 'USD', 1000)
+        for status in ('succeeded', 'canceled'):
+            self.server._objects[first.stripe_id]['status'] = status
+            with self.settings(PAYMENT_INTENTS={'STATUS_MAX_AGE': 0}):
+                second = await acquire_payment_intent('order:4', 'USD', 1000)
+            self.assertNotEqual(second.stripe_id, first.stripe_id)
+            self.assertEqual(second.status, 'requires_payment_method')
+            first = second
+
+    async def test_finished_intent_rejecting_update_replaced(self):
+        """
+        Проверяет, что PaymentIntent с актуальным по записи статусом, но завершенный в Stripe,
+        заменяется новым, когда Stripe отклоняет обновление суммы
+        """
+        first = await acquire_payment_intent('order:6', 'USD', 1000)
+        self.server._objects[first.stripe_id]['status'] = 'succeeded'
+        second = await acquire_payment_intent('order:6', 'USD', 2000)
+        self.assertNotEqual(second.stripe_id, first.stripe_id)
+        self.assertEqual(second.amount, 2000)
+        # Создание, отклоненное обновление и новое создание - без проверок статуса
+        self.assertEqual(self.server.requests, 3)
@@ -1,18 +1,95 @@
-import stripe
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, redirect
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect
 from django.shortcuts import render
 from django.urls import reverse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import ParseError
 from rest_framework.parsers import JSONParser
 
-from config import load_config
+from config import CURRENCIES, load_config
+from .cart import abuild_cart_summary
+from .cart_store import CartLimitError, get_cart_store
+from .importers import RowParseError, import_item_rows, iter_json_array, iter_ndjson
+from .item_cache import aget_item_or_404, get_item_or_404, get_items, item_cache_stats
+from .metrics import render_metrics
 from .models import Item
-from .models import OrderItem, Order
-from .serializers import ItemSerializer
+from .models import Order
+from .page_cache import get_item_page, get_item_version, page_cache_stats, store_item_page
+from .payment_intents import acquire_payment_intent
+from .pricing import price_checkout
+from .serializers import CartBatchSerializer, ItemCatalogSerializer, ItemSerializer
+from .webhooks import InvalidWebhook, record_event
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl')
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 500
+CATALOG_COLUMNS = {'price': ('price_minor', 'currency')}
+
+
+def async_csrf_exempt(view_func):
+    """
+    csrf_exempt для async-представлений: декоратор Django 4.2 оборачивает их в синхронную функцию
+    """
+    view_func.csrf_exempt = True
+    return view_func
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest())
+
+
+def _with_validators(response, etag, last_modified=None):
+    """
+    Ставит ETag и Last-Modified; no-cache - браузер хранит страницу, но перед показом сверяет ее с сервером
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+async def _aget_object_or_404(model, **kwargs):
+    """
+    Асинхронный аналог get_object_or_404
+    """
+    try:
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+async def _asession_key(request):
+    """
+    Ключ сессии посетителя; сессия создается, если ее еще нет
+    """
+    if request.session.session_key is None:
+        await sync_to_async(request.session.save)()
+        request.session.modified = True  # чтобы middleware отправил cookie сессии
+    return request.session.session_key
+
 
-config = load_config(path='.env')
+def _materialize_cart(request):
+    store = get_cart_store(request)
+    return store, store.materialize()
+
+
+async def _with_cart_order(request, view):
+    """
+    Переносит корзину посетителя в базу и вызывает view для получившегося заказа
+    """
+    store, order = await sync_to_async(_materialize_cart)(request)
+    if order is None:
+        return JsonResponse({'error': 'Корзина пуста'}, status=400)
+    response = await view(request, order.pk)
+    return await sync_to_async(store.commit)(response)
 
 
 @csrf_exempt
@@ -29,14 +106,162 @@ def create_item(request):
         return JsonResponse(serializer.errors, status=400)
 
 
+@csrf_exempt
+@require_POST
+def import_items(request):
+    '''
+    Массовая загрузка товаров: JSON-массив или NDJSON (application/x-ndjson).
+    Тело запроса читается потоком, строки сохраняются порциями, ошибки возвращаются построчно:
+    первые MAX_ERRORS подробно, а error_count - общее число ошибочных строк.
+    Поврежденный JSON-массив отклоняется целиком (400): порции сохраняются в общей транзакции
+    и откатываются, если структура массива нарушена.
+    '''
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        result = import_item_rows(iter_ndjson(request))
+    else:
+        try:
+            with transaction.atomic():
+                result = import_item_rows(iter_json_array(request))
+        except RowParseError as e:
+            return JsonResponse({'created': 0, 'errors': [{'row': None, 'errors': {'non_field_errors': [str(e)]}}],
+                                 'error_count': 1}, status=400)
+
+    if not result.error_count:
+        status = 201
+    elif result.created:
+        status = 207  # Часть строк сохранена, часть отклонена
+    else:
+        status = 400
+    return JsonResponse({'created': result.created, 'errors': result.errors, 'error_count': result.error_count},
+                        status=status)
+
+
+@require_GET
+def item_list(request):
+    '''
+    Каталог товаров в JSON с постраничной навигацией по курсору (id последнего товара),
+    фильтром по валюте, выборочными полями и поддержкой условных GET-запросов (ETag/Last-Modified).
+    '''
+    try:
+        limit = min(max(int(request.GET.get('limit', CATALOG_PAGE_SIZE)), 1), CATALOG_MAX_PAGE_SIZE)
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return JsonResponse({'error': 'limit и after должны быть целыми числами'}, status=400)
+
+    fields = None
+    if request.GET.get('fields'):
+        fields = request.GET['fields'].split(',')
+        unknown = set(fields) - set(ItemCatalogSerializer.Meta.fields)
+        if unknown:
+            return JsonResponse({'error': f'Неизвестные поля: {", ".join(sorted(unknown))}'}, status=400)
+
+    # Курсор по id вместо OFFSET: глубокие страницы читаются по индексу первичного ключа
+    queryset = Item.objects.filter(pk__gt=after).order_by('pk')
+    if request.GET.get('currency'):
+        queryset = queryset.filter(currency=request.GET['currency'])
+    if fields:
+        # price хранится в price_minor, а для перевода в Decimal нужна валюта
+        columns = [column for name in fields for column in CATALOG_COLUMNS.get(name, (name,))]
+        queryset = queryset.only('id', 'updated_at', *columns)
+    items = list(queryset[:limit + 1])
+    has_next = len(items) > limit
+    items = items[:limit]
+
+    # Валидаторы считаются до сериализации, чтобы ответ 304 обходился без нее
+    fingerprint = ','.join(f'{item.pk}:{item.updated_at.timestamp()}' for item in items)
+    etag = quote_etag(hashlib.md5(f'{request.get_full_path()}|{has_next}|{fingerprint}'.encode()).hexdigest())
+    last_modified = max((item.updated_at for item in items), default=None)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        next_url = None
+        if has_next:
+            query = request.GET.copy()
+            query['after'] = items[-1].pk
+            next_url = f'{request.path}?{query.urlencode()}'
+        response = JsonResponse({
+            'results': ItemCatalogSerializer(items, many=True, fields=fields).data,
+            'next': next_url,
+        })
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+@ensure_csrf_cookie
 def item_detail(request, id):
-    item = get_object_or_404(Item, pk=id)
-    config = load_config(path='.env', currency=item.currency)  # Загрузка конфигурации с учетом валюты
+    """
+    Страница товара. Валидаторы - версия товара и ключ Stripe его валюты; версия берется
+    из указателя кеша страниц, поэтому повторный просмотр неизмененного товара получает 304
+    без запросов к базе и рендеринга.
+    """
+    item = None
+    pointer = get_item_version(id)
+    if pointer is None:
+        item = get_item_or_404(id)
+        pointer = (item.version, item.currency)
+    version, currency = pointer
+    config = load_config(path='.env', currency=currency)  # Загрузка конфигурации с учетом валюты
+    etag = _etag('item', id, version, currency, config.stripe.publishable_key)
+    last_modified = version // 1_000_000
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return _with_validators(response, etag, last_modified)
+
+    if item is None:
+        # Готовая страница берется из кеша; CSRF-токен не встраивается в HTML, а читается из cookie.
+        # Без указателя страница рендерится заново: store_item_page восстановит указатель
+        response = get_item_page(id, version, currency, config.stripe.publishable_key)
+        if response is not None:
+            return _with_validators(response, etag, last_modified)
+
+        item = get_item_or_404(id)
+        if item.version != version:
+            # Товар сохранили после чтения указателя: валидаторы - по отрисованной версии
+            config = load_config(path='.env', currency=item.currency)
+            etag = _etag('item', id, item.version, item.currency, config.stripe.publishable_key)
+            last_modified = item.version // 1_000_000
     context = {
         'item': item,
         'stripe_public_key': config.stripe.publishable_key  # Используйте ключ из StripeConfig
     }
-    return render(request, 'item_detail.html', context)
+    response = render(request, 'item_detail.html', context)
+    store_item_page(item, config.stripe.publishable_key, response)
+    return _with_validators(response, etag, last_modified)
+
+
+@require_GET
+def metrics(request):
+    """
+    Метрики всех процессов приложения в текстовом формате Prometheus
+    """
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request, currency):
+    """
+    Принимает событие Stripe аккаунта валюты currency: проверяет подпись, сохраняет событие
+    во входящий ящик и сразу отвечает 200. Статусы заказов меняет команда process_webhooks.
+    """
+    if currency not in CURRENCIES:
+        raise Http404(f'Неизвестная валюта {currency}')
+    secret = load_config(path='.env', currency=currency).stripe.webhook_secret
+    try:
+        event_id = record_event(request.body, request.headers.get('Stripe-Signature'), secret)
+    except InvalidWebhook as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'received': event_id})
+
+
+def cache_stats(request):
+    """
+    Счетчики кеша страниц и кеша товаров текущего процесса
+    """
+    return JsonResponse({'item_page': page_cache_stats(), 'item': item_cache_stats()})
 
 
 def payment_success(request):
@@ -56,114 +281,151 @@ def payment_cancel(request):
 @require_POST
 def add_to_order(request, item_id):
     """
-    Добавляет товар в заказ
+    Добавляет товар в корзину текущего посетителя
 
+    Где хранится корзина, определяет настройка CART_STORE; в базе количество увеличивается
+    одним атомарным upsert-запросом, а общая стоимость - на стоимость добавленной строки.
     """
-    # Получаем или создаем новый заказ (можно связать с текущим пользователем)
-    order, created = Order.objects.get_or_create(status='pending')
-    request.session['cart_id'] = order.id  # Сохраняем ID заказа в сессии
-    # Получаем товар
-    item = get_object_or_404(Item, pk=item_id)
+    item = get_item_or_404(item_id)
+    quantity = int(request.POST.get('quantity', 1))
+    if quantity < 1:
+        return JsonResponse({'error': 'Количество должно быть положительным'}, status=400)
+
+    store = get_cart_store(request)
+    try:
+        store.add(item, quantity)
+    except CartLimitError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return store.commit(JsonResponse({'message': 'Товар добавлен в корзину!'}, status=200))
+
+
+def _cart_payload(cart):
+    return {
+        'order_id': cart.order_id,
+        'currency': cart.currency,
+        'lines': [
+            {
+                'item_id': line.item_id,
+                'name': line.name,
+                'quantity': line.quantity,
+                'unit_price': str(line.unit_price),
+                'line_total': str(line.line_total),
+            }
+            for line in cart.lines
+        ],
+        'discounts': [{'rate': str(discount.rate), 'amount': str(discount.amount)} for discount in cart.discounts],
+        'taxes': [{'rate': str(tax.rate), 'amount': str(tax.amount)} for tax in cart.taxes],
+        'subtotal': str(cart.subtotal),
+        'total': str(cart.total),
+    }
 
-    # Проверяем, есть ли уже такой товар в заказе
-    order_item, created = OrderItem.objects.get_or_create(order=order, item=item)
 
-    if not created:
-        # Если товар уже в заказе, увеличиваем количество
-        order_item.quantity += int(request.POST.get('quantity', 1))
-        order_item.save()
-    else:
-        # Если товара еще нет в заказе, устанавливаем начальное количество
-        order_item.quantity = int(request.POST.get('quantity', 1))
-        order_item.save()
+@require_POST
+def update_cart(request):
+    """
+    Пакетное изменение корзины: {"operations": [{"item_id": 1, "op": "add|set|remove", "quantity": 2}, ...]}
+
+    Товары загружаются одним запросом, все операции применяются одной транзакцией,
+    в ответе - новая сводка корзины.
+    """
+    try:
+        serializer = CartBatchSerializer(data=JSONParser().parse(request))
+    except ParseError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    operations = serializer.validated_data['operations']
 
-    # Обновляем общую стоимость заказа
-    order.calculate_total_price()
+    wanted = {operation['item_id'] for operation in operations if operation['op'] != 'remove'}
+    missing = sorted(wanted - set(get_items(wanted)))
+    if missing:
+        return JsonResponse({'error': 'Товары не найдены', 'item_ids': missing}, status=400)
 
-    return JsonResponse({'message': 'Товар добавлен в корзину!'}, status=200)
+    store = get_cart_store(request)
+    try:
+        cart = store.apply(operations)
+    except CartLimitError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return store.commit(JsonResponse(_cart_payload(cart)))
+
+
+def _cart_etag(request, state):
+    # В странице корзины есть CSRF-токен и ключи Stripe: их смена тоже меняет ETag
+    keys = [load_config(path='.env', currency=currency).stripe.publishable_key for currency in CURRENCIES]
+    return _etag('cart', state, request.META.get('CSRF_COOKIE', ''), *keys)
+
+
+def _cart_last_modified(state):
+    _, updated_at, lines = state
+    if updated_at is None:
+        return None
+    return int(max([updated_at, *[line[2] for line in lines]]).timestamp())
 
 
 def cart_view(request):
     """
     Функция просмотра корзины заказов
-    """
-    order, created = Order.objects.get_or_create(status='pending')
 
-    # Определение валюты на основе товаров в корзине (например, валюта первого товара)
-    if order.order_items.exists():
-        currency = order.order_items.first().item.currency
-    else:
-        currency = 'USD'  # Значение по умолчанию, если корзина пуста
-
-    # Загрузка конфигурации Stripe в зависимости от валюты
-    config = load_config(path='.env', currency=currency)
+    Валидаторы - updated_at заказа и набор строк с версиями товаров. На условный запрос они
+    читаются одним запросом, и если корзина не менялась, ответ 304 отдается без расчета сводки
+    и рендеринга; для обычного запроса они берутся из уже загруженной корзины.
+    """
+    # Просмотр корзины не создает заказ: без корзины показывается пустая сводка
+    store = get_cart_store(request)
+    if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+        state = store.state()
+        last_modified = _cart_last_modified(state)
+        etag = _cart_etag(request, state)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            patch_cache_control(response, private=True)
+            return store.commit(_with_validators(response, etag, last_modified))
+
+    # Вся корзина считается заранее, шаблон только отображает готовые суммы
+    cart = store.summary()
+
+    # Загрузка конфигурации Stripe в зависимости от валюты корзины
+    config = load_config(path='.env', currency=cart.currency)
 
     context = {
-        'order': order,
+        'order': store.get_order(),
+        'cart': cart,
         'stripe_public_key': config.stripe.publishable_key  # Используйте ключ из StripeConfig
     }
-    return render(request, 'cart.html', context)
+    response = render(request, 'cart.html', context)
+    # Состояние - из загруженной корзины, ETag - после рендеринга: он мог выпустить новый CSRF-токен
+    state = store.state()
+    patch_cache_control(response, private=True)
+    # Корзина оплаченного заказа очищается при просмотре: сохраняем это
+    return store.commit(_with_validators(response, _cart_etag(request, state), _cart_last_modified(state)))
 
 
-def checkout_order(request, order_id):
+async def checkout_order(request, order_id=None):
     """
     функция используется для создания сессии оплаты с помощью Stripe Checkout
     на основе товаров в заказе, включая расчет общей стоимости с учетом скидок и налогов, и указывает URL
-    для успешного и отмененного платежей.
+    для успешного и отмененного платежей. Без order_id заказ создается из корзины посетителя.
     """
-    order = get_object_or_404(Order, pk=order_id)
-    # Убедитесь, что общая стоимость заказа рассчитана
-    order.calculate_total_price()
+    if order_id is None:
+        return await _with_cart_order(request, checkout_order)
+    order = await _aget_object_or_404(Order, pk=order_id)
+    # Заказ загружается один раз, скидки и налоги распределяются по строкам за один проход
+    cart = await abuild_cart_summary(order)
+    pricing = price_checkout(cart)
+    await sync_to_async(order.calculate_total_price)(totals=cart.totals)
 
-    try:
-        # Создание line_items на основе товаров в заказе
-        line_items = [{
-            'price_data': {
-                'currency': order.currency,
-                'product_data': {
-                    'name': item.item.name,
-                },
-                'unit_amount': int(item.get_cost() * 100),
-            },
-            'quantity': item.quantity,
-        } for item in order.order_items.all()]
-
-        # Расчет общей суммы скидки и налога
-        discount_total = sum(discount.amount for discount in order.discount_set.all())
-        tax_total = sum(((item.get_cost() - discount_total / order.order_items.count()) * tax.rate / 100) for item in
-                        order.order_items.all() for tax in order.tax_set.all())
-
-        # Добавление информации о скидках в line_items
-        if discount_total > 0:
-            line_items.append({
-                'price_data': {
-                    'currency': order.currency,
-                    'product_data': {
-                        'name': 'Discount',
-                    },
-                    'unit_amount': -int(discount_total * 100),
-                },
-                'quantity': 1,
-            })
-
-        # Добавление информации о налогах в line_items
-        if tax_total > 0:
-            line_items.append({
-                'price_data': {
-                    'currency': order.currency,
-                    'product_data': {
-                        'name': 'Tax',
-                    },
-                    'unit_amount': int(tax_total * 100),
-                },
-                'quantity': 1,
-            })
+    # stripe SDK загружается при первом платеже, а не при старте воркера
+    from .stripe_clients import get_async_stripe_client
 
+    try:
         # Создание сессии оплаты для Stripe Checkout
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await get_async_stripe_client(pricing.currency).create_checkout_session(
             payment_method_types=['card'],
-            line_items=line_items,
+            line_items=pricing.line_items(),
             mode='payment',
+            # По ним вебхук checkout.session.completed находит оплаченный заказ
+            client_reference_id=str(order.pk),
+            metadata={'order_id': order.pk},
             success_url=request.build_absolute_uri(reverse('payment_success')),
             cancel_url=request.build_absolute_uri(reverse('payment_cancel')),
         )
@@ -172,53 +434,58 @@ def checkout_order(request, order_id):
         return JsonResponse({'error': str(e)}, status=400)
 
 
-@csrf_exempt
-def create_checkout_session(request, item_id):
+@async_csrf_exempt
+async def create_checkout_session(request, item_id):
     """
     Используется для создания PaymentIntent с помощью Stripe для определенного товара,
     возвращая клиентский секрет (clientSecret) для последующего оформления платежа.
     """
-    item = get_object_or_404(Item, pk=item_id)
+    item = await aget_item_or_404(item_id)
     try:
-        # Создаем PaymentIntent вместо Session
-        payment_intent = stripe.PaymentIntent.create(
-            amount=int(item.price * 100),  # Умножаем на 100, так как Stripe использует центы
+        # Создаем PaymentIntent вместо Session; повторные нажатия в рамках сессии получают тот же PaymentIntent
+        payment_intent = await acquire_payment_intent(
+            f'item:{item.id}:session:{await _asession_key(request)}',
             currency=item.currency,
+            amount=item.price_minor,  # Stripe принимает суммы в центах
             metadata={'item_id': item_id}
         )
-        return JsonResponse({'clientSecret': payment_intent['client_secret']})
+        return JsonResponse({'clientSecret': payment_intent.client_secret})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
 
-@csrf_exempt
-def create_checkout_session_for_order(request, order_id):
+@async_csrf_exempt
+async def create_checkout_session_for_order(request, order_id=None):
     """
     используется для создания PaymentIntent с помощью Stripe для определенного заказа,
     возвращая клиентский секрет (client_secret) для последующего оформления платежа.
     Функция также учитывает общую стоимость заказа, скидки и налоги, а также предоставляет
     опцию для сохранения данных карты для будущих платежей (setup_future_usage='off_session').
+    Без order_id заказ создается из корзины посетителя.
     """
-    order = get_object_or_404(Order, pk=order_id)
+    if order_id is None:
+        return await _with_cart_order(request, create_checkout_session_for_order)
+    order = await _aget_object_or_404(Order, pk=order_id)
+    cart = await abuild_cart_summary(order)
 
-    if not order.order_items.exists():
+    if not cart.lines:
         return JsonResponse({'error': 'Заказ пуст'}, status=400)
 
     # Предположим, что валюта заказа определяется по первому товару в заказе.
-    currency = order.order_items.first().item.currency
-    config = load_config(path='.env', currency=currency)
-    stripe.api_key = config.stripe.secret_key
+    currency = cart.currency
 
-    # Рассчитываем общую стоимость, скидки и налоги.
-    order.calculate_total_price()
-    total_amount = int(order.total_price * 100)  # Общая стоимость в центах.
+    # Рассчитываем общую стоимость, скидки и налоги тем же расчетом, что и в checkout_order.
+    pricing = price_checkout(cart)
+    await sync_to_async(order.calculate_total_price)(totals=cart.totals)
+    total_amount = pricing.total_minor  # Общая стоимость в центах.
 
     try:
-        # Создаем PaymentIntent вместо Checkout Session
-        payment_intent = stripe.PaymentIntent.create(
+        # Создаем PaymentIntent вместо Checkout Session; для заказа он переиспользуется, пока не оплачен
+        payment_intent = await acquire_payment_intent(
+            f'order:{order.id}',
             amount=total_amount,
             currency=currency,
-            metadata={'order_id': order_id},
+            metadata={'order_id': order.pk},
             setup_future_usage='off_session'  # Опция для сохранения данных карты для будущих платежей
 
         )
@@ -227,21 +494,21 @@ def create_checkout_session_for_order(request, order_id):
         return JsonResponse({'error': str(e)}, status=400)
 
 
-@csrf_exempt
-def create_payment_intent(request, item_id):
+@async_csrf_exempt
+async def create_payment_intent(request, item_id):
     """
      используется для создания PaymentIntent с помощью Stripe для определенного товара,
      возвращая клиентский секрет (client_secret) для последующего оформления платежа.
      Функция также учитывает сумму товара, валюту и предоставляет опцию для сохранения
      данных карты для будущих платежей (setup_future_usage='off_session').
     """
-    item = get_object_or_404(Item, pk=item_id)
-    stripe.api_key = config.stripe.secret_key  # Замените на ваш реальный ключ
+    item = await aget_item_or_404(item_id)
 
     try:
         # Создание PaymentIntent с сохранением способа оплаты для будущего использования
-        payment_intent = stripe.PaymentIntent.create(
-            amount=int(item.price * 100),  # Stripe работает с суммами в центах
+        payment_intent = await acquire_payment_intent(
+            f'item-off-session:{item.id}:session:{await _asession_key(request)}',
+            amount=item.price_minor,  # Stripe работает с суммами в центах
             currency=item.currency,
             metadata={'item_id': item.id},
             setup_future_usage='off_session'  # Опция для сохранения данных карты для будущих платежей
@@ -255,19 +522,9 @@ def clear_cart(request):
     """
     Очистка корзины заказов
     """
-    order_id = request.session.get('cart_id')
-    if order_id:
-        try:
-            order = Order.objects.get(id=order_id, status='pending')
-            order.order_items.all().delete()
-            order.total_price = 0
-            order.save()
-            del request.session['cart_id']  # Удаляем 'cart_id' из сессии
-        except Order.DoesNotExist:
-            print("Заказ не найден")
-    else:
-        print("ID заказа не найден в сессии")
-    return redirect('cart_view')
+    store = get_cart_store(request)
+    store.clear()
+    return store.commit(redirect('cart_view'))
 
 # def create_stripe_session(request, id):
 #     # Получение товара по ID
@@ -0,0 +1,125 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, PaymentIntentRecord, WebhookEvent
+
+# Статус заказа, в который переводит событие Stripe
+ORDER_STATUS_EVENTS = {
+    'payment_intent.succeeded': 'paid',
+    'checkout.session.completed': 'paid',
+    'checkout.session.async_payment_succeeded': 'paid',
+    'charge.refunded': 'refunded',
+}
+# Заказ двигается только вперед: событие, доставленное позже более нового, статус не откатывает
+ORDER_STATUS_FLOW = ('pending', 'paid', 'refunded')
+
+
+class InvalidWebhook(ValueError):
+    pass
+
+
+def record_event(payload, signature, secret):
+    """
+    Проверяет подпись события и сохраняет его во входящий ящик одним INSERT.
+    Повторная доставка уже сохраненного события игнорируется. Возвращает id события.
+    """
+    if not secret:
+        raise InvalidWebhook('Секрет вебхука не задан')
+    # stripe SDK загружается с первым вебхуком, а не при старте воркера
+    import stripe
+
+    try:
+        stripe.WebhookSignature.verify_header(
+            payload.decode('utf-8'), signature or '', secret, settings.STRIPE_WEBHOOK['TOLERANCE'],
+        )
+        event = json.loads(payload)
+        event_id, event_type = event['id'], event['type']
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError, ValueError, TypeError, KeyError) as e:
+        raise InvalidWebhook(str(e) or 'Некорректное событие') from e
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event_id, type=event_type, payload=event)], ignore_conflicts=True,
+    )
+    return event_id
+
+
+def _event_object(event):
+    return (event.get('data') or {}).get('object') or {}
+
+
+def _payment_intent_id(event_type, obj):
+    if event_type.startswith('payment_intent.'):
+        return obj.get('id')
+    return obj.get('payment_intent')
+
+
+def _order_id(obj):
+    # Checkout Session дублирует id заказа в client_reference_id
+    for value in ((obj.get('metadata') or {}).get('order_id'), obj.get('client_reference_id')):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _orders_by_payment_intent(intent_ids):
+    """
+    Заказы по id PaymentIntent из записей PaymentIntentRecord (scope_key 'order:<id>:<валюта>')
+    """
+    orders = {}
+    records = PaymentIntentRecord.objects.filter(stripe_id__in=intent_ids, scope_key__startswith='order:')
+    for stripe_id, scope_key in records.values_list('stripe_id', 'scope_key'):
+        orders[stripe_id] = int(scope_key.split(':')[1])
+    return orders
+
+
+def process_batch(batch_size=None):
+    """
+    Обрабатывает очередную пачку необработанных событий одной транзакцией и возвращает их число.
+
+    Из нескольких событий для одного заказа или PaymentIntent применяется самое позднее,
+    статусы меняются bulk-запросами: по одному UPDATE на каждый новый статус.
+    """
+    batch_size = batch_size or settings.STRIPE_WEBHOOK['BATCH_SIZE']
+    with transaction.atomic():
+        events = list(WebhookEvent.objects.filter(processed_at__isnull=True).order_by('id')[:batch_size])
+        if not events:
+            return 0
+
+        # Дубликаты по id события отсекает уникальный индекс при записи
+        order_events, intent_statuses, unresolved = {}, {}, {}
+        for event in sorted(events, key=lambda event: (event.payload.get('created') or 0, event.pk)):
+            obj = _event_object(event.payload)
+            intent_id = _payment_intent_id(event.type, obj)
+            if event.type.startswith('payment_intent.') and intent_id and obj.get('status'):
+                intent_statuses[intent_id] = obj['status']
+
+            status = ORDER_STATUS_EVENTS.get(event.type)
+            if status is None or (event.type.startswith('checkout.session.') and obj.get('payment_status') != 'paid'):
+                continue
+            order_id = _order_id(obj)
+            if order_id is not None:
+                order_events[order_id] = status
+            elif intent_id:
+                unresolved[intent_id] = status
+
+        if unresolved:
+            for intent_id, order_id in _orders_by_payment_intent(unresolved).items():
+                order_events.setdefault(order_id, unresolved[intent_id])
+
+        now = timezone.now()
+        for status in ORDER_STATUS_FLOW[1:]:
+            order_ids = [order_id for order_id, target in order_events.items() if target == status]
+            if order_ids:
+                previous = ORDER_STATUS_FLOW[:ORDER_STATUS_FLOW.index(status)]
+                Order.objects.filter(pk__in=order_ids, status__in=previous).update(status=status, updated_at=now)
+        for status in set(intent_statuses.values()):
+            PaymentIntentRecord.objects.filter(
+                stripe_id__in=[intent_id for intent_id, target in intent_statuses.items() if target == status],
+            ).update(status=status, updated_at=now)
+
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=now)
+    return len(events)